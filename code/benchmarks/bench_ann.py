@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+IVF 近似搜索基准测试
+
+对比精确搜索与 search(..., exact=False) 在不同 nprobe 下的
+单次查询耗时和 recall@k（以精确搜索结果为基准）：
+    python benchmarks/bench_ann.py --docs 50000 --queries 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import CHARS
+
+
+def make_topic_documents(count, topics=64, length=200, seed=42):
+    """生成按主题聚集的随机中文文档（每个主题只用一部分常用字）"""
+    rng = random.Random(seed)
+    vocab = [rng.sample(CHARS, 12) for _ in range(topics)]
+    documents = []
+    for i in range(count):
+        words = vocab[rng.randrange(topics)]
+        documents.append(
+            f"第{i}段：" + "".join(rng.choice(words) for _ in range(length))
+        )
+    return documents
+
+
+def run_queries(db, queries, k, **kwargs):
+    start = time.perf_counter()
+    results = [
+        [r["id"] for r in db.search("paragraphs", q, n=k, **kwargs)] for q in queries
+    ]
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB IVF 近似搜索基准")
+    parser.add_argument("--docs", type=int, default=50000, help="文档数量")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("-k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="探查簇数"
+    )
+    args = parser.parse_args()
+
+    documents = make_topic_documents(args.docs)
+    rng = random.Random(7)
+    queries = [rng.choice(documents)[8:60] for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path)
+        start = time.perf_counter()
+        db.add_many("paragraphs", documents)
+        print(f"导入 + 建索引: {time.perf_counter() - start:.2f} s")
+        print(f"簇数: {len(db._ivf['paragraphs'].centroids)}")
+
+        exact, exact_time = run_queries(db, queries, args.k)
+        print(f"{'exact':>10}: 查询 {exact_time * 1000:7.2f} ms")
+
+        for nprobe in args.nprobe:
+            db.nprobe = nprobe
+            results, elapsed = run_queries(db, queries, args.k, exact=False)
+            recall = sum(
+                len(set(r) & set(e)) / len(e) for r, e in zip(results, exact)
+            ) / len(queries)
+            print(
+                f"nprobe={nprobe:>3}: 查询 {elapsed * 1000:7.2f} ms  "
+                f"recall@{args.k} {recall:.4f}  加速 {exact_time / elapsed:5.1f}x"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
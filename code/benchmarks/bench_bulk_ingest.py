@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+批量导入基准测试
+
+对比最初版本（每条都 np.vstack 整个向量矩阵并重写 data.json / vectors.npy）、
+当前逐条 add() 与一次 add_many() 导入 N 篇文档的耗时：
+    python benchmarks/bench_bulk_ingest.py --docs 10000 --baseline-docs 300
+
+最初版本的单条耗时随已有文档数线性增长（总耗时平方增长），导入 N 篇要很久，
+因此只实测前 --baseline-docs 篇，按单条耗时的线性拟合估算导入 N 篇的总耗时。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+
+CHARS = "叶尘林诗雨苏晴王腾江城燕京昆仑超能进化系统时空之刃血脉觉醒黑暗议会深渊之门"
+
+
+def make_documents(count, length=120, seed=42):
+    """生成随机中文文档"""
+    rng = random.Random(seed)
+    return [
+        f"第{i}条设定：" + "".join(rng.choice(CHARS) for _ in range(length))
+        for i in range(count)
+    ]
+
+
+class BaselineVectorDB:
+    """最初版本 SimpleVectorDB 的写入路径：稠密向量 + 每条 add 重写全部数据"""
+
+    def __init__(self, persist_directory):
+        self.data_file = os.path.join(persist_directory, "data.json")
+        self.vectors_file = os.path.join(persist_directory, "vectors.npy")
+        self.data = []
+        self.vectors = np.array([])
+
+    def save_data(self):
+        with open(self.data_file, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+
+        if len(self.vectors) > 0:
+            np.save(self.vectors_file, self.vectors)
+
+    def add(self, collection, document, metadata=None):
+        # 延迟导入：bench_embedding 本身也从本模块导入 make_documents
+        from bench_embedding import legacy_embedding
+
+        embedding = legacy_embedding(document)
+        self.data.append(
+            {
+                "collection": collection,
+                "document": document,
+                "metadata": metadata or {},
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+        if len(self.vectors) == 0:
+            self.vectors = embedding.reshape(1, -1)
+        else:
+            self.vectors = np.vstack([self.vectors, embedding])
+        self.save_data()
+        return len(self.data) - 1
+
+
+def bench_baseline(documents, total):
+    """实测最初版本逐条导入 documents 的耗时，并估算导入 total 篇的总耗时"""
+    times = []
+    with tempfile.TemporaryDirectory() as path:
+        db = BaselineVectorDB(path)
+        for i, doc in enumerate(documents):
+            start = time.perf_counter()
+            db.add("world", doc, {"index": i})
+            times.append(time.perf_counter() - start)
+
+    # 第 k 条的耗时约为 a + b * k，导入 total 篇约为 a * total + b * total² / 2
+    slope, intercept = np.polyfit(np.arange(len(times)), times, 1)
+    estimate = intercept * total + slope * total * (total - 1) / 2
+    return sum(times), estimate
+
+
+def bench_single(documents):
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path)
+        start = time.perf_counter()
+        for i, doc in enumerate(documents):
+            db.add("world", doc, {"index": i})
+        elapsed = time.perf_counter() - start
+        db.close()
+    return elapsed
+
+
+def bench_batch(documents):
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path)
+        start = time.perf_counter()
+        db.add_many("world", documents, [{"index": i} for i in range(len(documents))])
+        elapsed = time.perf_counter() - start
+        db.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 批量导入基准")
+    parser.add_argument("--docs", type=int, default=10000, help="文档数量")
+    parser.add_argument(
+        "--baseline-docs", type=int, default=300, help="最初版本实测的文档数"
+    )
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs)
+
+    measured = min(args.baseline_docs, args.docs)
+    baseline, estimate = bench_baseline(documents[:measured], args.docs)
+    single = bench_single(documents)
+    batch = bench_batch(documents)
+
+    print(f"文档数: {args.docs}")
+    print(
+        f"最初版本 add(): {baseline:8.2f}s（前 {measured} 篇实测），"
+        f"导入 {args.docs} 篇估算 {estimate:8.1f}s"
+    )
+    print(
+        f"逐条 add():    {single:8.2f}s  ({args.docs / single:8.0f} 篇/秒，"
+        f"比最初版本快 {estimate / single:.0f}x)"
+    )
+    print(
+        f"add_many():    {batch:8.2f}s  ({args.docs / batch:8.0f} 篇/秒，"
+        f"比逐条 add() 快 {single / batch:.1f}x，比最初版本快 {estimate / batch:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
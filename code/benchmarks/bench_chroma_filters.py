@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 过滤下推基准测试
+
+写入 N 章的章节摘要、人物和伏笔后，对比最初「取回整个集合再在 Python 里过滤」
+的实现与当前 where 过滤 + include 字段投影的 ChromaReader 查询耗时：
+    python benchmarks/bench_chroma_filters.py --chapters 2000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_client import close_client, get_client
+from chroma_reader import ChromaReader
+from chroma_writer import ChromaWriter
+from bench_bulk_ingest import make_documents
+from bench_chroma_ingest import HashEmbedding
+
+
+def legacy_character_by_chapter(client, chapter):
+    """最初版本：取回全部人物后按章节号过滤"""
+    results = client.get(collection_name="characters")
+    return [
+        results["ids"][i]
+        for i, meta in enumerate(results["metadatas"])
+        if meta.get("chapter") == chapter
+    ]
+
+
+def legacy_foreshadowing_by_chapter(client, chapter):
+    """最初版本：取回全部伏笔后按埋入 / 回收章节过滤"""
+    results = client.get(collection_name="foreshadowing")
+    return [
+        results["ids"][i]
+        for i, meta in enumerate(results["metadatas"])
+        if meta.get("embed_chapter") == chapter
+        or meta.get("recover_chapter") == chapter
+    ]
+
+
+def legacy_recent_chapters(client, n):
+    """最初版本：取回全部章节（含正文）后排序"""
+    results = client.get(collection_name="chapters")
+    chapters = sorted(
+        zip(results["ids"], results["metadatas"]),
+        key=lambda x: x[1].get("chapter", 0),
+        reverse=True,
+    )
+    return [doc_id for doc_id, _ in chapters[:n]]
+
+
+def best_of(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma 过滤下推基准")
+    parser.add_argument("--chapters", type=int, default=2000, help="章节数")
+    args = parser.parse_args()
+
+    summaries = make_documents(args.chapters, length=300)
+    chapter = args.chapters - 10
+
+    with tempfile.TemporaryDirectory() as path:
+        client = get_client(path, embedding_function=HashEmbedding())
+        with ChromaWriter(path, batch_size=1000) as writer:
+            for i, summary in enumerate(summaries, 1):
+                writer.add_chapter_summary(i, summary, {"title": f"第{i}章"})
+                writer.add_character(f"人物{i}", summary[:60], i, "配角")
+                writer.add_foreshadowing(f"伏笔{i}", summary[-60:], i, i + 20)
+
+        reader = ChromaReader(path)
+        cases = (
+            (
+                "get_character_by_chapter",
+                lambda: legacy_character_by_chapter(client, chapter),
+                lambda: reader.get_character_by_chapter(chapter),
+            ),
+            (
+                "get_foreshadowing_by_chapter",
+                lambda: legacy_foreshadowing_by_chapter(client, chapter),
+                lambda: reader.get_foreshadowing_by_chapter(chapter),
+            ),
+            (
+                "get_recent_chapters(3)",
+                lambda: legacy_recent_chapters(client, 3),
+                lambda: reader.get_recent_chapters(3),
+            ),
+        )
+
+        print(f"章节数: {args.chapters}")
+        for label, legacy, current in cases:
+            before = best_of(legacy)
+            after = best_of(current)
+            print(
+                f"{label:<30} 全量取回 {before * 1000:8.1f} ms  "
+                f"过滤下推 {after * 1000:8.1f} ms  ({before / after:.1f}x)"
+            )
+        close_client(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 批量写入基准测试
+
+对比 ChromaWriter 逐条写入与 batch_size 批量写入 N 个人物设定的吞吐量。
+为了离线运行，使用按字符哈希的简单向量化函数代替 Chroma 默认模型
+（真实模型每次调用的固定开销更大，批量的收益也更大）：
+    python benchmarks/bench_chroma_ingest.py --docs 500 --batch-size 256
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from chromadb import EmbeddingFunction
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_client import close_client, get_client
+from chroma_writer import ChromaWriter
+from bench_bulk_ingest import make_documents
+
+
+class HashEmbedding(EmbeddingFunction):
+    """字符码位取模计数的 64 维向量"""
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        return [
+            np.bincount([ord(c) % 64 for c in text], minlength=64).astype(np.float32)
+            for text in input
+        ]
+
+    @staticmethod
+    def name():
+        return "bench-hash"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbedding()
+
+
+def ingest(documents, batch_size):
+    with tempfile.TemporaryDirectory() as path:
+        get_client(path, embedding_function=HashEmbedding())
+        start = time.perf_counter()
+        with ChromaWriter(path, batch_size=batch_size) as writer:
+            for i, document in enumerate(documents):
+                writer.add_character(f"人物{i}", document, i % 500 + 1, "配角")
+        elapsed = time.perf_counter() - start
+        close_client(path)
+    return elapsed, writer.batch_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma 批量写入基准")
+    parser.add_argument("--docs", type=int, default=500, help="人物数量")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批条数")
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs)
+    single, _ = ingest(documents, None)
+    batch, stats = ingest(documents, args.batch_size)
+
+    print(f"人物数: {args.docs}")
+    print(f"逐条写入:          {single:7.2f} s  ({args.docs / single:7.0f} 条/秒)")
+    print(
+        f"batch_size={args.batch_size:<5}: {batch:7.2f} s  "
+        f"({args.docs / batch:7.0f} 条/秒，{single / batch:.1f}x)"
+    )
+    seconds = [s["seconds"] for s in stats]
+    print(
+        f"共 {len(stats)} 批，每批平均 {np.mean(seconds) * 1000:.1f} ms，"
+        f"最慢 {max(seconds) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
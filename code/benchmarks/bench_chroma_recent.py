@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+最近章节查询基准测试
+
+对比不同章节数下 ChromaReader.get_recent_chapters(3) 整表扫描（没有最新章节指针）
+与按最新章节指针范围查询的耗时：
+    python benchmarks/bench_chroma_recent.py --chapters 500 2000 5000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_client import close_client, get_client
+from chroma_reader import ChromaReader
+from chroma_writer import ChromaWriter
+from bench_bulk_ingest import make_documents
+from bench_chroma_ingest import HashEmbedding
+
+
+def best_of(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(chapters, n):
+    summaries = make_documents(chapters, length=300)
+    with tempfile.TemporaryDirectory() as path:
+        get_client(path, embedding_function=HashEmbedding())
+        with ChromaWriter(path, batch_size=1000) as writer:
+            for i, summary in enumerate(summaries, 1):
+                writer.add_chapter_summary(i, summary, {"title": f"第{i}章"})
+
+        reader = ChromaReader(path)
+        expected = [c["id"] for c in reader._scan_recent_chapters(n)]
+        assert [c["id"] for c in reader.get_recent_chapters(n)] == expected
+
+        scan = best_of(lambda: reader._scan_recent_chapters(n))
+        pointer = best_of(lambda: reader.get_recent_chapters(n))
+        close_client(path)
+    return scan, pointer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="最近章节查询基准")
+    parser.add_argument(
+        "--chapters", type=int, nargs="+", default=[500, 2000, 5000], help="章节数"
+    )
+    parser.add_argument("-n", type=int, default=3, help="取最近几章")
+    args = parser.parse_args()
+
+    for chapters in args.chapters:
+        scan, pointer = bench(chapters, args.n)
+        print(
+            f"章节数 {chapters:>5}: 整表扫描 {scan * 1000:7.1f} ms  "
+            f"指针范围查询 {pointer * 1000:6.1f} ms  ({scan / pointer:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
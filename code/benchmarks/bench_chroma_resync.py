@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 增量重新同步基准测试
+
+模拟重新运行整部小说的章节钩子：首次全量写入 N 章的章节摘要、人物和伏笔，
+然后在内容不变、以及约 5% 章节改动的情况下再次全部写入，
+对比耗时和实际向量化的文档数：
+    python benchmarks/bench_chroma_resync.py --chapters 500
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_client import close_client, get_client
+from chroma_writer import ChromaWriter
+from bench_bulk_ingest import make_documents
+from bench_chroma_ingest import HashEmbedding
+
+
+class CountingEmbedding(HashEmbedding):
+    """记录向量化过的文本条数"""
+
+    embedded = 0
+
+    def __call__(self, input):
+        CountingEmbedding.embedded += len(input)
+        return super().__call__(input)
+
+
+def sync(path, summaries, batch_size):
+    """写入全部章节；返回 (耗时, 向量化条数, 新增/更新/跳过条数)"""
+    CountingEmbedding.embedded = 0
+    start = time.perf_counter()
+    with ChromaWriter(path, batch_size=batch_size) as writer:
+        for chapter, summary in enumerate(summaries, 1):
+            writer.add_chapter_summary(chapter, summary, {"title": f"第{chapter}章"})
+            writer.add_character(f"人物{chapter}", summary[:60], chapter, "配角")
+            writer.add_foreshadowing(
+                f"伏笔{chapter}", summary[-60:], chapter, chapter + 20
+            )
+    elapsed = time.perf_counter() - start
+
+    totals = {"added": 0, "updated": 0, "unchanged": 0}
+    for stats in writer.batch_stats:
+        for key in totals:
+            totals[key] += stats[key]
+    return elapsed, CountingEmbedding.embedded, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma 增量重新同步基准")
+    parser.add_argument("--chapters", type=int, default=500, help="章节数")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批条数")
+    args = parser.parse_args()
+
+    summaries = make_documents(args.chapters, length=300)
+    changed = list(summaries)
+    for i in range(0, args.chapters, 20):
+        changed[i] = changed[i] + "（修订）"
+
+    with tempfile.TemporaryDirectory() as path:
+        get_client(path, embedding_function=CountingEmbedding())
+        for label, data in (
+            ("首次写入", summaries),
+            ("原样重跑", summaries),
+            ("5% 改动", changed),
+        ):
+            elapsed, embedded, totals = sync(path, data, args.batch_size)
+            print(
+                f"{label}: {elapsed:6.2f} s  向量化 {embedded:5d} 条  "
+                f"新增 {totals['added']} / 更新 {totals['updated']} / "
+                f"跳过 {totals['unchanged']}"
+            )
+        close_client(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 钩子启动耗时基准测试
+
+example.py 中每章的钩子会创建 ChromaWriter、ChromaUpdater 和 ContextBuilder。
+对比每个读写器各自打开 ChromaClient 与通过 get_client() 共享客户端时，
+每章钩子的启动耗时：
+    python benchmarks/bench_chroma_startup.py --chapters 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from chromadb.api.shared_system_client import SharedSystemClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_client import ChromaClient, close_client
+from chroma_reader import ContextBuilder
+from chroma_writer import ChromaWriter, ChromaUpdater
+
+
+def separate_clients(path):
+    """改动前：每个读写器各自打开客户端"""
+    for _ in range(3):
+        ChromaClient(path)
+
+
+def shared_clients(path):
+    ChromaWriter(path)
+    ChromaUpdater(path)
+    ContextBuilder(path)
+
+
+def bench(hook, path, chapters):
+    start = time.perf_counter()
+    hook(path)
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(chapters):
+        hook(path)
+    return first, (time.perf_counter() - start) / chapters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma 钩子启动耗时基准")
+    parser.add_argument("--chapters", type=int, default=50, help="模拟的章节数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        # 先建好 collections，只比较打开已有数据库的耗时
+        ChromaClient(path).close()
+
+        for label, hook in (
+            ("独立客户端", separate_clients),
+            ("共享客户端", shared_clients),
+        ):
+            # 清掉 chromadb 内部缓存的系统实例，两种方式都从冷启动开始
+            SharedSystemClient.clear_system_cache()
+            first, per_hook = bench(hook, path, args.chapters)
+            print(
+                f"{label}: 首次 {first * 1000:8.2f} ms  "
+                f"之后每章 {per_hook * 1000:8.3f} ms"
+            )
+        close_client()
+
+
+if __name__ == "__main__":
+    main()
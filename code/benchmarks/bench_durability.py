@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+持久化开销基准测试
+
+在已有 N 篇文档的库上逐条 add()，对比每次写入后整库重写快照
+（save_data）与预写日志在不同 sync_interval 下的单次写入耗时：
+    python benchmarks/bench_durability.py --docs 20000 --writes 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import make_documents
+
+
+def bench(documents, writes, rewrite=False, **kwargs):
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path, ivf_min_rows=len(documents) + writes + 1, **kwargs)
+        db.add_many("world", documents)
+        db.compact()
+
+        start = time.perf_counter()
+        for i in range(writes):
+            db.add("world", f"新设定{i}", {"index": i})
+            if rewrite:
+                db.save_data()
+        db.close()
+        return (time.perf_counter() - start) / writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 持久化开销基准")
+    parser.add_argument("--docs", type=int, default=20000, help="已有文档数量")
+    parser.add_argument("--writes", type=int, default=200, help="逐条写入次数")
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs)
+    print(f"已有文档: {args.docs}，逐条写入: {args.writes}")
+
+    rewrite = bench(documents, min(args.writes, 20), rewrite=True)
+    print(f"每次重写快照:            {rewrite * 1000:8.2f} ms/次")
+    for interval in (0, 0.05, None):
+        elapsed = bench(documents, args.writes, sync_interval=interval)
+        print(
+            f"预写日志 sync_interval={str(interval):<5}: {elapsed * 1000:8.2f} ms/次  "
+            f"({rewrite / elapsed:6.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+混合检索基准测试
+
+在随机段落中埋入人名，对比纯向量搜索与 search(..., mode="hybrid")
+按人名查询时的单次耗时和 precision@k（结果中含有该人名的比例）：
+    python benchmarks/bench_hybrid.py --docs 50000 --queries 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import CHARS
+
+
+def make_named_documents(count, names, length=200, mention_rate=0.02, seed=42):
+    """生成随机中文段落，其中一部分在随机位置提到某个人名"""
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(count):
+        text = "".join(rng.choice(CHARS) for _ in range(length))
+        if rng.random() < mention_rate:
+            at = rng.randrange(length)
+            text = text[:at] + rng.choice(names) + text[at:]
+        documents.append(text)
+    return documents
+
+
+def run_queries(db, queries, k, **kwargs):
+    start = time.perf_counter()
+    results = [db.search("paragraphs", q, n=k, **kwargs) for q in queries]
+    elapsed = (time.perf_counter() - start) / len(queries)
+    precision = sum(
+        sum(q in r["document"] for r in rs) / k for q, rs in zip(queries, results)
+    ) / len(queries)
+    return elapsed, precision
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 混合检索基准")
+    parser.add_argument("--docs", type=int, default=50000, help="文档数量")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("-k", type=int, default=5, help="precision@k 的 k")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    names = ["".join(rng.sample(CHARS, rng.choice((2, 3)))) for _ in range(100)]
+    documents = make_named_documents(args.docs, names)
+    queries = [rng.choice(names) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path)
+        db.add_many("paragraphs", documents)
+
+        start = time.perf_counter()
+        db.search("paragraphs", queries[0], mode="hybrid")
+        print(f"建 BM25 索引: {time.perf_counter() - start:.2f} s")
+
+        for label, kwargs in (
+            ("exact", {}),
+            ("ivf", {"exact": False}),
+            ("hybrid", {"mode": "hybrid"}),
+        ):
+            elapsed, precision = run_queries(db, queries, args.k, **kwargs)
+            print(
+                f"{label:>8}: 查询 {elapsed * 1000:7.2f} ms  "
+                f"precision@{args.k} {precision:.3f}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
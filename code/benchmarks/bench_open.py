@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+打开数据库基准测试
+
+对比列式记录快照与早期 JSON 记录快照的打开耗时，以及打开后
+第一次按 chapter 查询的耗时：
+    python benchmarks/bench_open.py --docs 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import make_documents
+
+
+def bench_open(path):
+    start = time.perf_counter()
+    db = SimpleVectorDB(path)
+    opened = time.perf_counter() - start
+    start = time.perf_counter()
+    db.get_by_metadata("chapters", {"chapter": 7})
+    query = time.perf_counter() - start
+    db.close()
+    return opened, query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 打开耗时基准")
+    parser.add_argument("--docs", type=int, default=100000, help="文档数量")
+    parser.add_argument("--length", type=int, default=500, help="文档长度")
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, length=args.length)
+    with tempfile.TemporaryDirectory() as path:
+        db = SimpleVectorDB(path, ivf_min_rows=args.docs + 1)
+        db.add_many(
+            "chapters",
+            documents,
+            [{"chapter": i % 1000, "title": f"第{i}章"} for i in range(args.docs)],
+        )
+        db.compact()
+        records = list(db.data)
+        prefix = db._prefix("snapshot", db.generation)
+        db.close()
+
+        columnar = bench_open(path)
+
+        # 改写为早期的 JSON 记录快照
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.remove(prefix + ".ids.npy")
+        legacy = bench_open(path)
+
+    print(f"文档数: {args.docs}，文档长度: {args.length}")
+    for label, (opened, query) in (("JSON 快照", legacy), ("列式快照", columnar)):
+        print(
+            f"{label}: 打开 {opened * 1000:8.1f} ms  "
+            f"首次 chapter 查询 {query * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+并行向量化基准测试
+
+对比不同进程数下 add_many(..., workers=N) 导入长文档的耗时：
+    python benchmarks/bench_parallel_ingest.py --docs 20000 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import make_documents
+
+
+def bench(documents, workers):
+    with tempfile.TemporaryDirectory() as path:
+        # 不建 IVF 索引，只测向量化和写入
+        db = SimpleVectorDB(path, ivf_min_rows=len(documents) + 1)
+        start = time.perf_counter()
+        db.add_many("chapters", documents, workers=workers)
+        elapsed = time.perf_counter() - start
+        db.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 并行向量化基准")
+    parser.add_argument("--docs", type=int, default=20000, help="文档数量")
+    parser.add_argument("--length", type=int, default=2000, help="文档长度")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="进程数"
+    )
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, length=args.length)
+    print(f"文档数: {args.docs}，文档长度: {args.length}，CPU 核数: {os.cpu_count()}")
+
+    baseline = None
+    for workers in args.workers:
+        elapsed = bench(documents, workers)
+        baseline = baseline or elapsed
+        print(
+            f"workers={workers:>2}: {elapsed:7.2f}s  "
+            f"({args.docs / elapsed:8.0f} 篇/秒，加速 {baseline / elapsed:4.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
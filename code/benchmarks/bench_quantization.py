@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+向量存储类型基准测试
+
+对比 float64 / float32 / int8 三种存储方式的向量内存、冷启动耗时，
+以及相对 float64 基线的 recall@k：
+    python benchmarks/bench_quantization.py --docs 20000 --queries 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import make_documents
+
+DTYPES = ("float64", "float32", "int8")
+
+
+def vector_bytes(db):
+    matrix = db._matrix
+    return sum(
+        getattr(matrix, name).view.nbytes
+        for name in ("indptr", "indices", "values", "scales", "norms")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 量化存储基准")
+    parser.add_argument("--docs", type=int, default=20000, help="文档数量")
+    parser.add_argument("--length", type=int, default=400, help="文档长度")
+    parser.add_argument("--queries", type=int, default=200, help="查询数量")
+    parser.add_argument("-k", type=int, default=10, help="recall@k 的 k")
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, length=args.length)
+    rng = random.Random(7)
+    queries = [rng.choice(documents)[5:40] for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as root:
+        baseline = None
+        print(f"文档数: {args.docs}，查询数: {args.queries}，k = {args.k}")
+        for dtype in DTYPES:
+            path = os.path.join(root, dtype)
+            db = SimpleVectorDB(path, vector_dtype=dtype)
+            db.add_many("chapters", documents)
+            db.compact()
+            db.close()
+
+            start = time.perf_counter()
+            db = SimpleVectorDB(path, vector_dtype=dtype)
+            open_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = [
+                [r["id"] for r in db.search("chapters", q, n=args.k)] for q in queries
+            ]
+            query_time = (time.perf_counter() - start) / len(queries)
+
+            if baseline is None:
+                baseline = results
+            recall = sum(
+                len(set(r) & set(b)) / len(b) for r, b in zip(results, baseline)
+            ) / len(queries)
+
+            print(
+                f"{dtype:>8}: 向量 {vector_bytes(db) / 1e6:8.1f} MB  "
+                f"打开 {open_time * 1000:8.1f} ms  "
+                f"查询 {query_time * 1000:6.2f} ms  recall@{args.k} {recall:.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
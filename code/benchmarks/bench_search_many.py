@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+批量查询基准测试
+
+对比构建一次上下文时逐条 search() 与一次 search_many() 的耗时，
+以及精确搜索按行计算（读取全部候选行的非零元素）与按列计算
+（只读取查询非零列的倒排表）时不同长度查询的单次耗时：
+    python benchmarks/bench_search_many.py --docs 50000 --queries 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_vector_db
+from simple_vector_db import SimpleVectorDB
+from bench_bulk_ingest import make_documents
+
+
+def best_of(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDB 批量查询基准")
+    parser.add_argument("--docs", type=int, default=50000, help="文档数量")
+    parser.add_argument("--queries", type=int, default=10, help="每次上下文的查询数")
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, length=200)
+    rng = random.Random(7)
+    queries = [rng.choice(documents)[5:40] for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        # 只比较精确搜索，不建 IVF 索引
+        db = SimpleVectorDB(path, ivf_min_rows=args.docs + 1)
+        db.add_many("world", documents)
+
+        one = best_of(lambda: db.search("world", queries[0]))
+        loop = best_of(lambda: [db.search("world", q) for q in queries])
+        batch = best_of(lambda: db.search_many("world", queries))
+
+        latencies = []
+        for length in (5, 35, 60):
+            query = documents[123][10 : 10 + length]
+            by_column = best_of(lambda: db.search("world", query))
+            # 调高门槛，强制按行计算
+            threshold = simple_vector_db.COLUMN_INDEX_MIN_NNZ
+            simple_vector_db.COLUMN_INDEX_MIN_NNZ = 1 << 62
+            by_row = best_of(lambda: db.search("world", query))
+            simple_vector_db.COLUMN_INDEX_MIN_NNZ = threshold
+            latencies.append((length, by_row, by_column))
+        db.close()
+
+    print(f"文档数: {args.docs}，查询数: {args.queries}")
+    for length, by_row, by_column in latencies:
+        print(
+            f"{length:>2} 字查询 search(): 按行 {by_row * 1000:6.1f} ms  "
+            f"按列 {by_column * 1000:6.1f} ms  ({by_row / by_column:.1f}x)"
+        )
+    print(f"单条 search():        {one * 1000:8.1f} ms")
+    print(f"逐条 search() x {args.queries}:  {loop * 1000:8.1f} ms")
+    print(f"search_many():        {batch * 1000:8.1f} ms  ({loop / batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,63 @@ Chroma 向量数据库客户端
 
 import chromadb
 from chromadb.config import Settings
+import hashlib
+import json
 import os
+import threading
+
+# 进程内共享的客户端：persist_directory（绝对路径）→ ChromaClient
+_clients = {}
+_clients_lock = threading.Lock()
+
+# upsert 写入元数据的内部字段（正文和元数据的哈希），
+# ChromaClient.get / query 返回结果前去掉
+SYNC_PREFIX = "_sync_"
+CONTENT_HASH_KEY = SYNC_PREFIX + "content_hash"
+METADATA_HASH_KEY = SYNC_PREFIX + "metadata_hash"
+
+# 最新章节指针：persist_directory 下的 sidecar 文件，记录已写入的最大章节号
+LATEST_CHAPTER_FILE = "latest_chapter.json"
+
+
+def content_hash(text):
+    """文本的 128 位 BLAKE2b 哈希（十六进制）"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _metadata_hash(metadata):
+    return content_hash(json.dumps(metadata or {}, ensure_ascii=False, sort_keys=True))
+
+
+def _replacing(record, old):
+    """
+    让 upsert 整体替换元数据：Chroma 对已有 id 的 upsert 会合并元数据，
+    旧元数据中有、新元数据中没有的字段置为 None（Chroma 删除值为 None 的字段）
+    """
+    doc_id, document, metadata = record
+    dropped = {key: None for key in old if key not in metadata}
+    return doc_id, document, {**dropped, **metadata}
+
+
+def _public_metadata(metadata):
+    """去掉 SYNC_PREFIX 开头的内部字段"""
+    if not metadata:
+        return metadata
+    return {k: v for k, v in metadata.items() if not k.startswith(SYNC_PREFIX)}
 
 
 class ChromaClient:
     """Chroma 向量数据库客户端"""
 
-    def __init__(self, persist_directory="./chroma_data"):
+    def __init__(self, persist_directory="./chroma_data", embedding_function=None):
         self.persist_directory = persist_directory
         os.makedirs(persist_directory, exist_ok=True)
+        # None 表示使用 Chroma 默认的向量化模型
+        self.embedding_function = embedding_function
 
         self.client = chromadb.PersistentClient(
-            path=persist_directory, settings=Settings(anonymized_telemetry=False)
+            path=persist_directory,
+            settings=Settings(anonymized_telemetry=False, allow_reset=True),
         )
         self.collections = {}
         self.init_collections()
@@ -34,12 +79,16 @@ class ChromaClient:
             "reviews": "审核记录",
         }
 
+        options = {}
+        if self.embedding_function is not None:
+            options["embedding_function"] = self.embedding_function
+
         for name, desc in collection_configs.items():
             try:
-                self.collections[name] = self.client.get_collection(name)
+                self.collections[name] = self.client.get_collection(name, **options)
             except:
                 self.collections[name] = self.client.create_collection(
-                    name=name, metadata={"description": desc}
+                    name=name, metadata={"description": desc}, **options
                 )
 
     def get_collection(self, name):
@@ -48,28 +97,151 @@ class ChromaClient:
             self.init_collections()
         return self.collections[name]
 
+    @property
+    def max_batch_size(self):
+        """单次 add 最多能写入的条数（由 Chroma 后端决定）"""
+        # 旧版本 chromadb 的客户端没有 get_max_batch_size()
+        if hasattr(self.client, "get_max_batch_size"):
+            return self.client.get_max_batch_size()
+        return 5461
+
     def add(self, collection_name, documents, metadatas=None, ids=None):
-        """添加文档到 collection"""
-        collection = self.get_collection(collection_name)
+        """
+        添加文档到 collection，返回 {"added", "updated", "unchanged"}
+
+        等同于 upsert：未给出 ids 时按正文的内容哈希生成 id，
+        同一正文再次写入时更新元数据而不是被忽略；
+        同一次调用内的相同正文只保存一条，元数据以最后一条为准。
+        """
+        return self.upsert(collection_name, documents, metadatas, ids)
+
+    def upsert(self, collection_name, documents, metadatas=None, ids=None):
+        """
+        幂等写入：按 id 新增或覆盖文档，返回 {"added", "updated", "unchanged"}
 
+        元数据中额外记录正文的哈希和写入时元数据的哈希（SYNC_PREFIX 开头的
+        内部字段，get / query 的结果中不返回）：
+        两者都没变的文档直接跳过（不会覆盖之后由 update 修改的字段）；
+        只有元数据变化的沿用已有向量，不重新向量化；新文档和正文变化的
+        文档整批向量化写入。更新的文档整体替换元数据，旧元数据中有、
+        新元数据中没有的字段被删除。未给出 ids 时按正文的内容哈希生成；
+        同一批内 id 重复时以最后一条为准。
+        """
+        collection = self.get_collection(collection_name)
+        if metadatas is None:
+            metadatas = [None] * len(documents)
+        hashes = [content_hash(d) for d in documents]
         if ids is None:
-            ids = [f"{collection_name}_{i}" for i in range(len(documents))]
+            ids = [f"{collection_name}_{h}" for h in hashes]
+
+        latest = {doc_id: i for i, doc_id in enumerate(ids)}
+        records = [
+            (
+                doc_id,
+                documents[i],
+                {
+                    **(metadatas[i] or {}),
+                    CONTENT_HASH_KEY: hashes[i],
+                    METADATA_HASH_KEY: _metadata_hash(metadatas[i]),
+                },
+            )
+            for doc_id, i in latest.items()
+        ]
+
+        counts = {"added": 0, "updated": 0, "unchanged": 0}
+        size = self.max_batch_size
+        for start in range(0, len(records), size):
+            batch = records[start : start + size]
+            existing = collection.get(ids=[r[0] for r in batch], include=["metadatas"])
+            stored = dict(zip(existing["ids"], existing["metadatas"]))
 
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+            embed, reuse = [], []
+            for record in batch:
+                old = stored.get(record[0])
+                if old is None:
+                    counts["added"] += 1
+                    embed.append(record)
+                elif old.get(CONTENT_HASH_KEY) != record[2][CONTENT_HASH_KEY]:
+                    counts["updated"] += 1
+                    embed.append(_replacing(record, old))
+                elif old.get(METADATA_HASH_KEY) != record[2][METADATA_HASH_KEY]:
+                    counts["updated"] += 1
+                    reuse.append(_replacing(record, old))
+                else:
+                    counts["unchanged"] += 1
 
-    def query(self, collection_name, query_texts, n_results=3, where=None):
-        """查询文档"""
+            if embed:
+                collection.upsert(
+                    ids=[r[0] for r in embed],
+                    documents=[r[1] for r in embed],
+                    metadatas=[r[2] for r in embed],
+                )
+            if reuse:
+                vectors = collection.get(
+                    ids=[r[0] for r in reuse], include=["embeddings"]
+                )
+                embeddings = dict(zip(vectors["ids"], vectors["embeddings"]))
+                collection.upsert(
+                    ids=[r[0] for r in reuse],
+                    embeddings=[embeddings[r[0]] for r in reuse],
+                    documents=[r[1] for r in reuse],
+                    metadatas=[r[2] for r in reuse],
+                )
+
+        return counts
+
+    def query(
+        self, collection_name, query_texts, n_results=3, where=None, include=None
+    ):
+        """
+        查询文档
+
+        include 指定返回的字段（如 ["documents", "metadatas"]），
+        None 时使用 Chroma 的默认字段。
+        """
         collection = self.get_collection(collection_name)
 
-        return collection.query(
-            query_texts=query_texts, n_results=n_results, where=where
+        options = {} if include is None else {"include": include}
+        results = collection.query(
+            query_texts=query_texts, n_results=n_results, where=where, **options
         )
+        if results.get("metadatas") is not None:
+            results["metadatas"] = [
+                [_public_metadata(m) for m in row] for row in results["metadatas"]
+            ]
+        return results
+
+    def get(
+        self,
+        collection_name,
+        where=None,
+        where_document=None,
+        ids=None,
+        include=None,
+        limit=None,
+        offset=None,
+    ):
+        """
+        获取文档
 
-    def get(self, collection_name, where=None, where_document=None, ids=None):
-        """获取文档"""
+        过滤在 Chroma 内部完成；include 指定返回的字段（ids 总会返回，
+        include=[] 只取 ids），limit / offset 限制返回的条数。
+        返回的元数据中不含 upsert 记录的内部字段。
+        """
         collection = self.get_collection(collection_name)
 
-        return collection.get(where=where, where_document=where_document, ids=ids)
+        options = {} if include is None else {"include": include}
+        results = collection.get(
+            where=where,
+            where_document=where_document,
+            ids=ids,
+            limit=limit,
+            offset=offset,
+            **options,
+        )
+        if results.get("metadatas") is not None:
+            results["metadatas"] = [_public_metadata(m) for m in results["metadatas"]]
+        return results
 
     def update(self, collection_name, ids, documents=None, metadatas=None):
         """更新文档"""
@@ -77,9 +249,79 @@ class ChromaClient:
 
         collection.update(ids=ids, documents=documents, metadatas=metadatas)
 
+    # ========== 最新章节指针 ==========
+
+    @property
+    def latest_chapter_file(self):
+        return os.path.join(self.persist_directory, LATEST_CHAPTER_FILE)
+
+    def latest_chapter(self):
+        """
+        已写入的最大章节号，没有指针时为 None
+
+        指针每次从文件读取，其他进程（如章节钩子）写入的章节也能看到。
+        """
+        try:
+            with open(self.latest_chapter_file, "r", encoding="utf-8") as f:
+                return json.load(f)["chapter"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def advance_latest_chapter(self, chapter):
+        """把最新章节指针推进到 chapter（只增不减），先写临时文件再原子替换"""
+        latest = self.latest_chapter()
+        if latest is not None and latest >= chapter:
+            return
+        temp = self.latest_chapter_file + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump({"chapter": chapter}, f)
+        os.replace(temp, self.latest_chapter_file)
+
     def reset(self):
-        """重置所有数据（谨慎使用）"""
+        """重置所有数据（谨慎使用），并重新创建空的 collections"""
         self.client.reset()
+        self.collections = {}
+        self.init_collections()
+        try:
+            os.remove(self.latest_chapter_file)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """关闭底层的 PersistentClient，释放文件句柄"""
+        self.collections = {}
+        # 旧版本 chromadb 的客户端没有 close()
+        if hasattr(self.client, "close"):
+            self.client.close()
+
+
+def get_client(persist_directory="./chroma_data", embedding_function=None):
+    """
+    获取 persist_directory 对应的共享客户端
+
+    同一进程内每个目录只打开一次 PersistentClient 并初始化一次 collections，
+    之后所有读写器复用同一个客户端及其 collection 句柄。
+    embedding_function 只在首次打开该目录时生效。
+    """
+    key = os.path.abspath(persist_directory)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = ChromaClient(persist_directory, embedding_function)
+        return client
+
+
+def close_client(persist_directory=None):
+    """关闭共享客户端；不指定目录时关闭全部（进程退出或切换项目时调用）"""
+    with _clients_lock:
+        if persist_directory is None:
+            keys = list(_clients)
+        else:
+            keys = [os.path.abspath(persist_directory)]
+        for key in keys:
+            client = _clients.pop(key, None)
+            if client is not None:
+                client.close()
 
 
 if __name__ == "__main__":
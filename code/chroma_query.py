@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma where 过滤条件构建器
+用于网文编辑部长记忆系统
+
+把常用的比较和组合写成函数，生成 Chroma 的 where 字典，
+让过滤在 Chroma 内部完成，只把需要的记录取回来：
+
+    where = and_(eq("status", "active"), gte("embed_chapter", 30))
+    reader.client.get("foreshadowing", where=where, include=["metadatas"])
+
+and_ / or_ 会忽略 None，只剩一个条件时直接返回该条件，
+没有条件时返回 None（即不过滤），满足 Chroma「$and / $or 至少两项」的要求。
+"""
+
+
+def eq(field, value):
+    """字段等于 value"""
+    return {field: {"$eq": value}}
+
+
+def gte(field, value):
+    """字段大于等于 value"""
+    return {field: {"$gte": value}}
+
+
+def _combine(operator, conditions):
+    conditions = [c for c in conditions if c]
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {operator: conditions}
+
+
+def and_(*conditions):
+    """所有条件同时成立"""
+    return _combine("$and", conditions)
+
+
+def or_(*conditions):
+    """任一条件成立"""
+    return _combine("$or", conditions)
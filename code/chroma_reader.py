@@ -4,14 +4,31 @@ Chroma 向量数据库读取器
 用于网文编辑部长记忆系统
 """
 
-from chroma_client import ChromaClient
+from chroma_client import get_client
+from chroma_query import eq, gte, or_
+
+# 需要正文和元数据的查询只取这两个字段（不取向量）
+RECORD_FIELDS = ["documents", "metadatas"]
+
+
+def _records(results):
+    """把 Chroma get 的列式结果转成 [{"id", "document", "metadata"}, ...]"""
+    if not results or not results["ids"]:
+        return []
+    count = len(results["ids"])
+    documents = results.get("documents") or [None] * count
+    metadatas = results.get("metadatas") or [None] * count
+    return [
+        {"id": i, "document": d, "metadata": m}
+        for i, d, m in zip(results["ids"], documents, metadatas)
+    ]
 
 
 class ChromaReader:
     """Chroma 数据读取器"""
 
     def __init__(self, persist_directory="./chroma_data"):
-        self.client = ChromaClient(persist_directory)
+        self.client = get_client(persist_directory)
 
     # ========== 世界观查询 ==========
 
@@ -41,22 +58,12 @@ class ChromaReader:
 
     def get_character_by_chapter(self, chapter):
         """获取某章节出场的人物"""
-        # Chroma 不支持范围查询，这里需要获取所有后过滤
-        results = self.client.get(collection_name="characters")
-
-        matched = []
-        if results and results["metadatas"]:
-            for i, meta in enumerate(results["metadatas"]):
-                if meta.get("chapter") == chapter:
-                    matched.append(
-                        {
-                            "id": results["ids"][i],
-                            "document": results["documents"][i],
-                            "metadata": meta,
-                        }
-                    )
-
-        return matched
+        results = self.client.get(
+            collection_name="characters",
+            where=eq("chapter", chapter),
+            include=RECORD_FIELDS,
+        )
+        return _records(results)
 
     def get_all_characters(self):
         """获取所有人物"""
@@ -90,50 +97,71 @@ class ChromaReader:
         )
 
     def get_recent_chapters(self, n=5):
-        """获取最近的n章"""
-        results = self.client.get(collection_name="chapters")
-
+        """
+        获取最近的n章
+
+        有最新章节指针时只查询 chapter >= latest - n + 1 的章节，
+        耗时与项目总章节数无关；中间缺章导致不足 n 章时把范围加倍重查，
+        范围覆盖到第 1 章或没有指针时退回整表扫描。
+        指针比实际偏小时多出的章节也在范围内，偏大时靠加倍范围补足，结果都正确。
+        """
+        latest = self.client.latest_chapter()
+        if latest is None or n <= 0:
+            return self._scan_recent_chapters(n)
+
+        span = n
+        while True:
+            low = latest - span + 1
+            if low <= 1:
+                return self._scan_recent_chapters(n)
+            chapters = _records(
+                self.client.get(
+                    collection_name="chapters",
+                    where=gte("chapter", low),
+                    include=RECORD_FIELDS,
+                )
+            )
+            if len(chapters) >= n:
+                chapters.sort(key=lambda x: x["metadata"]["chapter"], reverse=True)
+                return chapters[:n]
+            span *= 2
+
+    def _scan_recent_chapters(self, n):
+        """扫描全部章节的元数据找出最近的 n 章"""
+        # 先只取元数据找出章节号最大的 n 章，再只取这几章的正文
+        results = self.client.get(collection_name="chapters", include=["metadatas"])
         if not results or not results["metadatas"]:
             return []
 
         # 按章节号排序
-        chapters = []
-        for i, meta in enumerate(results["metadatas"]):
-            chapters.append(
-                {
-                    "id": results["ids"][i],
-                    "document": results["documents"][i],
-                    "metadata": meta,
-                }
-            )
+        latest = sorted(
+            zip(results["ids"], results["metadatas"]),
+            key=lambda x: x[1].get("chapter", 0),
+            reverse=True,
+        )[:n]
+        if not latest:
+            return []
 
+        chapters = _records(
+            self.client.get(
+                collection_name="chapters",
+                ids=[doc_id for doc_id, _ in latest],
+                include=RECORD_FIELDS,
+            )
+        )
         chapters.sort(key=lambda x: x["metadata"].get("chapter", 0), reverse=True)
-        return chapters[:n]
+        return chapters
 
     # ========== 伏笔查询 ==========
 
     def get_foreshadowing_by_chapter(self, chapter):
         """获取某章节相关的伏笔（埋入或回收）"""
-        results = self.client.get(collection_name="foreshadowing")
-
-        if not results or not results["metadatas"]:
-            return []
-
-        matched = []
-        for i, meta in enumerate(results["metadatas"]):
-            if (
-                meta.get("embed_chapter") == chapter
-                or meta.get("recover_chapter") == chapter
-            ):
-                matched.append(
-                    {
-                        "id": results["ids"][i],
-                        "document": results["documents"][i],
-                        "metadata": meta,
-                    }
-                )
-
-        return matched
+        results = self.client.get(
+            collection_name="foreshadowing",
+            where=or_(eq("embed_chapter", chapter), eq("recover_chapter", chapter)),
+            include=RECORD_FIELDS,
+        )
+        return _records(results)
 
     def get_active_foreshadowing(self):
         """获取所有未回收的伏笔"""
@@ -166,6 +194,21 @@ class ChromaReader:
             collection_name="reviews", where={"chapter": chapter_num}
         )
 
+    # ========== 批量查询 ==========
+
+    def search_many(self, collection_name, queries, n=3, where=None):
+        """
+        批量查询：整批查询文本放进一次 collection.query 调用
+
+        返回 Chroma 的原始结果，第 i 个查询的结果位于各字段的第 i 项。
+        """
+        return self.client.query(
+            collection_name=collection_name,
+            query_texts=list(queries),
+            n_results=n,
+            where=where,
+        )
+
 
 class ContextBuilder:
     """上下文构建器 - 用于写作/审核时快速构建上下文"""
@@ -173,8 +216,13 @@ class ContextBuilder:
     def __init__(self, persist_directory="./chroma_data"):
         self.reader = ChromaReader(persist_directory)
 
-    def build_write_context(self, chapter_num):
-        """构建写作上下文"""
+    def build_write_context(self, chapter_num, world_queries=None):
+        """
+        构建写作上下文
+
+        world_queries 为本章涉及的关键词（人名、地名等），给出时一次
+        批量查询相关的世界观设定。
+        """
         context = {
             "chapter": chapter_num,
             "recent_chapters": [],
@@ -199,10 +247,18 @@ class ContextBuilder:
         active_fs = self.reader.get_active_foreshadowing()
         context["active_foreshadowing"] = active_fs
 
+        # 5. 批量查询相关世界观
+        if world_queries:
+            context["world_settings"] = self.reader.search_many("world", world_queries)
+
         return context
 
-    def build_review_context(self, chapter_num):
-        """构建审核上下文"""
+    def build_review_context(self, chapter_num, world_queries=None):
+        """
+        构建审核上下文
+
+        world_queries 的用法同 build_write_context。
+        """
         context = {
             "chapter": chapter_num,
             "all_characters": [],
@@ -223,6 +279,10 @@ class ContextBuilder:
         recent = self.reader.get_recent_chapters(n=3)
         context["previous_chapters"] = recent
 
+        # 4. 批量查询相关世界观
+        if world_queries:
+            context["world_settings"] = self.reader.search_many("world", world_queries)
+
         return context
 
 
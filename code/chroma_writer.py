@@ -4,67 +4,154 @@ Chroma 向量数据库写入器
 用于网文编辑部长记忆系统
 """
 
-from chroma_client import ChromaClient
+import itertools
+import time
+
+from chroma_client import get_client
+from chroma_query import eq
 
 
 class ChromaWriter:
-    """Chroma 数据写入器"""
+    """
+    Chroma 数据写入器
 
-    def __init__(self, persist_directory="./chroma_data"):
-        self.client = ChromaClient(persist_directory)
+    写入都是幂等的 upsert（见 ChromaClient.upsert）：重复运行同一章的钩子
+    时没变的文档直接跳过，变化的原地更新。
+
+    默认每次 add_* 立即写入一条。指定 batch_size 后按 collection 缓冲，
+    每攒够 batch_size 条整批写入一次（整批向量化一次），
+    剩余的在 flush() 或退出 with 块时写入（某一批写入失败时，
+    它和之后的批次留在缓冲中，可以再次 flush()）：
+
+        with ChromaWriter(batch_size=256) as writer:
+            for char in characters:
+                writer.add_character(**char)
+
+    每批的 collection、条数、耗时和新增/更新/跳过条数记录在 batch_stats 中。
+
+    章节摘要写入 Chroma 后推进最新章节指针（ChromaClient.latest_chapter），
+    ChromaReader.get_recent_chapters 据此只查询最后几章。
+    """
+
+    def __init__(self, persist_directory="./chroma_data", batch_size=None):
+        self.client = get_client(persist_directory)
+        self.batch_size = batch_size
+        # collection → {id: (document, metadata)}，按加入顺序
+        self._pending = {}
+        self.batch_stats = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def _write(self, collection_name, document, metadata, doc_id):
+        """写入一条文档；批量模式下先缓冲"""
+        if self.batch_size is None:
+            self.client.upsert(
+                collection_name=collection_name,
+                documents=[document],
+                metadatas=[metadata],
+                ids=[doc_id],
+            )
+            self._written(collection_name, [metadata])
+            return
+
+        pending = self._pending.setdefault(collection_name, {})
+        # 同一 id 以最后一次写入为准
+        pending.pop(doc_id, None)
+        pending[doc_id] = (document, metadata)
+        if len(pending) >= self.batch_size:
+            self._flush_collection(collection_name)
+
+    def flush(self):
+        """写入所有缓冲的文档，返回本次写入各批的统计"""
+        start = len(self.batch_stats)
+        for collection_name in list(self._pending):
+            self._flush_collection(collection_name)
+        return self.batch_stats[start:]
+
+    def _flush_collection(self, collection_name):
+        """按批写入该 collection 缓冲的文档；每批写入成功后才移出缓冲"""
+        pending = self._pending.get(collection_name, {})
+        size = min(self.batch_size, self.client.max_batch_size)
+        while pending:
+            batch = list(itertools.islice(pending, size))
+            metadatas = [pending[i][1] for i in batch]
+            began = time.perf_counter()
+            counts = self.client.upsert(
+                collection_name=collection_name,
+                documents=[pending[i][0] for i in batch],
+                metadatas=metadatas,
+                ids=batch,
+            )
+            for doc_id in batch:
+                del pending[doc_id]
+            self.batch_stats.append(
+                {
+                    "collection": collection_name,
+                    "count": len(batch),
+                    "seconds": time.perf_counter() - began,
+                    **counts,
+                }
+            )
+            self._written(collection_name, metadatas)
+        self._pending.pop(collection_name, None)
+
+    def _written(self, collection_name, metadatas):
+        """文档写入 Chroma 之后调用：章节摘要推进最新章节指针"""
+        if collection_name == "chapters":
+            self.client.advance_latest_chapter(max(m["chapter"] for m in metadatas))
 
     # ========== 世界观设定 ==========
 
     def add_world_setting(self, content, name, category):
         """写入世界观设定"""
-        self.client.add(
-            collection_name="world",
-            documents=[content],
-            metadatas=[{"type": "world", "name": name, "category": category}],
-            ids=[f"world_{name}"],
+        self._write(
+            "world",
+            content,
+            {"type": "world", "name": name, "category": category},
+            f"world_{name}",
         )
 
     # ========== 人物设定 ==========
 
     def add_character(self, name, content, chapter, role, status="active"):
         """写入人物设定"""
-        self.client.add(
-            collection_name="characters",
-            documents=[content],
-            metadatas=[
-                {
-                    "type": "character",
-                    "name": name,
-                    "chapter": chapter,
-                    "role": role,
-                    "status": status,
-                }
-            ],
-            ids=[f"char_{name}_{chapter}"],
+        self._write(
+            "characters",
+            content,
+            {
+                "type": "character",
+                "name": name,
+                "chapter": chapter,
+                "role": role,
+                "status": status,
+            },
+            f"char_{name}_{chapter}",
         )
 
     # ========== 技能设定 ==========
 
     def add_skill(self, name, content, category, owner=None):
         """写入技能设定"""
-        self.client.add(
-            collection_name="skills",
-            documents=[content],
-            metadatas=[
-                {"type": "skill", "name": name, "category": category, "owner": owner}
-            ],
-            ids=[f"skill_{name}"],
+        self._write(
+            "skills",
+            content,
+            {"type": "skill", "name": name, "category": category, "owner": owner},
+            f"skill_{name}",
         )
 
     # ========== 章节摘要 ==========
 
     def add_chapter_summary(self, chapter_num, content, metadata):
-        """写入章节摘要"""
-        self.client.add(
-            collection_name="chapters",
-            documents=[content],
-            metadatas=[{"chapter": chapter_num, **metadata}],
-            ids=[f"chapter_{chapter_num:03d}"],
+        """写入章节摘要（写入后推进最新章节指针）"""
+        self._write(
+            "chapters",
+            content,
+            {"chapter": chapter_num, **metadata},
+            f"chapter_{chapter_num:03d}",
         )
 
     # ========== 伏笔 ==========
@@ -73,55 +160,49 @@ class ChromaWriter:
         self, name, content, embed_chapter, recover_chapter, status="active"
     ):
         """写入伏笔"""
-        self.client.add(
-            collection_name="foreshadowing",
-            documents=[content],
-            metadatas=[
-                {
-                    "type": "foreshadowing",
-                    "name": name,
-                    "embed_chapter": embed_chapter,
-                    "recover_chapter": recover_chapter,
-                    "status": status,
-                }
-            ],
-            ids=[f"fs_{name}_{embed_chapter}"],
+        self._write(
+            "foreshadowing",
+            content,
+            {
+                "type": "foreshadowing",
+                "name": name,
+                "embed_chapter": embed_chapter,
+                "recover_chapter": recover_chapter,
+                "status": status,
+            },
+            f"fs_{name}_{embed_chapter}",
         )
 
     # ========== 剧情线 ==========
 
     def add_plot_point(self, name, content, chapter, plot_type="main"):
         """写入剧情点"""
-        self.client.add(
-            collection_name="plot",
-            documents=[content],
-            metadatas=[
-                {
-                    "type": "plot",
-                    "name": name,
-                    "chapter": chapter,
-                    "plot_type": plot_type,
-                }
-            ],
-            ids=[f"plot_{name}_{chapter}"],
+        self._write(
+            "plot",
+            content,
+            {
+                "type": "plot",
+                "name": name,
+                "chapter": chapter,
+                "plot_type": plot_type,
+            },
+            f"plot_{name}_{chapter}",
         )
 
     # ========== 审核记录 ==========
 
     def add_review(self, chapter_num, content, result, issues=None):
         """写入审核记录"""
-        self.client.add(
-            collection_name="reviews",
-            documents=[content],
-            metadatas=[
-                {
-                    "type": "review",
-                    "chapter": chapter_num,
-                    "result": result,
-                    "issues": issues or [],
-                }
-            ],
-            ids=[f"review_{chapter_num:03d}"],
+        self._write(
+            "reviews",
+            content,
+            {
+                "type": "review",
+                "chapter": chapter_num,
+                "result": result,
+                "issues": issues or [],
+            },
+            f"review_{chapter_num:03d}",
         )
 
 
@@ -129,34 +210,42 @@ class ChromaUpdater:
     """Chroma 数据更新器"""
 
     def __init__(self, persist_directory="./chroma_data"):
-        self.client = ChromaClient(persist_directory)
+        self.client = get_client(persist_directory)
+
+    def _first_id(self, collection_name, where):
+        """第一条匹配记录的 id（只取 id），没有时为 None"""
+        results = self.client.get(
+            collection_name=collection_name, where=where, include=[], limit=1
+        )
+        return results["ids"][0] if results and results["ids"] else None
 
     def recover_foreshadowing(self, name, chapter):
         """标记伏笔已回收"""
-        collection = self.client.get_collection("foreshadowing")
-        results = collection.get(where={"name": name})
-
-        if results and results["ids"]:
-            collection.update(
-                ids=[results["ids"][0]],
+        doc_id = self._first_id("foreshadowing", eq("name", name))
+        if doc_id is not None:
+            self.client.update(
+                collection_name="foreshadowing",
+                ids=[doc_id],
                 metadatas=[{"status": "recovered", "recover_chapter": chapter}],
             )
 
     def update_character_status(self, name, status):
         """更新人物状态"""
-        collection = self.client.get_collection("characters")
-        results = collection.get(where={"name": name})
-
-        if results and results["ids"]:
-            collection.update(ids=[results["ids"][0]], metadatas=[{"status": status}])
+        doc_id = self._first_id("characters", eq("name", name))
+        if doc_id is not None:
+            self.client.update(
+                collection_name="characters",
+                ids=[doc_id],
+                metadatas=[{"status": status}],
+            )
 
     def update_chapter_metadata(self, chapter_num, metadata):
         """更新章节元数据"""
-        collection = self.client.get_collection("chapters")
-        results = collection.get(where={"chapter": chapter_num})
-
-        if results and results["ids"]:
-            collection.update(ids=[results["ids"][0]], metadatas=[metadata])
+        doc_id = self._first_id("chapters", eq("chapter", chapter_num))
+        if doc_id is not None:
+            self.client.update(
+                collection_name="chapters", ids=[doc_id], metadatas=[metadata]
+            )
 
 
 if __name__ == "__main__":
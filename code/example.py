@@ -6,13 +6,15 @@ Chroma 长记忆系统使用示例
 
 from chroma_writer import ChromaWriter, ChromaUpdater
 from chroma_reader import ChromaReader, ContextBuilder
+from chroma_client import close_client
 
 # ========== 示例1: 初始化项目数据 ==========
 
 
 def init_project():
     """初始化项目时调用"""
-    writer = ChromaWriter("./chroma_data")
+    # 批量写入：按 collection 缓冲，最后 flush() 一次写完
+    writer = ChromaWriter("./chroma_data", batch_size=64)
 
     # 1. 写入世界观设定
     world_settings = [
@@ -118,6 +120,7 @@ def init_project():
             recover_chapter=fs["recover_chapter"],
         )
 
+    writer.flush()
     print("项目数据初始化完成！")
 
 
@@ -251,3 +254,6 @@ if __name__ == "__main__":
 
     # 4. 审核时查询
     # on_review(10)
+
+    # 5. 关闭共享的客户端
+    close_client()
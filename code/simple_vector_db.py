@@ -6,171 +6,2418 @@
 """
 
 import os
+import re
 import json
+import bisect
+import hashlib
+import itertools
+import mmap
+import struct
+import threading
+import time
+import zlib
 import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
 from pathlib import Path
 from datetime import datetime
 
+# 向量维度：256 维字符直方图 + 10000 维 n-gram 哈希桶
+EMBEDDING_DIM = 256 + 10000
+NGRAM_SIZE = 3
+NGRAM_BUCKETS = 10000
+
+# 向量化算法标识，随向量一起保存；算法改变时需要更新，
+# 打开数据库时标识不一致会触发重新向量化
+EMBEDDER_ID = "char256+fnv1a-3gram-10000/v1"
+
+# 稀疏向量列号的存储类型
+_INDEX_DTYPE = np.uint16 if EMBEDDING_DIM <= 1 << 16 else np.int32
+
+# 64 位 FNV-1a 参数
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+# IVF 近似索引：簇数取 sqrt(行数)，限制在 [IVF_MIN_LISTS, IVF_MAX_LISTS]
+IVF_MIN_LISTS = 8
+IVF_MAX_LISTS = 256
+# 近似查询默认探查 1/8 的簇，至少 IVF_MIN_NPROBE 个
+IVF_MIN_NPROBE = 4
+# 训练 k-means 时每个簇抽样的行数
+IVF_SAMPLE_PER_LIST = 32
+
+# 精确搜索：待计算的行非零元素超过 COLUMN_INDEX_MIN_NNZ 时建立按列副本，
+# 按列计算的代价更小时只读查询非零列的倒排表；按列副本之后追加或替换过的行
+# 超过 max(COLUMN_INDEX_MIN_STALE, 已覆盖行数 / 4) 时重建
+COLUMN_INDEX_MIN_NNZ = 1 << 16
+COLUMN_INDEX_MIN_STALE = 4096
+
+# 混合检索：BM25 取前 max(n × HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+# 条候选，再用向量相似度重排
+HYBRID_CANDIDATE_FACTOR = 10
+HYBRID_MIN_CANDIDATES = 100
+
+# 列式记录的 chapter 列中表示「字段不存在」和「不是整数（保存在 JSON 中）」的哨兵值
+_CHAPTER_MISSING = np.iinfo(np.int64).min
+_CHAPTER_OTHER = _CHAPTER_MISSING + 1
+# 能按 datetime64[us] 无损保存的时间戳格式（datetime.isoformat() 带微秒）
+_TIMESTAMP_RE = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}")
+
+# WAL 记录头：负载字节数 + 负载的 CRC32；负载头：JSON 字节数、向量行数、非零个数
+_WAL_HEADER = struct.Struct("<II")
+_WAL_PAYLOAD = struct.Struct("<III")
+
+# 所有 collection 默认建立哈希索引的元数据字段
+DEFAULT_INDEXED_FIELDS = (
+    "chapter",
+    "name",
+    "status",
+    "embed_chapter",
+    "recover_chapter",
+)
+
+
+class _GrowableArray:
+    """
+    按容量预分配、几何扩容的数组
+
+    只有前 size 行是有效数据，扩容时容量翻倍，
+    因此增长到 n 行最多复制 O(log n) 次。
+    初始数据可以是只读的内存映射数组，首次修改时才复制到内存。
+    """
+
+    def __init__(self, row_shape=(), dtype=np.float64, data=None):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        if data is None:
+            data = np.zeros((0,) + self.row_shape, dtype=self.dtype)
+        self._buffer = np.asarray(data, dtype=self.dtype).reshape(
+            (-1,) + self.row_shape
+        )
+        self.size = len(self._buffer)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self._buffer)
+
+    @property
+    def view(self):
+        """有效数据切片（不复制）"""
+        return self._buffer[: self.size]
+
+    def reserve(self, capacity):
+        """保证容量至少为 capacity（且缓冲区可写）"""
+        if capacity <= self.capacity and self._buffer.flags.writeable:
+            return
+        capacity = max(capacity, self.capacity * 2, 16)
+        buffer = np.zeros((capacity,) + self.row_shape, dtype=self.dtype)
+        buffer[: self.size] = self._buffer[: self.size]
+        self._buffer = buffer
+
+    def extend(self, rows):
+        """追加多行"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self.reserve(self.size + len(rows))
+        self._buffer[self.size : self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def delete(self, indices):
+        """原地删除若干行，后面的数据逐段前移"""
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        if not len(indices):
+            return
+        self.reserve(self.size)
+
+        # 连续的待删除位置合并成一段，每段只移动一次
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        run_starts = indices[np.r_[0, breaks]]
+        run_ends = indices[np.r_[breaks - 1, len(indices) - 1]] + 1
+
+        dst = run_starts[0]
+        next_starts = np.append(run_starts[1:], self.size)
+        for end, next_start in zip(run_ends.tolist(), next_starts.tolist()):
+            self._buffer[dst : dst + next_start - end] = self._buffer[end:next_start]
+            dst += next_start - end
+        self.size = dst
+
+    def splice(self, start, end, rows):
+        """用 rows 替换 [start, end) 区间，其后的数据整体平移"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        tail = self._buffer[end : self.size].copy()
+        self.size = start
+        self.extend(rows)
+        self.extend(tail)
+
+    def clear(self):
+        self.size = 0
+
+
+class _ColumnIndex:
+    """
+    CSR 矩阵前 size 行的按列副本（CSC / 倒排表）：列号 → 含该列的行号和值
+
+    查询向量很稀疏，按列计算点积只需读取查询非零列下的行，
+    与矩阵总的非零元素数无关。值保持矩阵的存储类型（int8 时未乘缩放系数）。
+    建立之后被替换过的行记在 stale 中，由调用方按行重新计算。
+    """
+
+    def __init__(self, matrix):
+        indptr = matrix.indptr.view
+        indices = matrix.indices.view
+        self.size = len(indptr) - 1
+        # 列号是 uint16，稳定排序使用基数排序；同一列内行号保持升序
+        order = np.argsort(indices, kind="stable")
+        rows = np.repeat(np.arange(self.size, dtype=np.int32), np.diff(indptr))
+        self.rows = rows[order]
+        self.values = matrix.values.view[order]
+        self.colptr = np.zeros(EMBEDDING_DIM + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=EMBEDDING_DIM), out=self.colptr[1:])
+        self.stale = np.zeros(self.size, dtype=bool)
+        self.stale_count = 0
+
+    def save(self, prefix):
+        """保存为 <prefix>.columns.<colptr|rows|values>.npy"""
+        for name in ("colptr", "rows", "values"):
+            path = f"{prefix}.columns.{name}.npy"
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, prefix, size, mmap=True):
+        """加载与 size 行快照一起写出的按列副本，不存在时返回 None"""
+        paths = {
+            name: f"{prefix}.columns.{name}.npy"
+            for name in ("colptr", "rows", "values")
+        }
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        index = cls.__new__(cls)
+        for name, path in paths.items():
+            setattr(index, name, np.load(path, mmap_mode="r" if mmap else None))
+        index.size = size
+        index.stale = np.zeros(index.size, dtype=bool)
+        index.stale_count = 0
+        return index
+
+    def mark_stale(self, row):
+        if row < self.size and not self.stale[row]:
+            self.stale[row] = True
+            self.stale_count += 1
+
+    def cost(self, columns):
+        """按列计算要读取的元素数"""
+        return int((self.colptr[columns + 1] - self.colptr[columns]).sum())
+
+    def dot(self, query):
+        """
+        前 size 行与一个稠密查询向量的点积（float64，int8 时未乘缩放系数）
+
+        只读取查询非零列的倒排表。
+        """
+        columns = np.flatnonzero(query)
+        starts = self.colptr[columns]
+        lengths = self.colptr[columns + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+        weights = self.values[positions].astype(np.float64)
+        weights *= np.repeat(query[columns], lengths)
+        return np.bincount(self.rows[positions], weights=weights, minlength=self.size)
+
+
+class _SparseMatrix:
+    """
+    可增长的 CSR 稀疏矩阵
+
+    只保存非零元素（列号 + 值），内存与不同 n-gram 的数量成正比，
+    与向量维度无关。同时缓存每行的范数。
+    dot() 在待计算的行较多时使用按列副本（_ColumnIndex），
+    内存约为矩阵本身的 1~2 倍，随快照一起写出。
+
+    值的存储类型：
+        float64 / float32  直接保存（计数特征在 float32 下无损）
+        int8               按行标量量化，每行一个 float32 缩放系数
+    快照可以用内存映射方式打开，数据在访问时才按页读入。
+    """
+
+    def __init__(
+        self,
+        indptr=None,
+        indices=None,
+        values=None,
+        dtype="float32",
+        scales=None,
+        norms=None,
+    ):
+        self.dtype = np.dtype(dtype)
+        self.quantized = self.dtype == np.int8
+
+        self.indptr = _GrowableArray(
+            dtype=np.int64, data=np.zeros(1) if indptr is None else indptr
+        )
+        self.indices = _GrowableArray(dtype=_INDEX_DTYPE, data=indices)
+
+        if self.quantized and values is not None and scales is None:
+            # 原始值，需要先量化
+            values, scales = self._quantize(np.diff(self.indptr.view), values)
+        self.values = _GrowableArray(dtype=self.dtype, data=values)
+        self.scales = _GrowableArray(dtype=np.float32, data=scales)
+
+        if norms is None:
+            norms = self._row_norms(self.indptr.view, self._dequantize())
+        self.norms = _GrowableArray(data=norms)
+        self._columns = None
+
+    @classmethod
+    def from_dense(cls, matrix, dtype="float32"):
+        """由稠密矩阵构造（用于迁移旧格式）"""
+        matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, EMBEDDING_DIM)
+        rows, cols = np.nonzero(matrix)
+        indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=len(matrix)))]
+        )
+        return cls(indptr, cols, matrix[rows, cols], dtype=dtype)
+
+    @staticmethod
+    def _row_norms(indptr, values):
+        if values is None or not len(values):
+            return np.zeros(len(indptr) - 1)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return np.sqrt(
+            np.bincount(rows, weights=np.square(values), minlength=len(indptr) - 1)
+        )
+
+    @staticmethod
+    def _quantize(lengths, values):
+        """
+        按行量化为 int8
+
+        缩放系数取 max(1, 行内最大绝对值 / 127)，
+        计数不超过 127 的行可以无损保存。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        starts = np.cumsum(lengths) - lengths
+        peaks = np.maximum.reduceat(np.append(np.abs(values), 0.0), starts)
+        peaks[lengths == 0] = 0
+        scales = np.maximum(1.0, peaks / 127.0).astype(np.float32)
+
+        quantized = np.rint(values / np.repeat(scales, lengths))
+        return np.clip(quantized, -127, 127).astype(np.int8), scales
+
+    def _dequantize(self):
+        """全部非零元素的值（float64，已乘回缩放系数）"""
+        values = self.values.view.astype(np.float64)
+        if self.quantized:
+            values *= np.repeat(self.scales.view, np.diff(self.indptr.view))
+        return values
+
+    def row_values(self, rows):
+        """
+        rows 各行的非零元素
+
+        返回 (在 indices 中的位置, 每行长度, float64 值)。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions, lengths = self._positions(rows)
+        values = self.values.view[positions].astype(np.float64)
+        if self.quantized:
+            values *= np.repeat(self.scales.view[rows], lengths)
+        return positions, lengths, values
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def append(self, indptr, indices, values):
+        """追加一批 CSR 行（indptr 从 0 开始，values 为 float64 原始值）"""
+        indptr = np.asarray(indptr, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        lengths = np.diff(indptr)
+
+        self.indptr.extend(indptr[1:] + len(self.indices))
+        self.indices.extend(indices)
+        if self.quantized:
+            stored, scales = self._quantize(lengths, values)
+            self.values.extend(stored)
+            self.scales.extend(scales)
+            # 范数按量化后实际保存的值计算，与打分保持一致
+            values = stored * np.repeat(scales.astype(np.float64), lengths)
+        else:
+            self.values.extend(values)
+        self.norms.extend(self._row_norms(indptr, values))
+
+    def replace(self, row, indices, values):
+        """用新的非零元素替换第 row 行（values 为 float64 原始值），其后的行平移"""
+        values = np.asarray(values, dtype=np.float64)
+        lengths = np.array([len(values)])
+        start, end = self.indptr.view[row : row + 2]
+
+        if self.quantized:
+            stored, scales = self._quantize(lengths, values)
+            self.scales.splice(row, row + 1, scales)
+            values = stored * np.float64(scales[0])
+        else:
+            stored = values
+
+        self.indices.splice(start, end, indices)
+        self.values.splice(start, end, stored)
+        shift = len(values) - (end - start)
+        self.indptr.splice(
+            row + 1, len(self.indptr), self.indptr.view[row + 1 :] + shift
+        )
+        self.norms.splice(row, row + 1, self._row_norms(np.r_[0, lengths], values))
+        if self._columns is not None:
+            self._columns.mark_stale(row)
+
+    def _positions(self, rows):
+        """
+        rows 各行非零元素在 indices/values 中的位置，以及每行的长度
+
+        rows 为连续行号时返回切片，避免额外的花式索引。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        indptr = self.indptr.view
+        starts = indptr[rows]
+        lengths = indptr[rows + 1] - starts
+
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            return slice(starts[0], starts[0] + lengths.sum()), lengths
+
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        return positions, lengths
+
+    def dot(self, rows, dense):
+        """
+        rows 各行与稠密向量（或 EMBEDDING_DIM × m 矩阵各列）的点积
+
+        待计算的行非零元素较多时，建立（或更新）按列副本，并在按列读取
+        查询非零列的倒排表代价更小时按列计算；否则按行计算。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        matrix = dense if dense.ndim == 2 else dense[:, None]
+        dots = self._dot(rows, matrix)
+        return dots if dense.ndim == 2 else dots[:, 0]
+
+    def _column_index(self):
+        """按列副本；不存在或过期的行过多时重建"""
+        columns = self._columns
+        if columns is not None:
+            stale = len(self) - columns.size + columns.stale_count
+            if stale <= max(COLUMN_INDEX_MIN_STALE, columns.size // 4):
+                return columns
+        self._columns = _ColumnIndex(self)
+        return self._columns
+
+    def _dot(self, rows, matrix):
+        if not len(rows):
+            return np.zeros((0, matrix.shape[1]))
+
+        indptr = self.indptr.view
+        row_cost = int((indptr[rows + 1] - indptr[rows]).sum())
+        if row_cost >= COLUMN_INDEX_MIN_NNZ:
+            index = self._column_index()
+            # 每个查询各自读取自己非零列的倒排表，并产生一个 size 长的结果
+            column_cost = sum(
+                index.cost(np.flatnonzero(matrix[:, j])) + index.size
+                for j in range(matrix.shape[1])
+            )
+            if column_cost < row_cost:
+                return self._dot_columns(index, rows, matrix)
+        return self._dot_rows(rows, matrix)
+
+    def _dot_columns(self, index, rows, matrix):
+        """按列副本计算点积；副本未覆盖或已过期的行按行计算"""
+        covered = rows < index.size
+        covered[covered] = ~index.stale[rows[covered]]
+        dots = np.empty((len(rows), matrix.shape[1]))
+        for j in range(matrix.shape[1]):
+            full = index.dot(matrix[:, j])
+            if self.quantized:
+                full *= self.scales.view[: index.size]
+            dots[covered, j] = full[rows[covered]]
+        if not covered.all():
+            dots[~covered] = self._dot_rows(rows[~covered], matrix)
+        return dots
+
+    def _dot_rows(self, rows, matrix):
+        """
+        按行计算点积
+
+        查询向量很稀疏：先用布尔查找表筛出落在查询非零列上的元素，
+        只对这些元素取值相乘，m 个查询共用一次筛选。
+        """
+        positions, lengths = self._positions(rows)
+        indices = self.indices.view[positions]
+        lookup = matrix.any(axis=1)
+        hits = np.flatnonzero(lookup[indices])
+        if not len(hits):
+            return np.zeros((len(rows), matrix.shape[1]))
+
+        if isinstance(positions, slice):
+            value_positions = positions.start + hits
+        else:
+            value_positions = positions[hits]
+        values = self.values.view[value_positions].astype(np.float64)
+
+        # 查询的非零列压缩成小矩阵，按命中元素的列取行相乘
+        columns = np.flatnonzero(lookup)
+        slots = np.zeros(EMBEDDING_DIM, dtype=np.intp)
+        slots[columns] = np.arange(len(columns))
+        products = matrix[columns][slots[indices[hits]]]
+        products *= values[:, None]
+
+        # 命中元素按行分段求和，没有命中元素的行结果置 0
+        row_starts = np.cumsum(lengths) - lengths
+        hit_rows = np.searchsorted(row_starts, hits, side="right") - 1
+        bounds = np.searchsorted(hit_rows, np.arange(len(rows)))
+        nonempty = np.diff(np.append(bounds, len(hits))) > 0
+        dots = np.zeros((len(rows), matrix.shape[1]))
+        dots[nonempty] = np.add.reduceat(products, bounds[nonempty], axis=0)
+
+        if self.quantized:
+            # 同一行共用一个缩放系数，求和之后再乘
+            dots *= self.scales.view[rows][:, None]
+        return dots
+
+    def to_dense(self, rows):
+        """把 rows 展开为稠密矩阵"""
+        positions, lengths, values = self.row_values(rows)
+        matrix = np.zeros((len(lengths), EMBEDDING_DIM))
+        row_ids = np.repeat(np.arange(len(lengths)), lengths)
+        matrix[row_ids, self.indices.view[positions]] = values
+        return matrix
+
+    def dot_dense(self, rows, dense, chunk_size=512):
+        """
+        rows 各行与稠密矩阵 dense（EMBEDDING_DIM × m）的乘积，返回 len(rows) × m
+
+        分块展开为 dense 同类型的稠密矩阵后交给 BLAS，
+        比逐个非零元素取出 dense 的行相乘快得多。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.zeros((len(rows), dense.shape[1]), dtype=dense.dtype)
+        block = np.zeros((min(chunk_size, len(rows)), EMBEDDING_DIM), dense.dtype)
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            positions, lengths, values = self.row_values(chunk)
+            row_ids = np.repeat(np.arange(len(chunk)), lengths)
+            columns = self.indices.view[positions]
+
+            block[row_ids, columns] = values
+            result[start : start + len(chunk)] = block[: len(chunk)] @ dense
+            block[row_ids, columns] = 0
+        return result
+
+    def delete(self, rows):
+        """删除若干行"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if not len(rows):
+            return
+        # 行号整体前移，按列副本在下次查询时重建
+        self._columns = None
+
+        positions, lengths = self._positions(rows)
+        if isinstance(positions, slice):
+            positions = np.arange(positions.start, positions.stop)
+        self.indices.delete(positions)
+        self.values.delete(positions)
+        self.norms.delete(rows)
+        if self.quantized:
+            self.scales.delete(rows)
+
+        # 剩余行的起点减去前面被删掉的元素个数
+        indptr = self.indptr.view
+        removed = np.zeros(len(indptr), dtype=np.int64)
+        removed[rows + 1] = lengths
+        shifted = indptr - np.cumsum(removed)
+        self.indptr.clear()
+        self.indptr.extend(np.delete(shifted, rows + 1))
+
+    def clear(self):
+        self._columns = None
+        self.indptr.clear()
+        self.indptr.extend([0])
+        for array in (self.indices, self.values, self.scales, self.norms):
+            array.clear()
+
+    def _arrays(self):
+        names = ["indptr", "indices", "values", "norms"]
+        return names + ["scales"] if self.quantized else names
+
+    def save(self, prefix):
+        """
+        保存为 <prefix>.<indptr|indices|values|norms|scales>.npy
+
+        非零元素达到 COLUMN_INDEX_MIN_NNZ 时一并重建并写出按列副本
+        （<prefix>.columns.*.npy），打开快照后的首次查询不必再建立。
+        """
+        for name in self._arrays():
+            path = f"{prefix}.{name}.npy"
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, getattr(self, name).view)
+            os.replace(path + ".tmp", path)
+        if len(self.values) >= COLUMN_INDEX_MIN_NNZ:
+            self._columns = _ColumnIndex(self)
+            self._columns.save(prefix)
+
+    @classmethod
+    def load(cls, prefix, dtype="float32", mmap=True):
+        """
+        加载快照
+
+        mmap=True 时以只读内存映射打开，启动几乎不读盘；
+        快照的存储类型与 dtype 不一致时按 dtype 重新转换。
+        """
+        mode = "r" if mmap else None
+        arrays = {}
+        for name in ("indptr", "indices", "values", "norms", "scales"):
+            path = f"{prefix}.{name}.npy"
+            if os.path.exists(path):
+                arrays[name] = np.load(path, mmap_mode=mode)
+
+        stored = np.dtype(arrays["values"].dtype)
+        if stored == np.dtype(dtype):
+            matrix = cls(dtype=dtype, **arrays)
+            matrix._columns = _ColumnIndex.load(prefix, len(matrix), mmap)
+            return matrix
+
+        matrix = cls(dtype=stored, **arrays)
+        values = matrix._dequantize()
+        return cls(matrix.indptr.view, matrix.indices.view, values, dtype=dtype)
+
+
+def _shift_rows(rows, deleted):
+    """删除 deleted（升序）这些行号后，rows 中剩余行号的新值"""
+    kept = rows[~np.isin(rows, deleted)]
+    return kept - np.searchsorted(deleted, kept)
+
+
+def _spherical_kmeans(matrix, rows, k, iterations=8, seed=0):
+    """
+    对稀疏矩阵的若干行做球面 k-means，返回 k × EMBEDDING_DIM 的单位化质心
+
+    行先按范数归一化；质心更新用 bincount 直接在非零元素上累加，
+    不需要展开整批稠密矩阵。
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(rows, dtype=np.int64)
+    positions, lengths, values = matrix.row_values(rows)
+    columns = matrix.indices.view[positions].astype(np.int64)
+    norms = matrix.norms.view[rows]
+    values = values / np.repeat(np.where(norms > 0, norms, 1.0), lengths)
+
+    centroids = matrix.to_dense(np.sort(rng.choice(rows, k, replace=False)))
+    centroids = centroids.astype(np.float32)
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    for _ in range(iterations):
+        labels = np.argmax(matrix.dot_dense(rows, centroids.T), axis=1)
+        sums = np.bincount(
+            np.repeat(labels, lengths) * EMBEDDING_DIM + columns,
+            weights=values,
+            minlength=k * EMBEDDING_DIM,
+        ).reshape(k, EMBEDDING_DIM)
+
+        # 空簇用随机行重新初始化
+        empty = np.flatnonzero(np.bincount(labels, minlength=k) == 0)
+        if len(empty):
+            sums[empty] = matrix.to_dense(np.sort(rng.choice(rows, len(empty))))
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    return centroids
+
+
+class _IVFIndex:
+    """
+    倒排文件（IVF）近似最近邻索引，每个 collection 一个
+
+    用球面 k-means 把行聚成 k 簇，查询时只对与查询最相近的 nprobe 个簇
+    内的行精确打分。collection 的行按顺序归簇：前 assigned 行已归簇，
+    其后新增的行在下一次更新时批量归簇。
+    """
+
+    def __init__(self, centroids, trained_size):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.trained_size = trained_size
+        self.lists = [_GrowableArray(dtype=np.int64) for _ in self.centroids]
+        self.assigned = 0
+
+    def assign(self, matrix, rows):
+        """把新行归入最近的簇"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        labels = np.argmax(matrix.dot_dense(rows, self.centroids.T), axis=1)
+        self.add(rows, labels)
+
+    def add(self, rows, labels):
+        if not len(rows):
+            return
+        order = np.argsort(labels, kind="stable")
+        labels = labels[order]
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        ends = np.r_[starts[1:], len(labels)]
+        # 只追加到实际出现的簇
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self.lists[labels[start]].extend(rows[order[start:end]])
+        self.assigned += len(rows)
+
+    def reassign(self, matrix, row):
+        """行的向量改变后，把已归簇的 row 移到新的最近簇"""
+        for index in self.lists:
+            position = np.searchsorted(index.view, row)
+            if position < len(index) and index.view[position] == row:
+                index.splice(position, position + 1, [])
+                break
+        else:
+            # 尚未归簇，之后按新向量归簇
+            return
+
+        label = np.argmax(matrix.dot_dense([row], self.centroids.T)[0])
+        target = self.lists[label]
+        position = np.searchsorted(target.view, row)
+        target.splice(position, position, [row])
+
+    def labels(self):
+        """已归簇行的簇号，按行号升序"""
+        rows = np.concatenate([index.view for index in self.lists])
+        labels = np.repeat(
+            np.arange(len(self.lists)), [len(index) for index in self.lists]
+        )
+        return labels[np.argsort(rows, kind="stable")]
+
+    def shift(self, deleted):
+        """行号整体平移（删除行之后）"""
+        for index in self.lists:
+            kept = _shift_rows(index.view, deleted)
+            index.clear()
+            index.extend(kept)
+        self.assigned = sum(len(index) for index in self.lists)
+
+    def probe(self, query, nprobe):
+        """与查询最相近的 nprobe 个簇中的全部行号（升序）"""
+        scores = self.centroids @ query.astype(np.float32)
+        nprobe = min(nprobe, len(self.lists))
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.lists[i].view for i in probes]))
+
+
+class _BM25Index:
+    """
+    BM25 倒排索引，每个 collection 一个
+
+    词项是相邻两个字（汉字或字母数字）组成的二元组。倒排表按段保存：
+    每段是按 (词项, 行号) 排序的 (terms, rows, tfs) 三个数组，
+    查询时对每个词项二分定位。collection 的行按顺序建索引：前 indexed 行
+    已建索引，其后新增的行在下一次查询时作为新段加入，相邻段规模相近时
+    合并，每条倒排记录被合并 O(log n) 次。
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.segments = []
+        # 已建索引的行号（升序）及其词项数
+        self.rows = _GrowableArray(dtype=np.int64)
+        self.lengths = _GrowableArray(dtype=np.int64)
+        self.indexed = 0
+
+    def add(self, rows, texts):
+        """为新行建索引"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        doc_ids, terms = _bigram_terms(texts)
+        self.rows.extend(rows)
+        self.lengths.extend(np.bincount(doc_ids, minlength=len(rows)))
+        self.indexed += len(rows)
+
+        segment = self._build(terms, rows[doc_ids], np.ones(len(terms), np.int64))
+        self.segments.append(segment)
+        while len(self.segments) > 1 and len(self.segments[-2][0]) <= 2 * len(
+            self.segments[-1][0]
+        ):
+            last = self.segments.pop()
+            previous = self.segments.pop()
+            self.segments.append(
+                self._build(*(np.concatenate(a) for a in zip(previous, last)))
+            )
+
+    @staticmethod
+    def _build(terms, rows, tfs):
+        """
+        按 (词项, 行号) 排序并合并重复项，累加词频
+
+        调用时 rows 总是非降序的（新段按行号生成，合并时后一段的行号
+        都大于前一段），所以按词项稳定排序即可。
+        """
+        order = np.argsort(terms, kind="stable")
+        terms, rows, tfs = terms[order], rows[order], tfs[order]
+        if not len(terms):
+            return terms, rows, tfs
+        starts = np.flatnonzero(
+            np.r_[True, (terms[1:] != terms[:-1]) | (rows[1:] != rows[:-1])]
+        )
+        return terms[starts], rows[starts], np.add.reduceat(tfs, starts)
+
+    def scores(self, query_terms):
+        """
+        与查询词项有交集的行及其 BM25 得分，返回 (行号升序, 得分)
+
+        文档总数、平均长度和文档频率按已建索引的全部行（含已删除的行）统计。
+        """
+        count = len(self.rows)
+        if not count:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        average = max(self.lengths.view.sum() / count, 1e-12)
+
+        matched_rows, matched_scores = [], []
+        for term in np.unique(query_terms).tolist():
+            postings = []
+            for terms, rows, tfs in self.segments:
+                lo = np.searchsorted(terms, term, side="left")
+                hi = np.searchsorted(terms, term, side="right")
+                if hi > lo:
+                    postings.append((rows[lo:hi], tfs[lo:hi]))
+            if not postings:
+                continue
+
+            rows = np.concatenate([p[0] for p in postings])
+            tfs = np.concatenate([p[1] for p in postings]).astype(np.float64)
+            df = len(rows)
+            idf = np.log1p((count - df + 0.5) / (df + 0.5))
+            lengths = self.lengths.view[np.searchsorted(self.rows.view, rows)]
+            norm = self.K1 * (1 - self.B + self.B * lengths / average)
+            matched_rows.append(rows)
+            matched_scores.append(idf * tfs * (self.K1 + 1) / (tfs + norm))
+
+        if not matched_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        return rows, np.bincount(inverse, weights=np.concatenate(matched_scores))
+
+
+class _EmbeddingCache:
+    """
+    查询文本向量的 LRU 缓存（只用于 search / search_many 的查询文本；
+    写入的文档向量已经保存在向量矩阵中，不进入缓存）
+
+    键为「向量化算法标识 + 文本」的 128 位 BLAKE2b 哈希，值为该文本的
+    稀疏向量 (indices, values)。可以保存为 npz 文件，下次启动时加载。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(text):
+        data = f"{EMBEDDER_ID}\0{text}".encode("utf-8", "surrogatepass")
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, indices, values):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (indices, values)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        self.dirty = True
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def save(self, path):
+        """按从旧到新的顺序保存（先写临时文件再替换）"""
+        entries = list(self._entries.items())
+        lengths = [len(indices) for _, (indices, _) in entries]
+        indptr = np.zeros(len(entries) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(lengths)
+
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                embedder=np.array(EMBEDDER_ID),
+                keys=np.array([key for key, _ in entries], dtype="S16"),
+                indptr=indptr,
+                indices=np.concatenate(
+                    [indices for _, (indices, _) in entries] + [np.zeros(0, np.int32)]
+                ),
+                values=np.concatenate(
+                    [values for _, (_, values) in entries] + [np.zeros(0)]
+                ),
+            )
+        os.replace(path + ".tmp", path)
+        self.dirty = False
+
+    def load(self, path):
+        """加载缓存文件；向量化算法不一致或文件损坏时忽略"""
+        try:
+            with np.load(path) as archive:
+                if str(archive["embedder"]) != EMBEDDER_ID:
+                    return
+                keys = archive["keys"].tolist()
+                indptr = archive["indptr"]
+                indices = archive["indices"]
+                values = archive["values"]
+        except (OSError, ValueError, KeyError):
+            return
+
+        for i in range(max(0, len(keys) - self.maxsize), len(keys)):
+            lo, hi = indptr[i], indptr[i + 1]
+            self._entries[keys[i]] = (indices[lo:hi], values[lo:hi])
+
+
+def _ngram_hashes(codepoints, n=NGRAM_SIZE):
+    """
+    所有字符 n-gram 的 64 位 FNV-1a 哈希（逐码位，向量化）
+
+    与 Python 内置 hash() 不同，结果不受 PYTHONHASHSEED 影响，
+    不同进程、不同机器得到的向量可以直接比较。
+    """
+    count = len(codepoints) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    hashes = np.full(count, _FNV_OFFSET, dtype=np.uint64)
+    for k in range(n):
+        hashes ^= codepoints[k : k + count]
+        hashes *= _FNV_PRIME
+    return hashes
+
+
+def _batch_features(texts):
+    """
+    整批文本的特征，返回 (文档序号, 列号)
+
+    全部文本一次编码为码位数组，n-gram 哈希在整批上用数组运算滚动计算，
+    跨越文档边界的 n-gram 丢弃；字符直方图列号在前，n-gram 哈希桶列号
+    （已偏移 256）在后，同一列号出现几次即计数几次。
+    """
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    codepoints = np.frombuffer(
+        "".join(texts).encode("utf-32-le", "surrogatepass"), dtype=np.uint32
+    ).astype(np.uint64)
+    doc_ids = np.repeat(np.arange(len(texts)), lengths)
+
+    # 统计字符出现频率（使用常见字符范围）
+    is_char = codepoints < 256
+
+    # 字符级别的 n-gram 特征：起点和终点在同一篇文档内才有效
+    hashes = _ngram_hashes(codepoints)
+    starts = doc_ids[: len(hashes)]
+    valid = starts == doc_ids[NGRAM_SIZE - 1 :]
+    keys = 256 + hashes[valid] % np.uint64(NGRAM_BUCKETS)
+
+    return (
+        np.concatenate([doc_ids[is_char], starts[valid]]),
+        np.concatenate([codepoints[is_char], keys]).astype(np.int64),
+    )
+
+
+def _text_features(text):
+    """单篇文本的特征列号"""
+    return _batch_features([text])[1]
+
+
+def _bigram_terms(texts):
+    """
+    整批文本的 BM25 词项，返回 (文档序号, 词项)
+
+    词项是同一篇文档内相邻两个「字」的码位对（编码为一个整数），
+    「字」指汉字和字母数字，英文字母不区分大小写；标点和空白把文本断开。
+    """
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    codepoints = np.frombuffer(
+        "".join(texts).encode("utf-32-le", "surrogatepass"), dtype=np.uint32
+    ).astype(np.int64)
+    doc_ids = np.repeat(np.arange(len(texts)), lengths)
+
+    upper = (codepoints >= 0x41) & (codepoints <= 0x5A)
+    codepoints = np.where(upper, codepoints + 0x20, codepoints)
+    is_word = (
+        ((codepoints >= 0x30) & (codepoints <= 0x39))
+        | ((codepoints >= 0x61) & (codepoints <= 0x7A))
+        | ((codepoints >= 0x3400) & (codepoints <= 0x9FFF))
+        | ((codepoints >= 0xF900) & (codepoints <= 0xFAFF))
+        | ((codepoints >= 0x20000) & (codepoints <= 0x3134F))
+    )
+
+    valid = is_word[:-1] & is_word[1:] & (doc_ids[:-1] == doc_ids[1:])
+    terms = codepoints[:-1][valid] * 0x110000 + codepoints[1:][valid]
+    return doc_ids[:-1][valid], terms
+
+
+def _embed_texts(texts, chunk_size=256):
+    """
+    批量向量化，返回 CSR 形式的 (indptr, indices, values)
+
+    每 chunk_size 篇一块计数：特征较密（长文本）时用 np.bincount 在
+    (文档, 列号) 上直接计数，较稀疏（短文本）时排序去重更快。
+    结果按行、列号升序排列。
+    """
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices, values = [], []
+    nnz = 0
+
+    for start in range(0, len(texts), chunk_size):
+        chunk = texts[start : start + chunk_size]
+        rows, columns = _batch_features(chunk)
+        keys = rows * EMBEDDING_DIM + columns
+
+        if len(keys) * 8 >= len(chunk) * EMBEDDING_DIM:
+            counts = np.bincount(keys, minlength=len(chunk) * EMBEDDING_DIM)
+            # 先比较成布尔数组再取非零位置，比直接在计数数组上快得多
+            keys = np.flatnonzero(counts > 0)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+
+        row_offsets = np.arange(len(chunk)) * EMBEDDING_DIM
+        row_ends = np.searchsorted(keys, row_offsets + EMBEDDING_DIM)
+        row_nnz = np.diff(row_ends, prepend=0)
+
+        indptr.append(nnz + row_ends)
+        indices.append((keys - np.repeat(row_offsets, row_nnz)).astype(np.int32))
+        values.append(counts.astype(np.float64))
+        nnz += len(keys)
+
+    return (
+        np.concatenate(indptr),
+        np.concatenate(indices + [np.zeros(0, dtype=np.int32)]),
+        np.concatenate(values + [np.zeros(0)]),
+    )
+
+
+def _shard_layout(rows, nnz_bound):
+    """
+    分片共享内存的布局，返回 (values 偏移, indices 偏移, 总字节数)
+
+    依次存放 indptr(int64, rows + 1)、values(float64, nnz_bound)、
+    indices(int32, nnz_bound)。
+    """
+    values_offset = (rows + 1) * 8
+    indices_offset = values_offset + nnz_bound * 8
+    return values_offset, indices_offset, indices_offset + nnz_bound * 4
+
+
+def _shard_nnz_bound(texts):
+    """分片非零元素数的上界：每个字符至多贡献一个字符列和一个 n-gram 列"""
+    return 2 * sum(len(text) for text in texts)
+
+
+def _embed_shard(name, texts, nnz_bound):
+    """
+    进程池工作函数：向量化一批文本，写入主进程分配的共享内存 name，
+    返回非零元素数
+
+    共享内存由主进程创建和释放：Windows 上命名共享内存在最后一个句柄
+    关闭时即被释放，工作进程创建的共享内存等不到主进程打开。
+    """
+    indptr, indices, values = _embed_texts(texts)
+    if len(indices) > nnz_bound:
+        raise ValueError(f"非零元素数 {len(indices)} 超过上界 {nnz_bound}")
+
+    values_offset, indices_offset, _ = _shard_layout(len(texts), nnz_bound)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        for array, offset in (
+            (indptr, 0),
+            (values, values_offset),
+            (indices, indices_offset),
+        ):
+            target = np.ndarray(array.shape, array.dtype, buffer=shm.buf, offset=offset)
+            target[:] = array
+            del target
+    finally:
+        shm.close()
+    return len(indices)
+
+
+def _read_shard(shm, rows, nnz, nnz_bound):
+    """复制出工作进程写入共享内存的 CSR 数组"""
+    values_offset, indices_offset, _ = _shard_layout(rows, nnz_bound)
+    indptr = np.ndarray(rows + 1, np.int64, buffer=shm.buf).copy()
+    values = np.ndarray(nnz, np.float64, buffer=shm.buf, offset=values_offset).copy()
+    indices = np.ndarray(nnz, np.int32, buffer=shm.buf, offset=indices_offset).copy()
+    return indptr, indices, values
+
+
+def _embed_parallel(texts, workers, shard_size=None):
+    """
+    用进程池并行向量化，返回与 _embed_texts 相同的 CSR 数组
+
+    文本按顺序切成若干分片，每个工作进程约分到 4 片；主进程为每片按
+    非零元素数的上界分配共享内存，工作进程写入向量（不经过 pickle），
+    主进程按分片顺序复制后释放。同时在途的分片不超过进程数的两倍，
+    限制共享内存的总占用。
+    """
+    if shard_size is None:
+        shard_size = max(256, -(-len(texts) // (workers * 4)))
+    shards = [texts[i : i + shard_size] for i in range(0, len(texts), shard_size)]
+
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices, values = [], []
+    nnz = 0
+    # 先启动资源跟踪进程，工作进程与主进程共用它，
+    # 工作进程打开、主进程 unlink 的共享内存才不会被重复清理
+    resource_tracker.ensure_running()
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit(shard):
+            bound = _shard_nnz_bound(shard)
+            shm = shared_memory.SharedMemory(
+                create=True, size=max(1, _shard_layout(len(shard), bound)[2])
+            )
+            future = executor.submit(_embed_shard, shm.name, shard, bound)
+            in_flight.append((shm, len(shard), bound, future))
+
+        pending = iter(shards)
+        try:
+            for shard in itertools.islice(pending, workers * 2):
+                submit(shard)
+            while in_flight:
+                shm, rows, bound, future = in_flight.popleft()
+                try:
+                    shard_nnz = future.result()
+                    shard_indptr, shard_indices, shard_values = _read_shard(
+                        shm, rows, shard_nnz, bound
+                    )
+                finally:
+                    shm.close()
+                    shm.unlink()
+                indptr.append(nnz + shard_indptr[1:])
+                indices.append(shard_indices)
+                values.append(shard_values)
+                nnz += shard_nnz
+                for shard in itertools.islice(pending, 1):
+                    submit(shard)
+        finally:
+            # 出错时等未完成的分片结束后再释放它们的共享内存
+            for shm, _, _, future in in_flight:
+                future.cancel()
+            for shm, _, _, future in in_flight:
+                try:
+                    future.exception()
+                except Exception:
+                    pass
+                shm.close()
+                shm.unlink()
+
+    return (
+        np.concatenate(indptr),
+        np.concatenate(indices + [np.zeros(0, dtype=np.int32)]),
+        np.concatenate(values + [np.zeros(0)]),
+    )
+
+
+def _read_blob(path, mapped=True):
+    """读取二进制文件；mapped=True 时以只读内存映射打开（空文件直接读入）"""
+    with open(path, "rb") as f:
+        if not mapped or os.fstat(f.fileno()).st_size == 0:
+            return f.read()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _RecordStore:
+    """
+    文档记录表：行号 → {"id", "collection", "document", "metadata", "timestamp"}
+
+    快照中的记录按列保存，打开时只映射数组，不解析正文和元数据：
+        <prefix>.ids.npy            文档 id（int64）
+        <prefix>.collection.npy     collection 编号（int32，名称表在 .collections.json）
+        <prefix>.chapter.npy        metadata["chapter"]（int64，不存在或不是整数
+                                    时为哨兵值）
+        <prefix>.timestamp.npy      时间戳（datetime64[us]，无法无损表示时为 NaT）
+        <prefix>.docs.bin           UTF-8 正文，按 .docs.offsets.npy 定位
+        <prefix>.extra.bin          其余元数据和字段的 JSON，按 .extra.offsets.npy 定位
+
+    访问某一行时才解码为 dict 并缓存，调用方对 dict 的修改在下次保存时写回；
+    快照之后新增的行直接以 dict 保存在尾部。
+    """
+
+    def __init__(self, entries=None):
+        # 快照部分（前 _size 行）
+        self._size = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._codes = np.zeros(0, dtype=np.int32)
+        self._chapters = np.zeros(0, dtype=np.int64)
+        self._timestamps = np.zeros(0, dtype="datetime64[us]")
+        self._docs = b""
+        self._doc_starts = self._doc_ends = np.zeros(0, dtype=np.int64)
+        self._extra = b""
+        self._extra_starts = self._extra_ends = np.zeros(0, dtype=np.int64)
+        self.collections = []
+        # 快照行号 → 已解码的 dict
+        self._decoded = {}
+        # 快照之后新增的行
+        self._tail = list(entries or [])
+
+    def __len__(self):
+        return self._size + len(self._tail)
+
+    def __getitem__(self, row):
+        if row >= self._size:
+            return self._tail[row - self._size]
+        entry = self._decoded.get(row)
+        if entry is None:
+            entry = self._decoded[row] = self._decode(row)
+        return entry
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def append(self, entry):
+        self._tail.append(entry)
+
+    def extend(self, entries):
+        self._tail.extend(entries)
+
+    def _raw(self, row):
+        """快照行是否还未解码（列中的值仍然有效）"""
+        return row < self._size and row not in self._decoded
+
+    def _decode(self, row):
+        extra = json.loads(
+            self._extra[self._extra_starts[row] : self._extra_ends[row]].decode(
+                "utf-8", "surrogatepass"
+            )
+        )
+        metadata = extra.pop("metadata")
+        chapter = int(self._chapters[row])
+        if chapter not in (_CHAPTER_MISSING, _CHAPTER_OTHER):
+            metadata["chapter"] = chapter
+
+        entry = {
+            "id": int(self._ids[row]),
+            "collection": self.collections[self._codes[row]],
+            "document": self._document(row),
+            "metadata": metadata,
+        }
+        timestamp = self._timestamps[row]
+        if not np.isnat(timestamp):
+            entry["timestamp"] = np.datetime_as_string(timestamp, unit="us")
+        entry.update(extra)
+        return entry
+
+    def _document(self, row):
+        start, end = self._doc_starts[row], self._doc_ends[row]
+        return self._docs[start:end].decode("utf-8", "surrogatepass")
+
+    def documents(self, rows):
+        """rows 的正文（未解码的快照行直接从正文文件读取，不缓存）"""
+        return [
+            self._document(row) if self._raw(row) else self[row]["document"]
+            for row in rows
+        ]
+
+    def metadata_values(self, key, rows):
+        """rows 的 metadata[key]，不存在时为 None；chapter 字段优先从列中读取"""
+        rows = list(rows)
+        chapters = None
+        if key == "chapter" and self._size and rows:
+            # 与 rows 一一对应地一次取出整列（尾部行的取值不使用）
+            head = np.minimum(np.asarray(rows, dtype=np.int64), self._size - 1)
+            chapters = self._chapters[head].tolist()
+
+        values = []
+        for k, row in enumerate(rows):
+            if not self._raw(row):
+                values.append(self[row]["metadata"].get(key))
+            elif chapters is not None and chapters[k] == _CHAPTER_MISSING:
+                values.append(None)
+            elif chapters is not None and chapters[k] != _CHAPTER_OTHER:
+                values.append(chapters[k])
+            else:
+                values.append(self._decode(row)["metadata"].get(key))
+        return values
+
+    def index_columns(self, start):
+        """
+        start 之后各行的 (id, collection 编号, 编号 → 名称表)
+
+        快照行直接取列；尾部没有 id 的旧版记录 id 为 -1。
+        """
+        names = list(self.collections)
+        lookup = {name: code for code, name in enumerate(names)}
+        ids, codes = [], []
+        for entry in self._tail[max(start - self._size, 0) :]:
+            ids.append(entry.get("id", -1))
+            code = lookup.get(entry["collection"])
+            if code is None:
+                code = lookup[entry["collection"]] = len(names)
+                names.append(entry["collection"])
+            codes.append(code)
+
+        head = slice(min(start, self._size), self._size)
+        return (
+            np.concatenate([self._ids[head], np.array(ids, dtype=np.int64)]),
+            np.concatenate([self._codes[head], np.array(codes, dtype=np.int32)]),
+            names,
+        )
+
+    def keep(self, alive):
+        """只保留 alive 为 True 的行（压缩时移除已删除的行）"""
+        alive = np.asarray(alive, dtype=bool)
+        head, tail = alive[: self._size], alive[self._size :]
+        rows = np.cumsum(head) - 1
+        self._decoded = {
+            int(rows[row]): entry for row, entry in self._decoded.items() if head[row]
+        }
+        for name in (
+            "_ids",
+            "_codes",
+            "_chapters",
+            "_timestamps",
+            "_doc_starts",
+            "_doc_ends",
+            "_extra_starts",
+            "_extra_ends",
+        ):
+            setattr(self, name, getattr(self, name)[head])
+        self._size = int(head.sum())
+        self._tail = [entry for entry, keep in zip(self._tail, tail.tolist()) if keep]
+
+    def save(self, prefix):
+        """
+        写出列式快照
+
+        未解码的快照行直接复制原始字节，只有解码过或新增的行重新编码。
+        """
+        count = len(self)
+        names = list(self.collections)
+        lookup = {name: code for code, name in enumerate(names)}
+        ids = np.empty(count, dtype=np.int64)
+        codes = np.empty(count, dtype=np.int32)
+        chapters = np.empty(count, dtype=np.int64)
+        timestamps = np.empty(count, dtype="datetime64[us]")
+        docs, extras = [], []
+
+        raw = np.zeros(count, dtype=bool)
+        raw[: self._size] = True
+        raw[list(self._decoded)] = False
+        head = np.flatnonzero(raw)
+        ids[head] = self._ids[head]
+        codes[head] = self._codes[head]
+        chapters[head] = self._chapters[head]
+        timestamps[head] = self._timestamps[head]
+
+        doc_spans = zip(self._doc_starts.tolist(), self._doc_ends.tolist())
+        extra_spans = zip(self._extra_starts.tolist(), self._extra_ends.tolist())
+        for row, is_raw in enumerate(raw.tolist()):
+            if row < self._size:
+                doc_start, doc_end = next(doc_spans)
+                extra_start, extra_end = next(extra_spans)
+            if is_raw:
+                docs.append(self._docs[doc_start:doc_end])
+                extras.append(self._extra[extra_start:extra_end])
+                continue
+
+            entry = dict(self[row])
+            ids[row] = entry.pop("id")
+            collection = entry.pop("collection")
+            code = lookup.get(collection)
+            if code is None:
+                code = lookup[collection] = len(names)
+                names.append(collection)
+            codes[row] = code
+            docs.append(entry.pop("document").encode("utf-8", "surrogatepass"))
+
+            metadata = dict(entry.pop("metadata"))
+            chapter = metadata.get("chapter")
+            if "chapter" not in metadata:
+                chapters[row] = _CHAPTER_MISSING
+            elif type(chapter) is int and _CHAPTER_OTHER < chapter < 1 << 63:
+                chapters[row] = chapter
+                # 保留占位，解码时按原来的键顺序填回
+                metadata["chapter"] = None
+            else:
+                chapters[row] = _CHAPTER_OTHER
+
+            timestamps[row] = np.datetime64("NaT")
+            timestamp = entry.get("timestamp")
+            if isinstance(timestamp, str) and _TIMESTAMP_RE.fullmatch(timestamp):
+                timestamps[row] = np.datetime64(timestamp, "us")
+                del entry["timestamp"]
+
+            extras.append(
+                json.dumps({"metadata": metadata, **entry}, ensure_ascii=False).encode(
+                    "utf-8", "surrogatepass"
+                )
+            )
+
+        arrays = {
+            "ids": ids,
+            "collection": codes,
+            "chapter": chapters,
+            "timestamp": timestamps,
+        }
+        for name, blob in (("docs", docs), ("extra", extras)):
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in blob], out=offsets[1:])
+            arrays[f"{name}.offsets"] = offsets
+            path = f"{prefix}.{name}.bin"
+            with open(path + ".tmp", "wb") as f:
+                f.write(b"".join(blob))
+            os.replace(path + ".tmp", path)
+
+        for name, array in arrays.items():
+            path = f"{prefix}.{name}.npy"
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+        path = f"{prefix}.collections.json"
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(names, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """打开列式快照；mmap=True 时数组和正文都以只读内存映射打开"""
+        mode = "r" if mmap else None
+        store = cls()
+        with open(f"{prefix}.collections.json", "r", encoding="utf-8") as f:
+            store.collections = json.load(f)
+        store._ids = np.load(f"{prefix}.ids.npy", mmap_mode=mode)
+        store._codes = np.load(f"{prefix}.collection.npy", mmap_mode=mode)
+        store._chapters = np.load(f"{prefix}.chapter.npy", mmap_mode=mode)
+        store._timestamps = np.load(f"{prefix}.timestamp.npy", mmap_mode=mode)
+        store._size = len(store._ids)
+
+        offsets = np.load(f"{prefix}.docs.offsets.npy", mmap_mode=mode)
+        store._doc_starts, store._doc_ends = offsets[:-1], offsets[1:]
+        store._docs = _read_blob(f"{prefix}.docs.bin", mmap)
+        offsets = np.load(f"{prefix}.extra.offsets.npy", mmap_mode=mode)
+        store._extra_starts, store._extra_ends = offsets[:-1], offsets[1:]
+        store._extra = _read_blob(f"{prefix}.extra.bin", mmap)
+        return store
+
+
+def _wal_record(ops, vectors=None):
+    """
+    把一批操作编码为一条 WAL 记录
+
+    记录头为负载字节数和负载的 CRC32；负载为 JSON 数组形式的操作，
+    后接这批新增行的稀疏向量（每行非零个数、int32 列号、float64 值）。
+    一条记录整体生效或整体丢弃。
+    """
+    text = json.dumps(ops, ensure_ascii=False).encode("utf-8", "surrogatepass")
+    if vectors is None:
+        vectors = (np.zeros(1, dtype=np.int64), np.zeros(0), np.zeros(0))
+    indptr, indices, values = vectors
+    indptr = np.asarray(indptr, dtype=np.int64)
+
+    payload = b"".join(
+        [
+            _WAL_PAYLOAD.pack(len(text), len(indptr) - 1, int(indptr[-1])),
+            text,
+            np.diff(indptr).astype(np.int32).tobytes(),
+            np.asarray(indices, dtype=np.int32).tobytes(),
+            np.asarray(values, dtype=np.float64).tobytes(),
+        ]
+    )
+    return _WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_wal(buffer):
+    """
+    解码 WAL，返回 ([(操作列表, indptr, indices, values), ...], 有效字节数)
+
+    遇到不完整或校验失败的记录即停止，之后的内容视为崩溃遗留的残片。
+    """
+    records = []
+    offset = 0
+    while offset + _WAL_HEADER.size <= len(buffer):
+        size, crc = _WAL_HEADER.unpack_from(buffer, offset)
+        start = offset + _WAL_HEADER.size
+        payload = buffer[start : start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+
+        text_size, rows, nnz = _WAL_PAYLOAD.unpack_from(payload)
+        position = _WAL_PAYLOAD.size
+        ops = json.loads(
+            payload[position : position + text_size].decode("utf-8", "surrogatepass")
+        )
+        position += text_size
+        lengths = np.frombuffer(payload, dtype=np.int32, count=rows, offset=position)
+        position += rows * 4
+        indices = np.frombuffer(payload, dtype=np.int32, count=nnz, offset=position)
+        position += nnz * 4
+        values = np.frombuffer(payload, dtype=np.float64, count=nnz, offset=position)
+
+        indptr = np.zeros(rows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        records.append((ops, indptr, indices, values))
+        offset = start + size
+
+    return records, offset
+
 
 class SimpleVectorDB:
     """
     简化版向量数据库
     使用 numpy 实现余弦相似度搜索
+
+    向量以 CSR 稀疏矩阵保存，只存非零的 n-gram 计数。
+
+    存储采用「快照 + 追加日志」结构：
+        CURRENT                         当前代号（generation）
+        snapshot-<gen>.<ids|collection|chapter|timestamp>.npy,
+        snapshot-<gen>.<docs|extra>.bin 压缩后的完整快照（列式记录，见 _RecordStore）
+        snapshot-<gen>.<indptr|indices|values>.npy  快照向量（CSR）
+        snapshot-<gen>.columns.*.npy    快照向量的按列副本（较大时写出）
+        log-<gen>.wal                   快照之后追加的预写日志（操作 + 稀疏向量）
+
+    add/delete 只向日志末尾追加一条带 CRC32 的记录，日志超过快照规模时
+    自动压缩成新快照，因此单次写入的均摊开销为 O(1)。日志按 sync_interval
+    组提交：距上次 fsync 超过间隔的写入才 fsync，把之前的写入一并落盘；
+    其余写入的 fsync 由后台定时器在首次未落盘写入的 sync_interval 之后完成
+    （或更早由下一次写入、sync()、close() 完成），断电最多丢失这段时间的写入。
+    切换 CURRENT 是快照的提交点，打开时重放日志并截断校验失败的尾部。
+    每条文档有单调递增、永不复用的 id；delete 只在存活位图上打墓碑，
+    查询时跳过，压缩时才真正移除。
+    行数达到 ivf_min_rows 的 collection 会建立 IVF 近似索引
+    （snapshot-<gen>.ivf.npz），search(..., exact=False) 时使用。
+    search(..., mode="hybrid") 使用按需建立的 BM25 倒排索引（不持久化）。
+    旧版的 data.json / vectors.npy 只读打开，首次写入时迁移为快照。
     """
 
-    def __init__(self, persist_directory="./vector_db"):
+    def __init__(
+        self,
+        persist_directory="./vector_db",
+        compact_min_ops=1024,
+        indexed_fields=None,
+        vector_dtype="float32",
+        mmap=True,
+        ivf_min_rows=1024,
+        nprobe=None,
+        embedding_cache_size=4096,
+        persist_embedding_cache=False,
+        sync_interval=0.05,
+    ):
         self.persist_directory = persist_directory
         os.makedirs(persist_directory, exist_ok=True)
 
-        # 数据存储
+        # 向量值的存储类型：float64 / float32（计数特征无损）/ int8（按行量化）
+        self.vector_dtype = np.dtype(vector_dtype).name
+        # 以内存映射方式打开快照向量，按需读入
+        self.mmap = mmap
+
+        # 日志操作数超过 max(compact_min_ops, 记录数) 时压缩
+        self.compact_min_ops = compact_min_ops
+
+        # 日志 fsync 的最小间隔（秒），也是推迟的 fsync 的截止时间：
+        # 0 表示每次写入都 fsync，None 表示从不 fsync（只防进程崩溃，不防断电）
+        self.sync_interval = sync_interval
+
+        # collection 行数达到 ivf_min_rows 时训练 IVF 索引
+        self.ivf_min_rows = ivf_min_rows
+        # 近似查询探查的簇数，None 表示按簇数自动选择
+        self.nprobe = nprobe
+
+        # 额外建立哈希索引的字段：{collection: [字段, ...]}
+        self.indexed_fields = {
+            collection: set(fields)
+            for collection, fields in (indexed_fields or {}).items()
+        }
+
+        # 旧版数据文件（只读，用于迁移）
         self.data_file = os.path.join(persist_directory, "data.json")
         self.vectors_file = os.path.join(persist_directory, "vectors.npy")
+        self.current_file = os.path.join(persist_directory, "CURRENT")
+
+        self._log_fp = None
+        # 已写入但尚未 fsync 的日志；推迟的 fsync 由 _sync_timer 在截止时间完成，
+        # _sync_lock 保护日志句柄和这些状态不被定时器线程同时修改
+        self._unsynced = False
+        self._synced_at = time.monotonic()
+        self._sync_timer = None
+        self._sync_lock = threading.Lock()
+
+        # 查询文本的向量缓存；persist_embedding_cache=True 时在 close() 时保存
+        self._embedding_cache = _EmbeddingCache(embedding_cache_size)
+        self.embedding_cache_file = None
+        if persist_embedding_cache:
+            self.embedding_cache_file = os.path.join(
+                persist_directory, "embedding_cache.npz"
+            )
+            if os.path.exists(self.embedding_cache_file):
+                self._embedding_cache.load(self.embedding_cache_file)
 
         # 加载或初始化数据
         self.load_data()
 
+    # ========== 存储 ==========
+
+    def _prefix(self, kind, generation):
+        """生成指定代号的文件路径前缀"""
+        return os.path.join(self.persist_directory, f"{kind}-{generation:06d}")
+
+    def _path(self, kind, generation, ext):
+        """生成指定代号的文件路径"""
+        return f"{self._prefix(kind, generation)}.{ext}"
+
+    def _read_generation(self):
+        """读取当前代号，不存在时返回 None"""
+        if not os.path.exists(self.current_file):
+            return None
+        with open(self.current_file, "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+
     def load_data(self):
-        """加载数据"""
+        """加载数据：快照 + 日志重放，截断崩溃时写了一半的尾部"""
+        self._close_log()
+        self.generation = self._read_generation()
+        self._log_ops = 0
+
+        if self.generation is None:
+            # 旧版格式或空库
+            self._load_legacy()
+            return
+
+        snapshot_records = self._path("snapshot", self.generation, "ids.npy")
+        snapshot_meta = self._path("snapshot", self.generation, "meta.json")
+        snapshot_vectors = self._path("snapshot", self.generation, "indptr.npy")
+
+        # 没有记录向量化算法的快照来自旧版本，向量不可信
+        meta = {}
+        if os.path.exists(snapshot_meta):
+            with open(snapshot_meta, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        self._embedder_id = meta.get("embedder")
+        self._next_id = meta.get("next_id", 0)
+
+        if os.path.exists(snapshot_records):
+            self.data = _RecordStore.load(
+                self._prefix("snapshot", self.generation), self.mmap
+            )
+        else:
+            self.data = _RecordStore()
+
+        if os.path.exists(snapshot_vectors):
+            self._matrix = _SparseMatrix.load(
+                self._prefix("snapshot", self.generation), self.vector_dtype, self.mmap
+            )
+        else:
+            self._matrix = _SparseMatrix(dtype=self.vector_dtype)
+
+        self._rebuild_collection_index()
+        self._load_ivf()
+        self._replay_log()
+        self._remove_stale_files()
+
+    def _load_legacy(self):
+        """只读加载旧版 data.json / vectors.npy"""
         if os.path.exists(self.data_file):
             with open(self.data_file, "r", encoding="utf-8") as f:
-                self.data = json.load(f)
+                self.data = _RecordStore(json.load(f))
         else:
-            self.data = []
+            self.data = _RecordStore()
 
+        # 旧版向量使用 Python hash()，每个进程都不同，一律视为过期
+        self._embedder_id = None
+        self._next_id = 0
         if os.path.exists(self.vectors_file):
-            self.vectors = np.load(self.vectors_file)
+            self._matrix = _SparseMatrix.from_dense(
+                np.load(self.vectors_file), self.vector_dtype
+            )
         else:
-            self.vectors = np.array([])
+            self._matrix = _SparseMatrix(dtype=self.vector_dtype)
+
+        self._rebuild_collection_index()
+
+    def _replay_log(self):
+        """
+        重放预写日志
+
+        逐条校验记录的长度和 CRC32，以第一条不完整或校验失败的记录为界，
+        之前的记录整批生效，之后的内容（崩溃时写了一半）截断。
+        """
+        log_file = self._path("log", self.generation, "wal")
+        if not os.path.exists(log_file):
+            return
+        with open(log_file, "rb") as f:
+            buffer = f.read()
+
+        records, valid_bytes = _read_wal(buffer)
+        # 正文被更新的行，向量在全部行并入矩阵后重新计算
+        updated = set()
+        for ops, indptr, indices, values in records:
+            for op in ops:
+                self._apply_logged(op, updated)
+            self._matrix.append(indptr, indices, values)
+            self._log_ops += len(ops)
+        self._replace_vectors(sorted(updated))
+
+        if valid_bytes < len(buffer):
+            with open(log_file, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def _apply_logged(self, op, updated):
+        """重放一条日志操作；正文被更新的行加入 updated，之后统一重新向量化"""
+        if op["op"] == "add":
+            self.data.append(op["entry"])
+            self._index_rows(len(self.data) - 1)
+        elif op["op"] == "delete":
+            self._tombstone(self._id_rows(op["ids"]))
+        elif op["op"] == "update":
+            for row in self._id_rows([op["id"]]).tolist():
+                if "metadata" in op:
+                    self._update_metadata_row(row, op["metadata"])
+                if "document" in op:
+                    self.data[row]["document"] = op["document"]
+                    updated.add(row)
+
+    def _load_ivf(self):
+        """加载快照的 IVF 索引（向量化算法不一致时丢弃）"""
+        ivf_file = self._path("snapshot", self.generation, "ivf.npz")
+        if self._embedder_id != EMBEDDER_ID or not os.path.exists(ivf_file):
+            return
+
+        with np.load(ivf_file) as archive:
+            for i, collection in enumerate(archive["collections"].tolist()):
+                ivf = _IVFIndex(archive[f"centroids_{i}"], int(archive[f"trained_{i}"]))
+                labels = archive[f"labels_{i}"]
+                ivf.add(self._rows(collection)[: len(labels)], labels)
+                self._ivf[collection] = ivf
+
+    def _save_ivf(self, generation):
+        """把各 collection 的 IVF 索引写到新快照旁"""
+        if not self._ivf:
+            return
+
+        arrays = {"collections": np.array(list(self._ivf))}
+        for i, ivf in enumerate(self._ivf.values()):
+            arrays[f"centroids_{i}"] = ivf.centroids
+            arrays[f"labels_{i}"] = ivf.labels()
+            arrays[f"trained_{i}"] = np.int64(ivf.trained_size)
+
+        ivf_file = self._path("snapshot", generation, "ivf.npz")
+        with open(ivf_file + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(ivf_file + ".tmp", ivf_file)
+
+    def _remove_stale_files(self):
+        """清理压缩过程中崩溃遗留的其他代号文件"""
+        keep = (f"snapshot-{self.generation:06d}.", f"log-{self.generation:06d}.")
+        for name in os.listdir(self.persist_directory):
+            if name.startswith(("snapshot-", "log-")) and not name.startswith(keep):
+                try:
+                    os.remove(os.path.join(self.persist_directory, name))
+                except OSError:
+                    # 仍被映射的文件（Windows）留到下次清理
+                    pass
+
+    def _open_log(self):
+        """打开当前代号的追加日志"""
+        if self.generation is None:
+            # 首次写入：把旧版数据（或空库）迁移为快照
+            self.compact()
+
+        if self._log_fp is None:
+            self._log_fp = open(self._path("log", self.generation, "wal"), "ab")
+
+    def _append_log(self, ops, vectors=None):
+        """
+        向日志追加一批操作（调用前需先 _open_log）
+
+        整批操作和新增行的向量编码为一条 WAL 记录，用一次 write 写入，
+        然后按 sync_interval 组提交。
+        """
+        self._log_fp.write(_wal_record(ops, vectors))
+        self._log_fp.flush()
+        self._log_ops += len(ops)
+
+        with self._sync_lock:
+            self._unsynced = True
+            syncing = self.sync_interval is not None
+            if syncing and time.monotonic() - self._synced_at >= self.sync_interval:
+                self._sync_locked()
+            elif syncing and self._sync_timer is None:
+                # 推迟的 fsync 最迟在 sync_interval 之后由定时器线程完成
+                self._sync_timer = threading.Timer(
+                    self.sync_interval, self._sync_on_deadline
+                )
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+        # 墓碑也计入压缩条件，避免已删除的行长期占用内存
+        live = len(self.data) - self._dead
+        if self._log_ops + self._dead > max(self.compact_min_ops, live):
+            self.compact()
+
+    def _ensure_embeddings(self):
+        """
+        向量化算法标识与当前不一致时，用当前算法重新向量化全部文档
+
+        在首次查询或写入时进行（惰性），结果立即压缩为新快照；
+        旧版格式只在内存中更新，首次写入迁移时一并落盘。
+        """
+        if self._embedder_id == EMBEDDER_ID:
+            return
+
+        self._embedder_id = EMBEDDER_ID
+        self._ivf = {}
+        self._matrix = _SparseMatrix(dtype=self.vector_dtype)
+        self._matrix.append(
+            *self._compute_embeddings(self.data.documents(range(len(self.data))))
+        )
+
+        if self.generation is not None:
+            self.compact()
+
+    def compact(self):
+        """把内存中的全部数据写成新快照，并切换到新的空日志"""
+        self._ensure_embeddings()
+        self._close_log()
+        self._purge_tombstones()
+        generation = (self.generation or 0) + 1
+
+        self.data.save(self._prefix("snapshot", generation))
+        self._matrix.save(self._prefix("snapshot", generation))
+        self._save_ivf(generation)
+
+        snapshot_meta = self._path("snapshot", generation, "meta.json")
+        with open(snapshot_meta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "embedder": self._embedder_id,
+                    "vector_dtype": self.vector_dtype,
+                    "next_id": self._next_id,
+                },
+                f,
+            )
+        os.replace(snapshot_meta + ".tmp", snapshot_meta)
+
+        # 快照文件落盘后切换 CURRENT（提交点），之前崩溃仍使用旧代号
+        prefix = f"snapshot-{generation:06d}."
+        self._fsync_paths(
+            [
+                os.path.join(self.persist_directory, name)
+                for name in os.listdir(self.persist_directory)
+                if name.startswith(prefix)
+            ]
+        )
+        with open(self.current_file + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(generation))
+        self._fsync_paths([self.current_file + ".tmp"])
+        os.replace(self.current_file + ".tmp", self.current_file)
+        self._fsync_paths([])
+
+        self.generation = generation
+        self._log_ops = 0
+
+        # 改为打开新快照的记录，释放已解码的记录和对旧快照的映射
+        self.data = _RecordStore.load(self._prefix("snapshot", generation), self.mmap)
+        if self.mmap:
+            # 改为映射新快照，释放内存中的副本和对旧快照的映射
+            self._matrix = _SparseMatrix.load(
+                self._prefix("snapshot", generation), self.vector_dtype
+            )
+        self._remove_stale_files()
 
     def save_data(self):
-        """保存数据"""
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        """保存数据（写出完整快照）"""
+        self.compact()
+
+    def close(self):
+        """关闭日志文件句柄，需要时保存向量缓存"""
+        self._close_log()
+        if self.embedding_cache_file and self._embedding_cache.dirty:
+            self._embedding_cache.save(self.embedding_cache_file)
+
+    def sync(self):
+        """把已写入的日志立即 fsync 到磁盘"""
+        with self._sync_lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        """sync() 的实现，调用方持有 _sync_lock；同时取消等待中的定时器"""
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        if self._log_fp is not None and self._unsynced:
+            os.fsync(self._log_fp.fileno())
+        self._unsynced = False
+        self._synced_at = time.monotonic()
+
+    def _sync_on_deadline(self):
+        """定时器线程：截止时间到达时 fsync 推迟的写入"""
+        with self._sync_lock:
+            # 等锁期间已被 sync() 取消或换成新的定时器时不再处理
+            if self._sync_timer is threading.current_thread():
+                self._sync_locked()
+
+    def _fsync_paths(self, paths):
+        """fsync 文件和所在目录（sync_interval=None 时跳过）"""
+        if self.sync_interval is None:
+            return
+        for path in paths:
+            with open(path, "rb") as f:
+                os.fsync(f.fileno())
+        try:
+            fd = os.open(self.persist_directory, os.O_RDONLY)
+        except OSError:
+            # Windows 不能打开目录，目录项由文件系统保证
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _close_log(self):
+        """fsync 并关闭日志文件句柄"""
+        with self._sync_lock:
+            if self._log_fp is not None:
+                if self.sync_interval is not None:
+                    self._sync_locked()
+                self._log_fp.close()
+                self._log_fp = None
+                self._unsynced = False
+
+    def __enter__(self):
+        return self
 
-        if len(self.vectors) > 0:
-            np.save(self.vectors_file, self.vectors)
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
     def _get_embedding(self, text):
         """
         简单的文本向量化
-        使用词袋模型 + 字符 n-gram
+        使用词袋模型 + 字符 n-gram（返回稠密向量，用于查询）
         """
-        # 字符级别的 n-gram
-        n = 3
-        ngrams = [text[i : i + n] for i in range(len(text) - n + 1)]
+        indptr, indices, values = self._get_embeddings([text])
+        vector = np.zeros(EMBEDDING_DIM)
+        vector[indices] = values
+        return vector
 
-        # 统计字符出现频率
-        vector = np.zeros(256)  # 使用常见字符范围
+    def embedding_cache_info(self):
+        """向量缓存的命中/未命中次数和当前条数"""
+        return self._embedding_cache.info()
 
-        for char in text:
-            if ord(char) < 256:
-                vector[ord(char)] += 1
+    def _get_embeddings(self, texts):
+        """
+        查询文本批量向量化，返回 CSR 形式的 (indptr, indices, values)
+
+        先查向量缓存，只对未命中的文本计算向量。
+        """
+        keys = [self._embedding_cache.key(text) for text in texts]
+        rows = [self._embedding_cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+
+        if missing:
+            indptr, indices, values = self._compute_embeddings(
+                [texts[i] for i in missing]
+            )
+            for j, i in enumerate(missing):
+                lo, hi = indptr[j], indptr[j + 1]
+                rows[i] = (indices[lo:hi].copy(), values[lo:hi].copy())
+                self._embedding_cache.put(keys[i], *rows[i])
+            if len(missing) == len(texts):
+                return indptr, indices, values
+
+        indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(indices) for indices, _ in rows])
+        return (
+            indptr,
+            np.concatenate([indices for indices, _ in rows] + [np.zeros(0, np.int32)]),
+            np.concatenate([values for _, values in rows] + [np.zeros(0)]),
+        )
 
-        # 添加 n-gram 特征
-        ngram_counts = {}
-        for ng in ngrams:
-            key = hash(ng) % 10000
-            ngram_counts[key] = ngram_counts.get(key, 0) + 1
+    def _compute_embeddings(self, texts):
+        """批量计算向量（不经过缓存）"""
+        return _embed_texts(list(texts))
 
-        # 扩展向量
-        ngram_vec = np.zeros(10000)
-        for k, v in ngram_counts.items():
-            ngram_vec[k] = v
+    def _cosine_scores(self, rows, query_embedding):
+        """
+        计算查询向量与指定行的余弦相似度
+
+        query_embedding 可以是单个向量，也可以是 EMBEDDING_DIM × m 的
+        查询矩阵（返回 len(rows) × m）。一次稀疏-稠密乘法，行范数使用
+        缓存，任一范数为 0 时得分为 0。
+        """
+        query_norm = np.linalg.norm(query_embedding, axis=0)
+        if not len(rows) or not np.any(query_norm):
+            return np.zeros((len(rows),) + query_embedding.shape[1:])
 
-        return np.concatenate([vector, ngram_vec])
+        dots = self._matrix.dot(rows, query_embedding)
+        norms = np.multiply.outer(self._matrix.norms.view[rows], query_norm)
 
-    def _cosine_similarity(self, v1, v2):
-        """计算余弦相似度"""
-        dot = np.dot(v1, v2)
-        norm1 = np.linalg.norm(v1)
-        norm2 = np.linalg.norm(v2)
+        scores = np.zeros(dots.shape)
+        np.divide(dots, norms, out=scores, where=norms != 0)
+        return scores
 
-        if norm1 == 0 or norm2 == 0:
-            return 0
+    @staticmethod
+    def _top_k(scores, n):
+        """
+        返回得分最高的 n 个位置（降序，同分时位置靠前的优先）
+
+        先用 argpartition 取第 n 大的分数作为门槛，只对不低于门槛的
+        候选排序，结果与对全部结果做稳定排序一致。
+        """
+        if n <= 0 or not len(scores):
+            return np.zeros(0, dtype=np.int64)
+        if n < len(scores):
+            threshold = scores[np.argpartition(-scores, n - 1)[n - 1]]
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            candidates = np.arange(len(scores))
 
-        return dot / (norm1 * norm2)
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order[:n]]
 
     def add(self, collection, document, metadata=None):
         """添加文档"""
-        embedding = self._get_embedding(document)
+        return self.add_many(collection, [document], [metadata])[0]
 
-        entry = {
-            "collection": collection,
-            "document": document,
-            "metadata": metadata or {},
-            "timestamp": datetime.now().isoformat(),
-        }
+    def add_many(self, collection, documents, metadatas=None, workers=None):
+        """
+        批量添加文档
+
+        整批向量化一次、向量矩阵扩容一次、日志写入一次，
+        返回新文档的 id 列表（单调递增，删除和压缩后也不变）。
+        workers > 1 时用多个进程并行向量化（适合导入整部小说等大批量数据，
+        不经过向量缓存）。
+        """
+        documents = list(documents)
+        if not documents:
+            return []
+        if metadatas is None:
+            metadatas = [None] * len(documents)
+
+        self._ensure_embeddings()
+        self._open_log()
+        if workers is not None and workers > 1:
+            embeddings = _embed_parallel(documents, workers)
+        else:
+            embeddings = self._compute_embeddings(documents)
+
+        timestamp = datetime.now().isoformat()
+        entries = [
+            {
+                "id": self._next_id + i,
+                "collection": collection,
+                "document": document,
+                "metadata": metadata or {},
+                "timestamp": timestamp,
+            }
+            for i, (document, metadata) in enumerate(zip(documents, metadatas))
+        ]
+
+        start = len(self.data)
+        self.data.extend(entries)
+        self._index_rows(start)
+        self._matrix.append(*embeddings)
+
+        self._append_log([{"op": "add", "entry": e} for e in entries], embeddings)
+        self._update_ivf(collection)
+
+        return [e["id"] for e in entries]
+
+    # ========== 索引 ==========
+
+    def _rebuild_collection_index(self):
+        """根据 self.data 重建 collection → 行号索引，清空元数据索引和 IVF 索引"""
+        self._collection_rows = {}
+        # 行号 → 文档 id（升序），以及存活位图
+        self._ids = _GrowableArray(dtype=np.int64)
+        self._alive = _GrowableArray(dtype=bool)
+        self._dead = 0
+        # collection → _IVFIndex
+        self._ivf = {}
+        # collection → _BM25Index，首次混合检索时建立
+        self._bm25 = {}
+        self._invalidate_metadata_index()
+        self._index_rows(0)
+
+    def _invalidate_metadata_index(self):
+        """丢弃元数据索引（行号整体平移后），下次查询时按需重建"""
+        # (collection, 字段) → {值: [行号, ...]}
+        self._field_index = {}
+        # (collection, 字段) → (排序后的数值, 对应行号)
+        self._range_index = {}
+
+    def _index_rows(self, start):
+        """把 start 之后新增的行加入 collection 索引和已建立的元数据索引"""
+        ids, codes, names = self.data.index_columns(start)
+        if not len(ids):
+            return
+        if np.any(ids < 0):
+            # 旧版记录没有 id，按加入顺序补上（旧版 id 即当时的行号）
+            for k in range(len(ids)):
+                entry = self.data[start + k]
+                entry.setdefault("id", self._next_id)
+                ids[k] = entry["id"]
+                self._next_id = max(self._next_id, entry["id"] + 1)
+        self._next_id = max(self._next_id, int(ids.max()) + 1)
+
+        self._ids.extend(ids)
+        self._alive.extend(np.ones(len(ids), dtype=bool))
+
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            collection = names[codes[lo]]
+            rows = (start + order[lo:hi]).tolist()
+            if collection not in self._collection_rows:
+                self._collection_rows[collection] = _GrowableArray(dtype=np.int64)
+            self._collection_rows[collection].extend(rows)
+
+            for (indexed_collection, key), index in self._field_index.items():
+                if indexed_collection == collection:
+                    self._add_to_field_index(index, key, rows)
+
+            for (indexed_collection, key), index in list(self._range_index.items()):
+                if indexed_collection == collection:
+                    self._range_index[(collection, key)] = self._insert_range_rows(
+                        index, key, rows
+                    )
+
+    @staticmethod
+    def _index_value(value):
+        """元数据值转换为可哈希的索引键（列表、字典按 JSON 序列化）"""
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            return (
+                "__json__",
+                json.dumps(value, ensure_ascii=False, sort_keys=True),
+            )
+
+    def _numeric_values(self, key, rows):
+        """取出 rows 中字段为数值的 (值, 行号)，其余行忽略"""
+        values, numeric_rows = [], []
+        for i, value in zip(rows, self.data.metadata_values(key, rows)):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values.append(value)
+                numeric_rows.append(i)
+        return (
+            np.array(values, dtype=np.float64),
+            np.array(numeric_rows, dtype=np.int64),
+        )
 
-        self.data.append(entry)
+    def _insert_range_rows(self, index, key, rows):
+        """把新行插入有序索引（新行行号更大，同值时排在后面）"""
+        values, rows = self._numeric_values(key, rows)
+        order = np.argsort(values, kind="stable")
+        positions = np.searchsorted(index[0], values[order], side="right")
+        return (
+            np.insert(index[0], positions, values[order]),
+            np.insert(index[1], positions, rows[order]),
+        )
+
+    def _add_to_field_index(self, index, key, rows):
+        for i, value in zip(rows, self.data.metadata_values(key, rows)):
+            index.setdefault(self._index_value(value), []).append(i)
+
+    def _is_indexed(self, collection, key):
+        return key in DEFAULT_INDEXED_FIELDS or key in self.indexed_fields.get(
+            collection, ()
+        )
+
+    def create_index(self, collection, key):
+        """为 collection 的元数据字段声明哈希索引"""
+        self.indexed_fields.setdefault(collection, set()).add(key)
+
+    def _get_field_index(self, collection, key):
+        """获取（必要时构建）字段的哈希索引"""
+        index = self._field_index.get((collection, key))
+        if index is None:
+            index = {}
+            self._add_to_field_index(index, key, self._rows(collection).tolist())
+            self._field_index[(collection, key)] = index
+        return index
+
+    def _get_range_index(self, collection, key):
+        """获取（必要时构建）数值字段的有序索引"""
+        index = self._range_index.get((collection, key))
+        if index is None:
+            values, rows = self._numeric_values(key, self._rows(collection).tolist())
+            order = np.lexsort((rows, values))
+            index = (values[order], rows[order])
+            self._range_index[(collection, key)] = index
+        return index
+
+    def _rows(self, collection):
+        """collection 中的全部行号（升序，含已删除的行）"""
+        index = self._collection_rows.get(collection)
+        return index.view if index is not None else np.zeros(0, dtype=np.int64)
+
+    def _live(self, rows):
+        """去掉 rows 中已删除的行（保持原顺序）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self._dead or not len(rows):
+            return rows
+        return rows[self._alive.view[rows]]
+
+    def _id_rows(self, ids):
+        """文档 id 对应的存活行号，不存在或已删除的 id 忽略"""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.searchsorted(self._ids.view, ids)
+        found = rows < len(self._ids)
+        rows, ids = rows[found], ids[found]
+        return self._live(rows[self._ids.view[rows] == ids])
+
+    def _update_ivf(self, collection):
+        """
+        维护 collection 的 IVF 索引，返回索引（行数不足时为 None）
 
-        if len(self.vectors) == 0:
-            self.vectors = embedding.reshape(1, -1)
+        行数达到 ivf_min_rows 时训练；行数增长到训练时的 4 倍且簇数
+        还能增加时重新训练，否则只把新增的行归入已有的簇。
+        """
+        rows = self._rows(collection)
+        ivf = self._ivf.get(collection)
+        if ivf is None and len(rows) < self.ivf_min_rows:
+            return None
+
+        lists = int(np.clip(np.sqrt(len(rows)), IVF_MIN_LISTS, IVF_MAX_LISTS))
+        if ivf is None or (
+            len(rows) >= 4 * ivf.trained_size and lists > len(ivf.centroids)
+        ):
+            rng = np.random.default_rng(len(rows))
+            sample_size = min(len(rows), lists * IVF_SAMPLE_PER_LIST)
+            sample = np.sort(rng.choice(rows, sample_size, replace=False))
+            lists = min(lists, len(sample))
+            centroids = _spherical_kmeans(self._matrix, sample, lists, seed=len(rows))
+            ivf = _IVFIndex(centroids, len(rows))
+            self._ivf[collection] = ivf
+
+        ivf.assign(self._matrix, rows[ivf.assigned :])
+        return ivf
+
+    def _match_rows(self, collection, metadata=None):
+        """
+        collection 中元数据与 metadata 完全匹配的行号（升序）
+
+        有索引的字段直接取出行号列表并求交集，其余字段只在候选行上比较，
+        开销与匹配行数成正比。
+        """
+        if not metadata:
+            return self._live(self._rows(collection))
+
+        indexed, remaining = [], {}
+        for k, v in metadata.items():
+            if self._is_indexed(collection, k):
+                index = self._get_field_index(collection, k)
+                indexed.append(index.get(self._index_value(v), []))
+            else:
+                remaining[k] = v
+
+        if indexed:
+            # 从最短的行号列表开始求交集
+            indexed.sort(key=len)
+            candidates = indexed[0]
+            for rows in indexed[1:]:
+                if not candidates:
+                    break
+                candidates = sorted(set(candidates).intersection(rows))
         else:
-            self.vectors = np.vstack([self.vectors, embedding])
+            candidates = self._rows(collection).tolist()
 
-        self.save_data()
+        matched = []
+        for i in candidates:
+            entry_metadata = self.data[i]["metadata"]
+            if all(entry_metadata.get(k) == v for k, v in remaining.items()):
+                matched.append(i)
 
-        return len(self.data) - 1
+        return self._live(matched)
 
-    def search(self, collection, query, n=3, filter_metadata=None):
-        """搜索文档"""
-        query_embedding = self._get_embedding(query)
+    def _range_rows(self, collection, key, low=None, high=None, descending=False):
+        """数值字段落在 [low, high] 内的行号，按字段值排序（同值时行号升序）"""
+        values, rows = self._get_range_index(collection, key)
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        end = len(values) if high is None else np.searchsorted(values, high, "right")
 
-        results = []
+        values, rows = values[start:end], rows[start:end]
+        if descending:
+            rows = rows[np.lexsort((rows, -values))]
+        return self._live(rows)
 
-        for i, entry in enumerate(self.data):
-            if entry["collection"] != collection:
-                continue
+    # ========== 查询 ==========
+
+    def search(
+        self, collection, query, n=3, filter_metadata=None, exact=True, mode="vector"
+    ):
+        """
+        搜索文档
+
+        exact=False 时使用 IVF 近似索引，只对与查询最相近的几个簇内的
+        行计算相似度；索引尚未建立或候选不足 n 条时退回精确搜索。
+
+        mode="hybrid" 时先用 BM25（汉字二元组）倒排索引取出候选，
+        再只对候选计算向量相似度重排，适合人名、地名等短查询；
+        查询没有可用的二元组或没有命中任何文档时退回向量搜索。
+        """
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"未知的搜索模式: {mode}")
+        self._ensure_embeddings()
+        query_embedding = self._get_embedding(query)
+
+        # 元数据过滤，计算相似度，取 top n
+        rows = self._match_rows(collection, filter_metadata)
+        candidates = None
+        if mode == "hybrid":
+            candidates = self._bm25_candidates(collection, rows, query, n)
+        if candidates is not None:
+            rows = candidates
+        elif not exact:
+            rows = self._ann_candidates(collection, rows, query_embedding, n)
+        scores = self._cosine_scores(rows, query_embedding)
+        return self._search_results(rows, scores, n)
+
+    def search_many(self, collection, queries, n=3, filter_metadata=None):
+        """
+        批量搜索
 
-            # 元数据过滤
-            if filter_metadata:
-                match = True
-                for k, v in filter_metadata.items():
-                    if entry["metadata"].get(k) != v:
-                        match = False
-                        break
-                if not match:
-                    continue
+        整批查询一次向量化，候选行较少时只做一次稀疏矩阵 × 查询矩阵的乘法，
+        较多时各查询分别读取按列副本中自己非零列的倒排表；返回与 queries 一一对应的结果列表，每项与 search() 的结果相同。
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        self._ensure_embeddings()
+
+        indptr, indices, values = self._get_embeddings(queries)
+        query_matrix = np.zeros((EMBEDDING_DIM, len(queries)))
+        query_matrix[indices, np.repeat(np.arange(len(queries)), np.diff(indptr))] = (
+            values
+        )
 
-            # 计算相似度
-            sim = self._cosine_similarity(query_embedding, self.vectors[i])
+        rows = self._match_rows(collection, filter_metadata)
+        scores = self._cosine_scores(rows, query_matrix)
+        return [
+            self._search_results(rows, scores[:, j], n) for j in range(len(queries))
+        ]
 
+    def _search_results(self, rows, scores, n):
+        """取得分最高的 n 行，组装成查询结果"""
+        results = []
+        for k in self._top_k(scores, n):
+            entry = self.data[int(rows[k])]
             results.append(
                 {
-                    "id": i,
+                    "id": entry["id"],
                     "document": entry["document"],
                     "metadata": entry["metadata"],
-                    "score": float(sim),
+                    "score": float(scores[k]),
                 }
             )
 
-        # 排序并返回 top n
-        results.sort(key=lambda x: x["score"], reverse=True)
+        return results
 
-        return results[:n]
+    def _ann_candidates(self, collection, rows, query_embedding, n):
+        """IVF 探查得到的候选行（已按元数据过滤）"""
+        ivf = self._update_ivf(collection)
+        if ivf is None:
+            return rows
+
+        nprobe = self.nprobe or max(IVF_MIN_NPROBE, len(ivf.centroids) // 8)
+        candidates = ivf.probe(query_embedding, nprobe)
+        if len(rows) < len(self._rows(collection)):
+            candidates = candidates[np.isin(candidates, rows)]
+        return candidates if len(candidates) >= n else rows
+
+    def _update_bm25(self, collection):
+        """维护 collection 的 BM25 索引：为尚未建索引的新行建索引"""
+        index = self._bm25.get(collection)
+        if index is None:
+            index = self._bm25[collection] = _BM25Index()
+
+        rows = self._rows(collection)[index.indexed :]
+        index.add(rows, self.data.documents(rows.tolist()))
+        return index
+
+    def _bm25_candidates(self, collection, rows, query, n):
+        """BM25 得分最高的候选行（已按元数据过滤，行号升序），没有命中时为 None"""
+        terms = _bigram_terms([query])[1]
+        if not len(terms):
+            return None
+
+        candidates, scores = self._update_bm25(collection).scores(terms)
+        if len(rows) < len(self._rows(collection)):
+            keep = np.isin(candidates, rows)
+            candidates, scores = candidates[keep], scores[keep]
+        if not len(candidates):
+            return None
+
+        limit = max(n * HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+        return np.sort(candidates[self._top_k(scores, limit)])
 
     def get_by_metadata(self, collection, metadata):
         """根据元数据获取文档"""
         results = []
 
-        for i, entry in enumerate(self.data):
-            if entry["collection"] != collection:
-                continue
+        for i in self._match_rows(collection, metadata).tolist():
+            entry = self.data[i]
+            results.append(
+                {
+                    "id": entry["id"],
+                    "document": entry["document"],
+                    "metadata": entry["metadata"],
+                }
+            )
 
-            match = True
-            for k, v in metadata.items():
-                if entry["metadata"].get(k) != v:
-                    match = False
-                    break
+        return results
 
-            if match:
-                results.append(
-                    {
-                        "id": i,
-                        "document": entry["document"],
-                        "metadata": entry["metadata"],
-                    }
-                )
+    def get_by_range(
+        self, collection, key, low=None, high=None, limit=None, descending=False
+    ):
+        """
+        按数值字段范围获取文档（闭区间，low/high 为 None 表示不设边界）
+
+        结果按字段值排序，descending=True 时从大到小，limit 限制返回条数。
+        """
+        rows = self._range_rows(collection, key, low, high, descending)
+        if limit is not None:
+            rows = rows[:limit]
+
+        results = []
+        for i in rows.tolist():
+            entry = self.data[i]
+            results.append(
+                {
+                    "id": entry["id"],
+                    "document": entry["document"],
+                    "metadata": entry["metadata"],
+                }
+            )
 
         return results
 
@@ -179,36 +2426,157 @@ class SimpleVectorDB:
         return self.get_by_metadata(collection, {})
 
     def delete(self, collection, document_id=None, metadata=None):
-        """删除文档"""
+        """
+        删除文档（打墓碑）
+
+        只在存活位图上标记并追加一条日志，开销与删除条数成正比；
+        其余文档的 id 不变，记录和向量在下次压缩时移除。
+        """
+        rows = np.zeros(0, dtype=np.int64)
         if document_id is not None:
-            self.data.pop(document_id)
-            self.vectors = np.delete(self.vectors, document_id, axis=0)
+            rows = self._id_rows([document_id])
+            rows = rows[[self.data[i]["collection"] == collection for i in rows]]
         elif metadata:
-            to_delete = []
-            for i, entry in enumerate(self.data):
-                if entry["collection"] != collection:
-                    continue
+            rows = self._match_rows(collection, metadata)
 
-                match = True
-                for k, v in metadata.items():
-                    if entry["metadata"].get(k) != v:
-                        match = False
-                        break
+        if len(rows):
+            ids = self._ids.view[rows].tolist()
+            # 首次写入时会压缩（行号可能变化），打开日志后按 id 重新定位
+            self._open_log()
+            self._tombstone(self._id_rows(ids))
+            self._append_log([{"op": "delete", "ids": ids}])
 
-                if match:
-                    to_delete.append(i)
+    def update_metadata(self, document_id, patch):
+        """
+        更新文档元数据（patch 中的字段覆盖原值）
+
+        不重新向量化，只调整 patch 涉及字段的元数据索引并追加一条日志。
+        返回是否找到该文档。
+        """
+        return self._update(document_id, {"metadata": dict(patch)})
 
-            # 倒序删除
-            for i in sorted(to_delete, reverse=True):
-                self.data.pop(i)
-                self.vectors = np.delete(self.vectors, i, axis=0)
+    def update_document(self, document_id, document):
+        """
+        替换文档正文
 
-        self.save_data()
+        只重新向量化这一行，id 和元数据不变。返回是否找到该文档。
+        """
+        self._ensure_embeddings()
+        return self._update(document_id, {"document": document})
+
+    def _update(self, document_id, changes):
+        """应用一次更新并写日志"""
+        if not len(self._id_rows([document_id])):
+            return False
+
+        # 首次写入时会压缩（行号可能变化），打开日志后按 id 重新定位
+        self._open_log()
+        row = int(self._id_rows([document_id])[0])
+        if "metadata" in changes:
+            self._update_metadata_row(row, changes["metadata"])
+        if "document" in changes:
+            self.data[row]["document"] = changes["document"]
+            self._replace_vectors([row])
+            self._bm25.pop(self.data[row]["collection"], None)
+
+        self._append_log([{"op": "update", "id": document_id, **changes}])
+        return True
+
+    def _update_metadata_row(self, row, patch):
+        """合并元数据，并把该行移到已建立的元数据索引中的新位置"""
+        entry = self.data[row]
+        old = entry["metadata"]
+        # 换成新字典，不修改调用方传入或之前查询返回的对象
+        entry["metadata"] = {**old, **patch}
+        collection = entry["collection"]
+
+        for key, value in patch.items():
+            index = self._field_index.get((collection, key))
+            if index is not None:
+                old_value = self._index_value(old.get(key))
+                rows = index[old_value]
+                rows.pop(bisect.bisect_left(rows, row))
+                if not rows:
+                    del index[old_value]
+                bisect.insort(index.setdefault(self._index_value(value), []), row)
+
+            range_index = self._range_index.get((collection, key))
+            if range_index is not None:
+                values, rows = range_index
+                keep = rows != row
+                values, rows = values[keep], rows[keep]
+                # 同值时保持行号升序
+                new_values, new_rows = self._numeric_values(key, [row])
+                if len(new_rows):
+                    lo = np.searchsorted(values, new_values[0], side="left")
+                    hi = np.searchsorted(values, new_values[0], side="right")
+                    position = lo + np.searchsorted(rows[lo:hi], row)
+                    values = np.insert(values, position, new_values[0])
+                    rows = np.insert(rows, position, row)
+                self._range_index[(collection, key)] = (values, rows)
+
+    def _replace_vectors(self, rows):
+        """按当前正文重新计算 rows 的向量，并更新 IVF 索引"""
+        if not rows:
+            return
+        indptr, indices, values = self._compute_embeddings(
+            [self.data[i]["document"] for i in rows]
+        )
+        for i, row in enumerate(rows):
+            lo, hi = indptr[i], indptr[i + 1]
+            self._matrix.replace(row, indices[lo:hi], values[lo:hi])
+            ivf = self._ivf.get(self.data[row]["collection"])
+            if ivf is not None:
+                ivf.reassign(self._matrix, row)
+
+    def _tombstone(self, rows):
+        """把存活的 rows 标记为已删除"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[self._alive.view[rows]]
+        self._alive.view[rows] = False
+        self._dead += len(rows)
+
+    def _purge_tombstones(self):
+        """移除已删除的记录和向量，并平移各索引中的行号（压缩时调用）"""
+        if not self._dead:
+            return
+
+        alive = self._alive.view
+        deleted = np.flatnonzero(~alive)
+        self.data.keep(alive)
+        self._matrix.delete(deleted)
+
+        ids = self._ids.view[alive]
+        self._ids.clear()
+        self._ids.extend(ids)
+        self._alive.clear()
+        self._alive.extend(np.ones(len(ids), dtype=bool))
+        self._dead = 0
+
+        for index in self._collection_rows.values():
+            kept = _shift_rows(index.view, deleted)
+            index.clear()
+            index.extend(kept)
+        for ivf in self._ivf.values():
+            ivf.shift(deleted)
+        self._bm25 = {}
+        self._invalidate_metadata_index()
 
     def reset(self):
-        """重置数据库"""
-        self.data = []
-        self.vectors = np.array([])
+        """
+        重置数据库
+
+        先切换到一个新的空快照（提交点与压缩相同），再清理旧文件，
+        中途崩溃时要么仍是原数据，要么已经是空库。
+        """
+        self._close_log()
+        self.data = _RecordStore()
+        self._matrix = _SparseMatrix(dtype=self.vector_dtype)
+        self._embedder_id = EMBEDDER_ID
+        self._next_id = 0
+        self._rebuild_collection_index()
+        self._log_ops = 0
+        self.compact()
 
         if os.path.exists(self.data_file):
             os.remove(self.data_file)
@@ -220,10 +2588,15 @@ class NovelVectorDB:
     """
     网文专用向量数据库
     封装了 collections 的概念
+
+    其余参数（vector_dtype、mmap、ivf_min_rows、persist_embedding_cache、
+    sync_interval 等）原样传给 SimpleVectorDB。
+    用完后调用 close()（或使用 with 语句），把推迟的日志 fsync
+    和向量缓存落盘。
     """
 
-    def __init__(self, persist_directory="./vector_db"):
-        self.db = SimpleVectorDB(persist_directory)
+    def __init__(self, persist_directory="./vector_db", **kwargs):
+        self.db = SimpleVectorDB(persist_directory, **kwargs)
 
         # Collections
         self.COLLECTIONS = {
@@ -234,15 +2607,60 @@ class NovelVectorDB:
             "foreshadowing": "伏笔记录",
             "plot": "剧情线",
             "reviews": "审核记录",
+            "passages": "章节段落",
+        }
+
+    def close(self):
+        """关闭数据库（fsync 并关闭日志，需要时保存向量缓存）"""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ========== 批量导入 ==========
+
+    def bulk_load(self, collection, items, workers=None):
+        """
+        批量导入同一 collection 的设定
+
+        items 中每一项的键与对应 add_* 方法的参数一致，例如：
+            db.bulk_load("characters", [
+                {"name": "叶尘", "content": "...", "chapter": 1, "role": "主角"},
+            ])
+        workers > 1 时并行向量化，见 SimpleVectorDB.add_many。
+        返回新文档的 id 列表。
+        """
+        builders = {
+            "world": self._world_entry,
+            "characters": self._character_entry,
+            "skills": self._skill_entry,
+            "chapters": self._chapter_entry,
+            "foreshadowing": self._foreshadowing_entry,
+            "plot": self._plot_entry,
+            "reviews": self._review_entry,
         }
+        if collection not in builders:
+            raise ValueError(f"未知的 collection: {collection}")
+
+        entries = [builders[collection](**item) for item in items]
+        if not entries:
+            return []
+
+        documents, metadatas = zip(*entries)
+        return self.db.add_many(collection, documents, metadatas, workers)
 
     # ========== 世界观 ==========
 
     def add_world(self, name, content, category):
         """添加世界观设定"""
-        return self.db.add(
-            "world", content, {"type": "world", "name": name, "category": category}
-        )
+        return self.db.add("world", *self._world_entry(name, content, category))
+
+    @staticmethod
+    def _world_entry(name, content, category):
+        return content, {"type": "world", "name": name, "category": category}
 
     def search_world(self, query, n=3, category=None):
         """搜索世界观"""
@@ -255,11 +2673,18 @@ class NovelVectorDB:
     def add_character(self, name, content, chapter, role):
         """添加人物"""
         return self.db.add(
-            "characters",
-            content,
-            {"type": "character", "name": name, "chapter": chapter, "role": role},
+            "characters", *self._character_entry(name, content, chapter, role)
         )
 
+    @staticmethod
+    def _character_entry(name, content, chapter, role):
+        return content, {
+            "type": "character",
+            "name": name,
+            "chapter": chapter,
+            "role": role,
+        }
+
     def search_characters(self, query, n=5, role=None):
         """搜索人物"""
         return self.db.search("characters", query, n, {"role": role} if role else None)
@@ -276,11 +2701,16 @@ class NovelVectorDB:
 
     def add_skill(self, name, content, category, owner=None):
         """添加技能"""
-        return self.db.add(
-            "skills",
-            content,
-            {"type": "skill", "name": name, "category": category, "owner": owner},
-        )
+        return self.db.add("skills", *self._skill_entry(name, content, category, owner))
+
+    @staticmethod
+    def _skill_entry(name, content, category, owner=None):
+        return content, {
+            "type": "skill",
+            "name": name,
+            "category": category,
+            "owner": owner,
+        }
 
     def search_skills(self, query, n=5, owner=None):
         """搜索技能"""
@@ -290,7 +2720,13 @@ class NovelVectorDB:
 
     def add_chapter_summary(self, chapter_num, content, metadata):
         """添加章节摘要"""
-        return self.db.add("chapters", content, {"chapter": chapter_num, **metadata})
+        return self.db.add(
+            "chapters", *self._chapter_entry(chapter_num, content, metadata)
+        )
+
+    @staticmethod
+    def _chapter_entry(chapter_num, content, metadata):
+        return content, {"chapter": chapter_num, **metadata}
 
     def get_chapter(self, chapter_num):
         """获取章节"""
@@ -299,48 +2735,149 @@ class NovelVectorDB:
 
     def get_recent_chapters(self, n=5):
         """获取最近章节"""
-        all_chapters = self.db.get_all("chapters")
-
-        # 按章节号排序
-        chapters = [(r, r["metadata"].get("chapter", 0)) for r in all_chapters]
-        chapters.sort(key=lambda x: x[1], reverse=True)
+        # 按章节号倒序
+        return self.db.get_by_range("chapters", "chapter", limit=n, descending=True)
 
-        return [r[0] for r in chapters[:n]]
+    def get_chapters_between(self, start, end):
+        """获取第 start 到第 end 章（含）的章节摘要"""
+        return self.db.get_by_range("chapters", "chapter", start, end)
 
     def search_chapters(self, query, n=3):
         """搜索章节"""
         return self.db.search("chapters", query, n)
 
+    # ========== 章节段落 ==========
+
+    def index_chapter_file(
+        self, chapter_num, path, window=4, overlap=1, encoding="utf-8"
+    ):
+        """
+        把章节正文切成相互重叠的段落窗口并建立索引
+
+        逐行读取文件（跳过开头的 frontmatter），每个非空行是一个段落，
+        每 window 段组成一个窗口，相邻窗口重叠 overlap 段。整章的窗口一次
+        批量向量化，元数据记录章节号、窗口在文件中的字符偏移和内容哈希；
+        内容未变的章节直接跳过，有变化的章节先删除旧窗口再重建。
+        返回写入的窗口数。
+        """
+        if not 0 <= overlap < window:
+            raise ValueError(f"overlap 必须在 [0, {window}) 内: {overlap}")
+
+        content_hash = hashlib.blake2b(digest_size=16)
+        paragraphs = []
+        with open(path, "r", encoding=encoding) as f:
+            offset = 0
+            in_frontmatter = False
+            for i, line in enumerate(f):
+                content_hash.update(line.encode("utf-8"))
+                text = line.strip()
+                if i == 0 and text == "---":
+                    in_frontmatter = True
+                elif in_frontmatter:
+                    in_frontmatter = text != "---"
+                elif text:
+                    paragraphs.append((offset, text))
+                offset += len(line)
+        digest = content_hash.hexdigest()
+
+        existing = self.db.get_by_metadata("passages", {"chapter": chapter_num})
+        if existing:
+            if existing[0]["metadata"].get("content_hash") == digest:
+                return 0
+            self.db.delete("passages", metadata={"chapter": chapter_num})
+
+        documents, metadatas = [], []
+        for start in range(0, max(1, len(paragraphs) - overlap), window - overlap):
+            group = paragraphs[start : start + window]
+            if not group:
+                break
+            documents.append("\n".join(text for _, text in group))
+            metadatas.append(
+                {
+                    "type": "passage",
+                    "chapter": chapter_num,
+                    "offset": group[0][0],
+                    "paragraph": start,
+                    "content_hash": digest,
+                }
+            )
+
+        return len(self.db.add_many("passages", documents, metadatas))
+
+    def index_chapter_dir(self, chapters_dir, pattern="chapter-*.md", **kwargs):
+        """
+        逐章索引目录中的章节文件（章节号取文件名中的数字）
+
+        一次只读入一章，未变化的章节跳过。返回 {章节号: 写入的窗口数}。
+        """
+        written = {}
+        for path in sorted(Path(chapters_dir).glob(pattern)):
+            match = re.search(r"(\d+)", path.stem)
+            if match:
+                chapter_num = int(match.group(1))
+                written[chapter_num] = self.index_chapter_file(
+                    chapter_num, path, **kwargs
+                )
+        return written
+
+    def search_passages(self, query, n=3, per_chapter=2, candidates=50):
+        """
+        搜索章节段落，按章节分组
+
+        取相似度最高的 candidates 个窗口，按章节归组，每章保留最多
+        per_chapter 段；返回得分最高的 n 章：
+            [{"chapter": 12, "score": 0.83, "passages": [...]}, ...]
+        """
+        results = self.db.search("passages", query, max(candidates, n * per_chapter))
+
+        groups = {}
+        for passage in results:
+            chapter = passage["metadata"]["chapter"]
+            if chapter not in groups:
+                groups[chapter] = {
+                    "chapter": chapter,
+                    "score": passage["score"],
+                    "passages": [],
+                }
+            if len(groups[chapter]["passages"]) < per_chapter:
+                groups[chapter]["passages"].append(passage)
+
+        # 结果已按得分降序，各章的插入顺序即按最高分排序
+        return list(groups.values())[:n]
+
     # ========== 伏笔 ==========
 
     def add_foreshadowing(self, name, content, embed_chapter, recover_chapter):
         """添加伏笔"""
         return self.db.add(
             "foreshadowing",
-            content,
-            {
-                "type": "foreshadowing",
-                "name": name,
-                "embed_chapter": embed_chapter,
-                "recover_chapter": recover_chapter,
-                "status": "active",
-            },
+            *self._foreshadowing_entry(name, content, embed_chapter, recover_chapter),
         )
 
+    @staticmethod
+    def _foreshadowing_entry(name, content, embed_chapter, recover_chapter):
+        return content, {
+            "type": "foreshadowing",
+            "name": name,
+            "embed_chapter": embed_chapter,
+            "recover_chapter": recover_chapter,
+            "status": "active",
+        }
+
     def get_foreshadowing_by_chapter(self, chapter):
         """获取某章节相关的伏笔"""
-        all_fs = self.db.get_all("foreshadowing")
+        embedded = self.db.get_by_metadata("foreshadowing", {"embed_chapter": chapter})
+        recovered = self.db.get_by_metadata(
+            "foreshadowing", {"recover_chapter": chapter}
+        )
 
-        results = []
-        for fs in all_fs:
-            meta = fs["metadata"]
-            if (
-                meta.get("embed_chapter") == chapter
-                or meta.get("recover_chapter") == chapter
-            ):
-                results.append(fs)
+        # 合并两次索引查询的结果，保持原有顺序
+        results = {fs["id"]: fs for fs in embedded + recovered}
+        return [results[i] for i in sorted(results)]
 
-        return results
+    def get_foreshadowing_embedded_between(self, start, end):
+        """获取第 start 到第 end 章（含）埋入的伏笔"""
+        return self.db.get_by_range("foreshadowing", "embed_chapter", start, end)
 
     def get_active_foreshadowing(self):
         """获取活跃伏笔"""
@@ -351,19 +2888,25 @@ class NovelVectorDB:
         all_fs = self.db.get_by_metadata("foreshadowing", {"name": name})
 
         for fs in all_fs:
-            # 重新添加（更新）伏笔状态
-            # 注意：简化版不支持更新，这里需要删除后重新添加
-            pass
+            # 只改元数据，不重新向量化
+            self.db.update_metadata(
+                fs["id"], {"status": "recovered", "recover_chapter": chapter}
+            )
 
     # ========== 剧情 ==========
 
     def add_plot_point(self, name, content, chapter, plot_type="main"):
         """添加剧情点"""
-        return self.db.add(
-            "plot",
-            content,
-            {"type": "plot", "name": name, "chapter": chapter, "plot_type": plot_type},
-        )
+        return self.db.add("plot", *self._plot_entry(name, content, chapter, plot_type))
+
+    @staticmethod
+    def _plot_entry(name, content, chapter, plot_type="main"):
+        return content, {
+            "type": "plot",
+            "name": name,
+            "chapter": chapter,
+            "plot_type": plot_type,
+        }
 
     def search_plot(self, query, n=5, plot_type=None):
         """搜索剧情"""
@@ -376,16 +2919,18 @@ class NovelVectorDB:
     def add_review(self, chapter_num, content, result, issues=None):
         """添加审核记录"""
         return self.db.add(
-            "reviews",
-            content,
-            {
-                "type": "review",
-                "chapter": chapter_num,
-                "result": result,
-                "issues": issues or [],
-            },
+            "reviews", *self._review_entry(chapter_num, content, result, issues)
         )
 
+    @staticmethod
+    def _review_entry(chapter_num, content, result, issues=None):
+        return content, {
+            "type": "review",
+            "chapter": chapter_num,
+            "result": result,
+            "issues": issues or [],
+        }
+
     def get_review(self, chapter_num):
         """获取审核记录"""
         results = self.db.get_by_metadata("reviews", {"chapter": chapter_num})
@@ -416,3 +2961,5 @@ if __name__ == "__main__":
     results = db.search_characters("妹妹")
     for r in results:
         print(f"  - {r['metadata']['name']}: {r['score']:.3f}")
+
+    db.close()
@@ -0,0 +1,56 @@
+# tests/conftest.py
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from chromadb.api.types import EmbeddingFunction
+except ImportError:
+    # 没有安装 chromadb 时 Chroma 的测试整体跳过（见各测试文件的 importorskip）
+    EmbeddingFunction = object
+
+
+class FakeEmbedding(EmbeddingFunction):
+    """不联网的假向量化：字符码位取模计数，并记录向量化过的文本"""
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, input):
+        self.texts.extend(input)
+        return [
+            np.bincount([ord(c) % 16 for c in text], minlength=16).astype(np.float32)
+            + 1
+            for text in input
+        ]
+
+    @staticmethod
+    def name():
+        return "test-fake"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return FakeEmbedding()
+
+
+@pytest.fixture
+def chroma_embedding():
+    return FakeEmbedding()
+
+
+@pytest.fixture
+def chroma_dir(tmp_path, chroma_embedding):
+    """使用 FakeEmbedding 打开共享客户端的 Chroma 数据目录，测试结束后关闭"""
+    from chroma_client import close_client, get_client
+
+    path = str(tmp_path / "chroma")
+    get_client(path, embedding_function=chroma_embedding)
+    yield path
+    close_client(path)
@@ -0,0 +1,133 @@
+# tests/test_chroma_client.py
+import pytest
+
+pytest.importorskip("chromadb")
+
+from chroma_client import SYNC_PREFIX, content_hash, get_client
+
+
+def stored_embeddings(client, collection_name):
+    results = client.get_collection(collection_name).get(include=["embeddings"])
+    return dict(zip(results["ids"], (list(e) for e in results["embeddings"])))
+
+
+def test_upsert_rerun_embeds_nothing(chroma_dir, chroma_embedding):
+    client = get_client(chroma_dir)
+    documents = ["叶尘，主角", "林诗雨，主角的妹妹", "苏晴，同学"]
+    metadatas = [{"name": "叶尘"}, {"name": "林诗雨"}, {"name": "苏晴"}]
+
+    counts = client.upsert("characters", documents, metadatas)
+    assert counts == {"added": 3, "updated": 0, "unchanged": 0}
+    assert len(chroma_embedding.texts) == 3
+
+    chroma_embedding.texts.clear()
+    counts = client.upsert("characters", documents, metadatas)
+    assert counts == {"added": 0, "updated": 0, "unchanged": 3}
+    assert chroma_embedding.texts == []
+    assert client.get("characters")["ids"] == [
+        f"characters_{content_hash(d)}" for d in documents
+    ]
+
+
+def test_upsert_metadata_change_reuses_embedding(chroma_dir, chroma_embedding):
+    client = get_client(chroma_dir)
+    client.upsert("plot", ["主线转折"], [{"chapter": 1}], ids=["turn"])
+    before = stored_embeddings(client, "plot")
+
+    chroma_embedding.texts.clear()
+    counts = client.upsert("plot", ["主线转折"], [{"chapter": 2}], ids=["turn"])
+    assert counts == {"added": 0, "updated": 1, "unchanged": 0}
+    assert chroma_embedding.texts == []
+    assert stored_embeddings(client, "plot") == before
+    assert client.get("plot")["metadatas"] == [{"chapter": 2}]
+
+
+def test_upsert_changed_document_is_reembedded(chroma_dir, chroma_embedding):
+    client = get_client(chroma_dir)
+    client.upsert("plot", ["主线转折", "支线"], ids=["turn", "side"])
+    before = stored_embeddings(client, "plot")
+
+    chroma_embedding.texts.clear()
+    counts = client.upsert("plot", ["主线大转折", "支线"], ids=["turn", "side"])
+    assert counts == {"added": 0, "updated": 1, "unchanged": 1}
+    assert chroma_embedding.texts == ["主线大转折"]
+    after = stored_embeddings(client, "plot")
+    assert after["side"] == before["side"]
+    assert after["turn"] != before["turn"]
+    assert client.get("plot", ids=["turn"])["documents"] == ["主线大转折"]
+
+
+def test_upsert_keeps_last_duplicate_and_later_updates(chroma_dir):
+    client = get_client(chroma_dir)
+    counts = client.upsert(
+        "foreshadowing",
+        ["旧描述", "新描述"],
+        [{"status": "active"}, {"status": "active", "note": "改"}],
+        ids=["fs", "fs"],
+    )
+    assert counts == {"added": 1, "updated": 0, "unchanged": 0}
+    assert client.get("foreshadowing")["documents"] == ["新描述"]
+
+    # 之后由 update 修改的字段，不会被原样重跑的写入覆盖
+    client.update("foreshadowing", ["fs"], metadatas=[{"status": "recovered"}])
+    client.upsert(
+        "foreshadowing", ["新描述"], [{"status": "active", "note": "改"}], ids=["fs"]
+    )
+    assert client.get("foreshadowing")["metadatas"][0]["status"] == "recovered"
+
+
+def test_add_accepts_duplicates_and_updates_metadata(chroma_dir):
+    client = get_client(chroma_dir)
+    client.add("plot", ["same", "same"])
+    assert len(client.get("plot")["ids"]) == 1
+
+    client.add("plot", ["主线转折"], [{"chapter": 1}])
+    client.add("plot", ["主线转折"], [{"chapter": 2}])
+    results = client.get("plot", where={"chapter": {"$gte": 1}})
+    assert results["metadatas"] == [{"chapter": 2}]
+
+
+def test_reads_hide_sync_fields(chroma_dir):
+    client = get_client(chroma_dir)
+    client.upsert("world", ["等级体系：炼气、筑基"], [{"name": "等级"}])
+
+    assert client.get("world")["metadatas"] == [{"name": "等级"}]
+    results = client.query("world", ["等级"], n_results=1)
+    assert results["metadatas"] == [[{"name": "等级"}]]
+    # 内部字段仍然保存在 Chroma 中
+    stored = client.get_collection("world").get(include=["metadatas"])
+    assert any(k.startswith(SYNC_PREFIX) for k in stored["metadatas"][0])
+
+
+def test_latest_chapter_pointer_only_advances(chroma_dir):
+    client = get_client(chroma_dir)
+    assert client.latest_chapter() is None
+    client.advance_latest_chapter(5)
+    client.advance_latest_chapter(3)
+    assert client.latest_chapter() == 5
+    client.advance_latest_chapter(8)
+    assert client.latest_chapter() == 8
+
+
+def test_reset_removes_data_and_pointer(chroma_dir):
+    client = get_client(chroma_dir)
+    client.upsert("chapters", ["第1章摘要"], [{"chapter": 1}])
+    client.advance_latest_chapter(1)
+
+    client.reset()
+    assert client.latest_chapter() is None
+    assert client.get("chapters")["ids"] == []
+    client.upsert("chapters", ["新第1章"], [{"chapter": 1}])
+    assert client.get("chapters")["documents"] == ["新第1章"]
+
+
+@pytest.mark.parametrize("document", ["主线转折", "主线大转折"])
+def test_upsert_replaces_metadata(chroma_dir, document):
+    client = get_client(chroma_dir)
+    client.upsert("plot", ["主线转折"], [{"a": 1, "b": 2}], ids=["turn"])
+    client.update("plot", ["turn"], metadatas=[{"status": "recovered"}])
+
+    # 元数据变化（正文不变或变化）时，新元数据中没有的字段被删除
+    counts = client.upsert("plot", [document], [{"a": 1}], ids=["turn"])
+    assert counts == {"added": 0, "updated": 1, "unchanged": 0}
+    assert client.get("plot")["metadatas"] == [{"a": 1}]
@@ -0,0 +1,26 @@
+# tests/test_chroma_query.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chroma_query import and_, eq, gte, or_
+
+
+def test_comparisons():
+    assert eq("name", "叶尘") == {"name": {"$eq": "叶尘"}}
+    assert gte("chapter", 3) == {"chapter": {"$gte": 3}}
+
+
+def test_combine_drops_empty_conditions():
+    assert and_() is None
+    assert or_(None, None) is None
+    # 只剩一个条件时直接返回，Chroma 的 $and / $or 至少需要两项
+    assert and_(eq("status", "active"), None) == {"status": {"$eq": "active"}}
+    assert or_(gte("chapter", 3)) == {"chapter": {"$gte": 3}}
+    assert or_(eq("embed_chapter", 5), eq("recover_chapter", 5)) == {
+        "$or": [{"embed_chapter": {"$eq": 5}}, {"recover_chapter": {"$eq": 5}}]
+    }
+    assert and_(eq("a", 1), None, and_(eq("b", 2), eq("c", 3))) == {
+        "$and": [{"a": {"$eq": 1}}, {"$and": [{"b": {"$eq": 2}}, {"c": {"$eq": 3}}]}]
+    }
@@ -0,0 +1,151 @@
+# tests/test_chroma_reader.py
+import pytest
+
+pytest.importorskip("chromadb")
+
+from chroma_client import get_client
+from chroma_reader import ChromaReader
+from chroma_writer import ChromaWriter
+
+
+def python_filter(path, collection_name, predicate):
+    """最初的实现：取回整个集合后在 Python 里过滤"""
+    results = get_client(path).get(collection_name)
+    return sorted(
+        (doc_id, document, metadata)
+        for doc_id, document, metadata in zip(
+            results["ids"], results["documents"], results["metadatas"]
+        )
+        if predicate(metadata)
+    )
+
+
+def as_tuples(records):
+    return sorted((r["id"], r["document"], r["metadata"]) for r in records)
+
+
+@pytest.fixture
+def novel(chroma_dir):
+    with ChromaWriter(chroma_dir, batch_size=50) as writer:
+        for chapter in range(1, 13):
+            writer.add_chapter_summary(
+                chapter, f"第{chapter}章摘要", {"title": f"第{chapter}章"}
+            )
+            writer.add_character(
+                f"人物{chapter}", f"人物{chapter}设定", chapter, "配角"
+            )
+            writer.add_character(f"人物{chapter}", "再次出场", chapter + 3, "配角")
+            writer.add_foreshadowing(
+                f"伏笔{chapter}", f"伏笔{chapter}描述", chapter, chapter * 2
+            )
+    return chroma_dir
+
+
+@pytest.mark.parametrize("chapter", [1, 4, 8, 12, 99])
+def test_chapter_filters_match_python_filter(novel, chapter):
+    reader = ChromaReader(novel)
+
+    assert as_tuples(reader.get_character_by_chapter(chapter)) == python_filter(
+        novel, "characters", lambda m: m.get("chapter") == chapter
+    )
+    # 埋入和回收在同一范围内的伏笔只返回一次
+    assert as_tuples(reader.get_foreshadowing_by_chapter(chapter)) == python_filter(
+        novel,
+        "foreshadowing",
+        lambda m: m.get("embed_chapter") == chapter
+        or m.get("recover_chapter") == chapter,
+    )
+
+
+@pytest.mark.parametrize("n", [0, 1, 3, 12, 20])
+def test_scan_recent_chapters_matches_sort(novel, n):
+    expected = sorted(
+        python_filter(novel, "chapters", lambda m: True),
+        key=lambda r: r[2]["chapter"],
+        reverse=True,
+    )[:n]
+    recent = ChromaReader(novel)._scan_recent_chapters(n)
+    assert [(r["id"], r["document"], r["metadata"]) for r in recent] == expected
+    assert [r["metadata"]["chapter"] for r in recent] == list(
+        range(12, max(12 - n, 0), -1)
+    )
+
+
+def recent_chapters(reader, n):
+    return [r["metadata"]["chapter"] for r in reader.get_recent_chapters(n)]
+
+
+def record_ranges(client, monkeypatch):
+    """记录 get_recent_chapters 发出的 chapter >= low 范围查询的 low"""
+    lows = []
+    get = client.get
+
+    def recording_get(*args, **kwargs):
+        where = kwargs.get("where") or {}
+        if "$gte" in where.get("chapter", {}):
+            lows.append(where["chapter"]["$gte"])
+        return get(*args, **kwargs)
+
+    monkeypatch.setattr(client, "get", recording_get)
+    return lows
+
+
+def test_recent_chapters_query_pointer_range(novel, monkeypatch):
+    reader = ChromaReader(novel)
+    assert reader.client.latest_chapter() == 12
+    lows = record_ranges(reader.client, monkeypatch)
+
+    assert recent_chapters(reader, 3) == [12, 11, 10]
+    assert lows == [10]
+    assert reader.get_recent_chapters(3) == reader._scan_recent_chapters(3)
+
+
+def test_recent_chapters_widen_over_gaps(chroma_dir, monkeypatch):
+    writer = ChromaWriter(chroma_dir)
+    for chapter in [1, 2, 3, 4, 5, 10, 20, 30]:
+        writer.add_chapter_summary(chapter, f"第{chapter}章摘要", {})
+    reader = ChromaReader(chroma_dir)
+    lows = record_ranges(reader.client, monkeypatch)
+
+    # 缺章时范围加倍：[28, 30] → [25, 30] → [19, 30] → [7, 30]
+    assert recent_chapters(reader, 3) == [30, 20, 10]
+    assert lows == [28, 25, 19, 7]
+
+    # 范围覆盖到第 1 章时退回整表扫描
+    lows.clear()
+    assert recent_chapters(reader, 5) == [30, 20, 10, 5, 4]
+    assert lows == [26, 21, 11]
+    assert recent_chapters(reader, 20) == [30, 20, 10, 5, 4, 3, 2, 1]
+
+
+def test_recent_chapters_with_stale_or_missing_pointer(novel):
+    reader = ChromaReader(novel)
+    client = reader.client
+
+    # 指针偏小：范围内多出的章节也会返回，排序后取最新的
+    with open(client.latest_chapter_file, "w", encoding="utf-8") as f:
+        f.write('{"chapter": 5}')
+    assert recent_chapters(reader, 3) == [12, 11, 10]
+
+    # 指针偏大（如章节被删除）：加倍范围补足
+    client.advance_latest_chapter(100)
+    assert client.latest_chapter() == 100
+    assert recent_chapters(reader, 3) == [12, 11, 10]
+
+    # 没有指针或指针损坏时整表扫描
+    with open(client.latest_chapter_file, "w", encoding="utf-8") as f:
+        f.write("{")
+    assert client.latest_chapter() is None
+    assert recent_chapters(reader, 3) == [12, 11, 10]
+    assert recent_chapters(reader, 0) == []
+
+
+def test_batched_writer_advances_pointer_on_flush(chroma_dir):
+    client = get_client(chroma_dir)
+    with ChromaWriter(chroma_dir, batch_size=10) as writer:
+        writer.add_chapter_summary(7, "第7章摘要", {})
+        writer.add_chapter_summary(3, "第3章摘要", {})
+        # 还在缓冲中的章节不推进指针
+        assert client.latest_chapter() is None
+    assert client.latest_chapter() == 7
+    assert recent_chapters(ChromaReader(chroma_dir), 1) == [7]
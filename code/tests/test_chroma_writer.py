@@ -0,0 +1,109 @@
+# tests/test_chroma_writer.py
+import pytest
+
+pytest.importorskip("chromadb")
+
+from chroma_client import ChromaClient, get_client
+from chroma_writer import ChromaWriter, ChromaUpdater
+
+
+def stored_ids(path, collection_name):
+    return sorted(get_client(path).get(collection_name, include=[])["ids"])
+
+
+def test_writer_without_batching_writes_immediately(chroma_dir):
+    writer = ChromaWriter(chroma_dir)
+    writer.add_character("叶尘", "叶尘，主角", 1, "主角")
+    assert stored_ids(chroma_dir, "characters") == ["char_叶尘_1"]
+    assert writer.batch_stats == []
+
+
+def test_writer_buffers_per_collection(chroma_dir):
+    writer = ChromaWriter(chroma_dir, batch_size=3)
+    writer.add_character("叶尘", "叶尘，主角", 1, "主角")
+    writer.add_character("林诗雨", "林诗雨，妹妹", 1, "女主")
+    writer.add_skill("时空之刃", "斩裂空间", "攻击", owner="叶尘")
+    assert stored_ids(chroma_dir, "characters") == []
+    assert stored_ids(chroma_dir, "skills") == []
+
+    # 攒够 batch_size 的 collection 整批写入，其余的仍在缓冲
+    writer.add_character("苏晴", "苏晴，同学", 2, "配角")
+    assert len(stored_ids(chroma_dir, "characters")) == 3
+    assert stored_ids(chroma_dir, "skills") == []
+    assert [(s["collection"], s["count"]) for s in writer.batch_stats] == [
+        ("characters", 3)
+    ]
+
+    stats = writer.flush()
+    assert [(s["collection"], s["count"], s["added"]) for s in stats] == [
+        ("skills", 1, 1)
+    ]
+    assert stored_ids(chroma_dir, "skills") == ["skill_时空之刃"]
+    assert writer.flush() == []
+
+
+def test_writer_flushes_on_exit_and_keeps_last_write(chroma_dir):
+    with ChromaWriter(chroma_dir, batch_size=100) as writer:
+        writer.add_foreshadowing("玉佩", "旧描述", 1, 10)
+        writer.add_foreshadowing("玉佩", "新描述", 1, 12)
+        writer.add_world_setting("炼气、筑基", "等级体系", "修炼")
+
+    results = get_client(chroma_dir).get("foreshadowing")
+    assert results["documents"] == ["新描述"]
+    assert results["metadatas"][0]["recover_chapter"] == 12
+    assert [s["count"] for s in writer.batch_stats] == [1, 1]
+
+
+def test_writer_caps_batches_at_max_batch_size(chroma_dir, monkeypatch):
+    monkeypatch.setattr(ChromaClient, "max_batch_size", property(lambda self: 2))
+    with ChromaWriter(chroma_dir, batch_size=10) as writer:
+        for i in range(5):
+            writer.add_plot_point(f"剧情{i}", f"第{i}个剧情点", i)
+
+    assert [s["count"] for s in writer.batch_stats] == [2, 2, 1]
+    assert len(stored_ids(chroma_dir, "plot")) == 5
+
+
+def test_writer_keeps_unwritten_batches_on_failure(chroma_dir, monkeypatch):
+    monkeypatch.setattr(ChromaClient, "max_batch_size", property(lambda self: 2))
+    client = get_client(chroma_dir)
+    upsert = client.upsert
+    calls = []
+
+    def failing_upsert(**kwargs):
+        calls.append(kwargs["ids"])
+        if len(calls) == 2:
+            raise RuntimeError("写入失败")
+        return upsert(**kwargs)
+
+    monkeypatch.setattr(client, "upsert", failing_upsert)
+    writer = ChromaWriter(chroma_dir, batch_size=10)
+    for i in range(5):
+        writer.add_plot_point(f"剧情{i}", f"第{i}个剧情点", i)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert len(stored_ids(chroma_dir, "plot")) == 2
+
+    # 失败的批次和之后的批次仍在缓冲中，再次 flush 全部写入
+    writer.flush()
+    assert len(stored_ids(chroma_dir, "plot")) == 5
+    assert calls[2] == calls[1]
+
+
+def test_updater_changes_one_record(chroma_dir):
+    writer = ChromaWriter(chroma_dir)
+    writer.add_foreshadowing("玉佩", "母亲留下的玉佩", 1, 30)
+    writer.add_character("叶尘", "叶尘，主角", 1, "主角")
+
+    updater = ChromaUpdater(chroma_dir)
+    updater.recover_foreshadowing("玉佩", 28)
+    updater.update_character_status("叶尘", "injured")
+    updater.recover_foreshadowing("不存在", 28)
+
+    client = get_client(chroma_dir)
+    foreshadowing = client.get("foreshadowing")["metadatas"][0]
+    assert (foreshadowing["status"], foreshadowing["recover_chapter"]) == (
+        "recovered",
+        28,
+    )
+    assert client.get("characters")["metadatas"][0]["status"] == "injured"
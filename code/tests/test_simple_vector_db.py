@@ -0,0 +1,932 @@
+# tests/test_simple_vector_db.py
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_vector_db import SimpleVectorDB, NovelVectorDB, EMBEDDING_DIM, EMBEDDER_ID
+from simple_vector_db import _GrowableArray, _SparseMatrix, _embed_texts, _text_features
+from simple_vector_db import _embed_parallel, _bigram_terms, _BM25Index
+from simple_vector_db import _wal_record
+import simple_vector_db
+
+
+def test_add_appends_to_log_and_reloads(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    db.add("characters", "林诗雨，主角的妹妹", {"name": "林诗雨", "chapter": 1})
+    db.add("characters", "叶尘，主角", {"name": "叶尘", "chapter": 1})
+    db.close()
+
+    # 写入只追加日志，不生成旧版 data.json
+    assert not (tmp_path / "data.json").exists()
+    assert (tmp_path / "log-000001.wal").exists()
+
+    reopened = SimpleVectorDB(str(tmp_path))
+    names = [r["metadata"]["name"] for r in reopened.get_all("characters")]
+    assert names == ["林诗雨", "叶尘"]
+    assert len(reopened._matrix) == 2
+
+
+def test_compaction_keeps_data(tmp_path):
+    db = SimpleVectorDB(str(tmp_path), compact_min_ops=4)
+    for i in range(10):
+        db.add("chapters", f"第{i}章 摘要", {"chapter": i})
+    db.delete("chapters", metadata={"chapter": 3})
+    db.close()
+
+    assert db.generation > 1
+    reopened = SimpleVectorDB(str(tmp_path))
+    chapters = [r["metadata"]["chapter"] for r in reopened.get_all("chapters")]
+    assert chapters == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert len(reopened._matrix) == 9
+
+
+def test_recovers_from_torn_log_tail(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    db.add("world", "等级体系", {"name": "等级"})
+    db.add("world", "势力分布", {"name": "势力"})
+    db.close()
+
+    # 模拟崩溃：最后一条记录只写了一半
+    log = tmp_path / "log-000001.wal"
+    size = log.stat().st_size
+    record = _wal_record([{"op": "add", "entry": {"collection": "world"}}])
+    with open(log, "ab") as f:
+        f.write(record[:-5])
+
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert len(reopened.data) == 2
+    assert len(reopened._matrix) == 2
+    assert log.stat().st_size == size
+
+    reopened.add("world", "地理设定", {"name": "地理"})
+    reopened.close()
+    assert len(SimpleVectorDB(str(tmp_path)).get_all("world")) == 3
+
+    # 校验失败的记录及其之后的内容都丢弃
+    data = bytearray(log.read_bytes())
+    data[size + 20] ^= 0xFF
+    log.write_bytes(bytes(data))
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert [r["document"] for r in reopened.get_all("world")] == [
+        "等级体系",
+        "势力分布",
+    ]
+    assert log.stat().st_size == size
+
+
+def test_opens_legacy_format_read_only(tmp_path):
+    legacy = SimpleVectorDB(str(tmp_path / "scratch"))
+    vector = legacy._get_embedding("林诗雨")
+    entry = {
+        "collection": "characters",
+        "document": "林诗雨",
+        "metadata": {"name": "林诗雨"},
+        "timestamp": "2026-02-17T20:22:22",
+    }
+    with open(tmp_path / "data.json", "w", encoding="utf-8") as f:
+        json.dump([entry], f, ensure_ascii=False, indent=2)
+    np.save(tmp_path / "vectors.npy", vector.reshape(1, -1))
+    before = (tmp_path / "data.json").read_bytes()
+
+    db = SimpleVectorDB(str(tmp_path))
+    assert db.get_all("characters")[0]["document"] == "林诗雨"
+    assert not (tmp_path / "CURRENT").exists()
+
+    # 首次写入迁移为快照，旧文件保持不变
+    db.add("characters", "叶尘", {"name": "叶尘"})
+    db.close()
+    assert (tmp_path / "data.json").read_bytes() == before
+    assert len(SimpleVectorDB(str(tmp_path)).get_all("characters")) == 2
+
+
+def test_add_many_matches_single_adds(tmp_path):
+    docs = ["等级体系：F到SSS", "势力分布：超管局", "地理设定：江城"]
+    metas = [{"name": "等级"}, {"name": "势力"}, {"name": "地理"}]
+
+    single = SimpleVectorDB(str(tmp_path / "single"))
+    ids = [single.add("world", d, m) for d, m in zip(docs, metas)]
+
+    batch = SimpleVectorDB(str(tmp_path / "batch"))
+    assert batch.add_many("world", docs, metas) == ids
+    np.testing.assert_array_equal(
+        batch._matrix.to_dense(range(3)), single._matrix.to_dense(range(3))
+    )
+    batch.close()
+
+    reopened = SimpleVectorDB(str(tmp_path / "batch"))
+    assert [r["metadata"]["name"] for r in reopened.get_all("world")] == [
+        "等级",
+        "势力",
+        "地理",
+    ]
+
+
+def test_bulk_load_uses_collection_metadata(tmp_path):
+    db = NovelVectorDB(str(tmp_path))
+    ids = db.bulk_load(
+        "characters",
+        [
+            {"name": "叶尘", "content": "主角", "chapter": 1, "role": "主角"},
+            {"name": "王腾", "content": "反派", "chapter": 5, "role": "反派"},
+        ],
+    )
+
+    assert ids == [0, 1]
+    assert db.get_character_by_chapter(5)[0]["metadata"] == {
+        "type": "character",
+        "name": "王腾",
+        "chapter": 5,
+        "role": "反派",
+    }
+    with pytest.raises(ValueError):
+        db.bulk_load("unknown", [])
+
+
+def test_growable_array_grows_geometrically():
+    array = _GrowableArray((2,))
+    reallocations = 0
+    for i in range(1000):
+        capacity = array.capacity
+        array.extend([[i, i]])
+        reallocations += array.capacity != capacity
+
+    assert len(array) == 1000
+    assert reallocations <= 8
+    np.testing.assert_array_equal(array.view[:, 0], np.arange(1000))
+
+
+def test_growable_array_delete_in_place():
+    array = _GrowableArray((), dtype=np.int64, data=np.arange(10))
+    array.delete([0, 3, 4, 9])
+    np.testing.assert_array_equal(array.view, [1, 2, 5, 6, 7, 8])
+
+    array.extend([10])
+    np.testing.assert_array_equal(array.view, [1, 2, 5, 6, 7, 8, 10])
+
+
+def test_search_matches_brute_force(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    docs = ["妹妹林诗雨", "主角叶尘", "妹妹的血脉", "反派王腾", "江城大学", "妹妹"]
+    db.add_many("characters", docs + docs, [{"i": i} for i in range(12)])
+    db.add("world", "妹妹妹妹", {})
+
+    query = db._get_embedding("妹妹")
+    expected = []
+    for i, entry in enumerate(db.data):
+        if entry["collection"] != "characters":
+            continue
+        v = db._matrix.to_dense([i])[0]
+        norm = np.linalg.norm(v) * np.linalg.norm(query)
+        expected.append((i, float(v @ query / norm) if norm else 0.0))
+    expected.sort(key=lambda x: x[1], reverse=True)
+
+    results = db.search("characters", "妹妹", n=5)
+    assert [r["id"] for r in results] == [i for i, _ in expected[:5]]
+    assert [r["score"] for r in results] == pytest.approx([s for _, s in expected[:5]])
+    assert db.search("characters", "妹妹", n=100)[-1]["id"] == expected[-1][0]
+
+
+def test_collection_index_follows_deletes(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    db.add_many(
+        "chapters", ["第1章", "第2章", "第3章"], [{"chapter": i} for i in (1, 2, 3)]
+    )
+    db.add_many("world", ["等级体系", "势力分布"], [{"name": "等级"}, {"name": "势力"}])
+    db.add("chapters", "第4章", {"chapter": 4})
+
+    db.delete("chapters", metadata={"chapter": 2})
+    assert [r["id"] for r in db.get_all("chapters")] == [0, 2, 5]
+    assert [r["document"] for r in db.get_all("world")] == ["等级体系", "势力分布"]
+    assert db.search("chapters", "第4章", n=1)[0]["metadata"] == {"chapter": 4}
+
+    db.close()
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert [r["id"] for r in reopened.get_all("chapters")] == [0, 2, 5]
+    assert reopened._rows("reviews").tolist() == []
+
+    # 压缩后行号平移，id 不变
+    reopened.compact()
+    assert reopened._rows("chapters").tolist() == [0, 1, 4]
+    assert reopened._rows("world").tolist() == [2, 3]
+    assert [r["id"] for r in reopened.get_all("chapters")] == [0, 2, 5]
+
+
+def test_metadata_index_lookups(tmp_path):
+    db = SimpleVectorDB(str(tmp_path), indexed_fields={"reviews": ["issues"]})
+    db.add_many(
+        "reviews",
+        ["通过", "退回", "通过"],
+        [
+            {"chapter": 1, "result": "pass", "issues": []},
+            {"chapter": 2, "result": "fail", "issues": ["节奏"]},
+            {"chapter": 3, "result": "pass", "issues": []},
+        ],
+    )
+    db.add("chapters", "第2章", {"chapter": 2})
+
+    assert [r["id"] for r in db.get_by_metadata("reviews", {"chapter": 2})] == [1]
+    assert [r["id"] for r in db.get_by_metadata("reviews", {"issues": []})] == [0, 2]
+    assert [
+        r["id"] for r in db.get_by_metadata("reviews", {"chapter": 3, "result": "pass"})
+    ] == [2]
+    assert db.get_by_metadata("reviews", {"chapter": 3, "result": "fail"}) == []
+
+    # 索引建立后的新增、删除同样可见
+    db.add("reviews", "通过", {"chapter": 2, "result": "pass", "issues": []})
+    assert [r["id"] for r in db.get_by_metadata("reviews", {"chapter": 2})] == [1, 4]
+    db.delete("reviews", metadata={"chapter": 1})
+    assert [r["id"] for r in db.get_by_metadata("reviews", {"chapter": 2})] == [1, 4]
+    results = db.search("reviews", "通过", filter_metadata={"chapter": 2})
+    assert sorted(r["id"] for r in results) == [1, 4]
+
+
+def test_range_queries(tmp_path):
+    db = NovelVectorDB(str(tmp_path))
+    for chapter in (3, 1, 5, 2, 4):
+        db.add_chapter_summary(chapter, f"第{chapter}章", {"title": str(chapter)})
+
+    assert [r["metadata"]["chapter"] for r in db.get_chapters_between(2, 4)] == [
+        2,
+        3,
+        4,
+    ]
+    assert [r["metadata"]["chapter"] for r in db.get_recent_chapters(2)] == [5, 4]
+
+    db.add_chapter_summary(6, "第6章", {"title": "6"})
+    assert [r["metadata"]["chapter"] for r in db.get_recent_chapters(2)] == [6, 5]
+
+    db.add_foreshadowing("血脉", "青龙血脉", 1, 30)
+    db.add_foreshadowing("阴谋", "深渊之门", 10, 50)
+    assert [fs["metadata"]["name"] for fs in db.get_foreshadowing_by_chapter(30)] == [
+        "血脉"
+    ]
+    assert [
+        fs["metadata"]["name"] for fs in db.get_foreshadowing_embedded_between(5, 20)
+    ] == ["阴谋"]
+
+
+def test_sparse_matrix_matches_dense():
+    rng = np.random.default_rng(0)
+    dense = rng.integers(0, 3, size=(6, EMBEDDING_DIM)) * (
+        rng.random((6, EMBEDDING_DIM)) < 0.001
+    )
+    dense[2] = 0
+    matrix = _SparseMatrix.from_dense(dense)
+    query = rng.random(EMBEDDING_DIM)
+
+    assert len(matrix.values) == np.count_nonzero(dense)
+    np.testing.assert_allclose(matrix.dot(range(6), query), dense @ query)
+    np.testing.assert_allclose(matrix.dot([5, 0, 2], query), dense[[5, 0, 2]] @ query)
+    np.testing.assert_allclose(matrix.norms.view, np.linalg.norm(dense, axis=1))
+
+    matrix.delete([0, 3])
+    np.testing.assert_array_equal(matrix.to_dense(range(4)), dense[[1, 2, 4, 5]])
+
+
+@pytest.mark.parametrize("dtype", ["float64", "int8"])
+def test_column_index_matches_row_dot(tmp_path, monkeypatch, dtype):
+    monkeypatch.setattr(simple_vector_db, "COLUMN_INDEX_MIN_NNZ", 1)
+    calls = []
+    dot_columns = _SparseMatrix._dot_columns
+    monkeypatch.setattr(
+        _SparseMatrix,
+        "_dot_columns",
+        lambda self, *args: calls.append(len(args[1])) or dot_columns(self, *args),
+    )
+    rng = np.random.default_rng(0)
+    columns = rng.choice(EMBEDDING_DIM, 40, replace=False)
+
+    def random_rows(count):
+        dense = np.zeros((count, EMBEDDING_DIM))
+        dense[:, columns] = rng.integers(0, 4, size=(count, len(columns)))
+        return dense
+
+    matrix = _SparseMatrix.from_dense(random_rows(50), dtype=dtype)
+    queries = np.zeros((EMBEDDING_DIM, 3))
+    queries[columns[:3], 0] = 1.0
+    queries[columns[5:7], 1] = [2.0, 0.5]
+    queries[columns[-1], 2] = 1.0
+    rows = rng.permutation(50)
+    np.testing.assert_allclose(
+        matrix.dot(rows, queries), matrix.to_dense(rows) @ queries
+    )
+    assert calls == [50]
+
+    # 建立副本之后追加和替换的行按行计算
+    tail = random_rows(3)
+    tail_rows, tail_columns = np.nonzero(tail)
+    indptr = np.searchsorted(tail_rows, np.arange(4))
+    matrix.append(indptr, tail_columns, tail[tail_rows, tail_columns])
+    replaced = random_rows(1)[0]
+    matrix.replace(7, np.flatnonzero(replaced), replaced[replaced != 0])
+    rows = rng.permutation(53)
+    expected = matrix.to_dense(rows) @ queries
+    np.testing.assert_allclose(matrix.dot(rows, queries), expected)
+    np.testing.assert_allclose(matrix.dot(rows, queries[:, 1]), expected[:, 1])
+    assert calls == [50, 53, 53]
+
+    # 快照连同按列副本一起写出
+    matrix.save(str(tmp_path / "m"))
+    loaded = _SparseMatrix.load(str(tmp_path / "m"), dtype=dtype)
+    assert loaded._columns.size == 53
+    np.testing.assert_allclose(loaded.dot(rows, queries), expected)
+
+    matrix.delete([0, 1])
+    assert matrix._columns is None
+    rows = np.arange(51)
+    np.testing.assert_allclose(
+        matrix.dot(rows, queries), matrix.to_dense(rows) @ queries
+    )
+    assert len(calls) == 5
+
+
+def test_embedding_is_stable_across_processes(tmp_path):
+    code = (
+        "import sys; sys.path.insert(0, %r);"
+        "from simple_vector_db import SimpleVectorDB;"
+        "v = SimpleVectorDB(%r)._get_embedding('林诗雨是主角的妹妹');"
+        "print(v.nonzero()[0].tolist())"
+    ) % (os.path.dirname(os.path.dirname(os.path.abspath(__file__))), str(tmp_path))
+
+    outputs = set()
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(
+            subprocess.run(
+                [sys.executable, "-c", code], env=env, capture_output=True, text=True
+            ).stdout
+        )
+    assert len(outputs) == 1
+
+
+def test_embedder_mismatch_triggers_reembed(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    db.add_many("characters", ["林诗雨，主角的妹妹", "叶尘，主角"])
+    db.compact()
+    db.close()
+
+    meta = tmp_path / f"snapshot-{db.generation:06d}.meta.json"
+    meta.write_text(json.dumps({"embedder": "old"}))
+    # 模拟旧算法写入的向量
+    np.save(tmp_path / f"snapshot-{db.generation:06d}.values.npy", np.zeros(0))
+    np.save(tmp_path / f"snapshot-{db.generation:06d}.indptr.npy", np.zeros(3))
+    np.save(tmp_path / f"snapshot-{db.generation:06d}.indices.npy", np.zeros(0))
+
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert reopened.search("characters", "主角的妹妹", n=1)[0]["id"] == 0
+    assert reopened._embedder_id == EMBEDDER_ID
+
+    current = SimpleVectorDB(str(tmp_path))
+    assert current._embedder_id == EMBEDDER_ID
+    assert len(current._matrix.values) > 0
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32", "int8"])
+def test_vector_dtypes_round_trip(tmp_path, dtype):
+    docs = [
+        "林诗雨，主角的妹妹，隐藏青龙血脉",
+        "叶尘，主角，时空之刃" * 60,
+        "王腾，反派",
+    ]
+    db = SimpleVectorDB(str(tmp_path), vector_dtype=dtype)
+    db.add_many("characters", docs)
+    expected = SimpleVectorDB(str(tmp_path / "exact"), vector_dtype="float64")
+    expected.add_many("characters", docs)
+
+    db.compact()
+    db.close()
+    reopened = SimpleVectorDB(str(tmp_path), vector_dtype=dtype)
+
+    # 快照以只读内存映射打开
+    assert not reopened._matrix.values.view.flags.writeable
+    assert reopened._matrix.values.view.dtype == np.dtype(dtype)
+    results = reopened.search("characters", "主角的妹妹", n=3)
+    exact = expected.search("characters", "主角的妹妹", n=3)
+    assert [r["id"] for r in results] == [r["id"] for r in exact]
+    assert [r["score"] for r in results] == pytest.approx(
+        [r["score"] for r in exact], abs=0.02
+    )
+
+    # 写入时才复制到内存
+    reopened.add("characters", "苏雨晴，女配")
+    assert len(reopened._matrix) == 4
+
+
+def test_int8_quantization_is_exact_for_small_counts():
+    matrix = _SparseMatrix(dtype="int8")
+    matrix.append([0, 3, 5], [1, 2, 3, 4, 5], [1.0, 2.0, 127.0, 4.0, 254.0])
+
+    np.testing.assert_array_equal(matrix.scales.view, [1.0, 2.0])
+    dense = matrix.to_dense([0, 1])
+    assert dense[0, [1, 2, 3]].tolist() == [1.0, 2.0, 127.0]
+    assert dense[1, [4, 5]].tolist() == [4.0, 254.0]
+
+
+def _topic_documents(count, topics=8, seed=0):
+    rng = np.random.default_rng(seed)
+    chars = "叶尘林诗雨苏晴王腾江城燕京昆仑超能进化系统时空之刃血脉觉醒黑暗议会深渊之门"
+    vocab = [rng.choice(list(chars), 6, replace=False) for _ in range(topics)]
+    return [
+        "".join(rng.choice(vocab[i % topics], 40)) + f"第{i}段" for i in range(count)
+    ]
+
+
+def test_ann_search_matches_exact(tmp_path):
+    documents = _topic_documents(300)
+    db = SimpleVectorDB(str(tmp_path), ivf_min_rows=64)
+    db.add_many("paragraphs", documents[:200])
+    for document in documents[200:]:
+        db.add("paragraphs", document, {"chapter": 1})
+
+    ivf = db._ivf["paragraphs"]
+    assert ivf.assigned == 300
+    assert sorted(np.concatenate([l.view for l in ivf.lists])) == list(range(300))
+
+    hits = 0
+    for query in documents[::30]:
+        exact = {r["id"] for r in db.search("paragraphs", query[:20], n=5)}
+        approx = db.search("paragraphs", query[:20], n=5, exact=False)
+        assert len(approx) == 5
+        hits += len(exact & {r["id"] for r in approx})
+    assert hits / 50 >= 0.8
+
+    # 过滤条件在候选行上生效，候选不足时退回精确搜索
+    filtered = db.search(
+        "paragraphs",
+        documents[0][:20],
+        n=3,
+        exact=False,
+        filter_metadata={"chapter": 1},
+    )
+    assert len(filtered) == 3
+    assert all(r["metadata"] == {"chapter": 1} for r in filtered)
+
+
+def test_ann_index_persists_and_follows_deletes(tmp_path):
+    documents = _topic_documents(200)
+    db = SimpleVectorDB(str(tmp_path), ivf_min_rows=64)
+    db.add_many("paragraphs", documents)
+    db.compact()
+    db.delete("paragraphs", document_id=0)
+    db.add("paragraphs", documents[0])
+    db.close()
+    assert (tmp_path / f"snapshot-{db.generation:06d}.ivf.npz").exists()
+
+    reopened = SimpleVectorDB(str(tmp_path), ivf_min_rows=64)
+    ivf = reopened._ivf["paragraphs"]
+    np.testing.assert_array_equal(ivf.centroids, db._ivf["paragraphs"].centroids)
+    # 快照中的 200 行已归簇，新增的一行在查询时归簇，已删除的行被跳过
+    assert ivf.assigned == 200
+
+    results = reopened.search("paragraphs", documents[0], n=1, exact=False)
+    assert results[0]["id"] == 200
+    assert ivf.assigned == 201
+
+    reopened.compact()
+    rows = sorted(np.concatenate([l.view for l in ivf.lists]))
+    assert rows == list(range(200))
+
+
+def test_delete_keeps_ids_stable(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    ids = db.add_many("chapters", [f"第{i}章" for i in range(6)])
+    assert ids == list(range(6))
+
+    db.delete("chapters", document_id=1)
+    db.delete("world", document_id=2)  # 不属于该 collection，忽略
+    db.delete("chapters", document_id=1)  # 重复删除，忽略
+    db.delete("chapters", metadata={})
+    assert [r["id"] for r in db.get_all("chapters")] == [0, 2, 3, 4, 5]
+    assert db._dead == 1 and len(db.data) == 6
+
+    db.compact()
+    assert db._dead == 0 and len(db.data) == 5
+    db.delete("chapters", document_id=5)
+    db.close()
+
+    # id 单调递增，删除最大的 id 之后也不会复用
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert [r["id"] for r in reopened.get_all("chapters")] == [0, 2, 3, 4]
+    assert reopened.add("chapters", "第6章") == 6
+    reopened.compact()
+    reopened.close()
+    assert SimpleVectorDB(str(tmp_path)).add("chapters", "第7章") == 7
+
+
+def test_update_metadata_moves_index_entries(tmp_path):
+    db = NovelVectorDB(str(tmp_path))
+    db.add_foreshadowing("玉佩", "神秘玉佩", 1, 30)
+    db.add_foreshadowing("血脉", "觉醒血脉", 2, 50)
+    vectors = db.db._matrix.to_dense([0, 1])
+
+    # 先建立索引，再更新
+    assert len(db.get_active_foreshadowing()) == 2
+    assert len(db.get_foreshadowing_by_chapter(30)) == 1
+    db.recover_foreshadowing("玉佩", 12)
+
+    assert [fs["metadata"]["name"] for fs in db.get_active_foreshadowing()] == ["血脉"]
+    assert db.get_foreshadowing_by_chapter(30) == []
+    assert [fs["id"] for fs in db.get_foreshadowing_by_chapter(12)] == [0]
+    assert [
+        fs["metadata"]["name"]
+        for fs in db.db.get_by_range("foreshadowing", "recover_chapter", 10, 60)
+    ] == ["玉佩", "血脉"]
+    # 元数据更新不改变向量
+    np.testing.assert_array_equal(db.db._matrix.to_dense([0, 1]), vectors)
+    assert db.db.update_metadata(99, {"status": "recovered"}) is False
+    db.db.close()
+
+    reopened = NovelVectorDB(str(tmp_path))
+    recovered = reopened.db.get_by_metadata("foreshadowing", {"status": "recovered"})
+    assert [fs["metadata"]["recover_chapter"] for fs in recovered] == [12]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_update_document_reembeds_one_row(tmp_path, dtype):
+    db = SimpleVectorDB(str(tmp_path), vector_dtype=dtype, ivf_min_rows=8)
+    ids = db.add_many("world", [f"设定{i}：等级体系" for i in range(20)])
+    assert db.update_document(ids[3], "昆仑深渊之门的封印")
+
+    fresh = SimpleVectorDB(str(tmp_path / "fresh"), vector_dtype=dtype)
+    fresh.add_many("world", [e["document"] for e in db.data])
+    np.testing.assert_allclose(
+        db._matrix.to_dense(range(20)), fresh._matrix.to_dense(range(20))
+    )
+    np.testing.assert_allclose(db._matrix.norms.view, fresh._matrix.norms.view)
+
+    for exact in (True, False):
+        top = db.search("world", "深渊之门", n=1, exact=exact)[0]
+        assert top["id"] == ids[3]
+    db.close()
+
+    # 重放日志时按更新后的正文重新计算向量
+    reopened = SimpleVectorDB(str(tmp_path), vector_dtype=dtype)
+    np.testing.assert_allclose(
+        reopened._matrix.to_dense(range(20)), fresh._matrix.to_dense(range(20))
+    )
+    assert reopened.search("world", "深渊之门", n=1)[0]["id"] == ids[3]
+
+
+def test_embedding_cache_hits_and_persists(tmp_path):
+    db = SimpleVectorDB(
+        str(tmp_path), embedding_cache_size=2, persist_embedding_cache=True
+    )
+    db.add("characters", "叶尘，主角")
+    db.add_many("characters", ["林诗雨", "苏晴"])
+    # 写入的文档不进入缓存
+    assert db.embedding_cache_info()["size"] == 0
+    db.search("characters", "妹妹")
+    db.search("characters", "妹妹")
+    assert db.embedding_cache_info() == {
+        "hits": 1,
+        "misses": 1,
+        "size": 1,
+        "maxsize": 2,
+    }
+
+    # 命中缓存与重新计算的结果一致
+    cached = db._get_embeddings(["妹妹", "叶尘，主角", "林诗雨"])
+    computed = db._compute_embeddings(["妹妹", "叶尘，主角", "林诗雨"])
+    for a, b in zip(cached, computed):
+        np.testing.assert_array_equal(a, b)
+
+    # 容量为 2，最久未用的「妹妹」被淘汰
+    db.close()
+    assert (tmp_path / "embedding_cache.npz").exists()
+    reopened = SimpleVectorDB(
+        str(tmp_path), embedding_cache_size=2, persist_embedding_cache=True
+    )
+    reopened.search("characters", "林诗雨")
+    reopened.search("characters", "叶尘，主角")
+    reopened.search("characters", "妹妹")
+    assert reopened.embedding_cache_info()["hits"] == 2
+    assert reopened.embedding_cache_info()["misses"] == 1
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 256])
+def test_batch_embedding_matches_per_text_counts(chunk_size):
+    texts = ["", "叶", "叶尘", "叶尘叶尘", "abc abc", "林诗雨" * 2000, "主角的妹妹"]
+    indptr, indices, values = _embed_texts(texts, chunk_size)
+
+    for i, text in enumerate(texts):
+        # n-gram 不跨越文档边界
+        expected = np.bincount(_text_features(text), minlength=EMBEDDING_DIM)
+        row = np.zeros(EMBEDDING_DIM)
+        row[indices[indptr[i] : indptr[i + 1]]] = values[indptr[i] : indptr[i + 1]]
+        np.testing.assert_array_equal(row, expected)
+        assert np.all(np.diff(indices[indptr[i] : indptr[i + 1]]) > 0)
+
+
+@pytest.mark.parametrize("dtype", ["float64", "int8"])
+def test_search_many_matches_single_searches(tmp_path, dtype):
+    db = SimpleVectorDB(str(tmp_path), vector_dtype=dtype)
+    db.add_many(
+        "world",
+        ["等级体系：炼气筑基", "势力分布：昆仑", "", "血脉觉醒", "深渊之门"],
+        [{"category": c} for c in ("等级", "势力", "势力", "血脉", "势力")],
+    )
+    queries = ["昆仑势力", "", "血脉", "不存在的词"]
+
+    for filter_metadata in (None, {"category": "势力"}):
+        batched = db.search_many("world", queries, n=2, filter_metadata=filter_metadata)
+        assert batched == [
+            db.search("world", q, n=2, filter_metadata=filter_metadata) for q in queries
+        ]
+    assert db.search_many("world", []) == []
+    assert db.search_many("reviews", queries) == [[], [], [], []]
+
+
+def test_parallel_ingest_matches_serial(tmp_path):
+    documents = [f"第{i}段：" + "叶尘林诗雨" * (i % 7) for i in range(40)] + [""]
+    # 全是 ASCII 的文本非零元素最多，检验共享内存按上界分配足够
+    documents += ["".join(chr(33 + (i * 7) % 90) for i in range(300)), "", ""]
+    shm_dir = "/dev/shm"
+    before = set(os.listdir(shm_dir)) if os.path.isdir(shm_dir) else set()
+    serial = _embed_texts(documents)
+    parallel = _embed_parallel(documents, workers=2, shard_size=7)
+    for a, b in zip(serial, parallel):
+        np.testing.assert_array_equal(a, b)
+        assert a.dtype == b.dtype
+    # 主进程释放了全部分片的共享内存
+    if os.path.isdir(shm_dir):
+        assert set(os.listdir(shm_dir)) <= before
+
+    db = NovelVectorDB(str(tmp_path))
+    ids = db.bulk_load(
+        "world",
+        [
+            {"name": str(i), "content": d, "category": "设定"}
+            for i, d in enumerate(documents)
+        ],
+        workers=2,
+    )
+    assert ids == list(range(len(documents)))
+    np.testing.assert_array_equal(db.db._matrix.indptr.view, serial[0])
+    assert db.search_world(documents[13], n=1)[0]["metadata"]["name"] == "13"
+
+
+def test_chapter_passages_index_and_reindex(tmp_path):
+    chapters = tmp_path / "chapters"
+    chapters.mkdir()
+    paragraphs = [f"第{i}段：叶尘在昆仑修炼。" for i in range(5)]
+    (chapters / "chapter-01.md").write_text(
+        "---\nchapter: 1\n---\n" + "\n\n".join(paragraphs) + "\n", encoding="utf-8"
+    )
+    (chapters / "chapter-02.md").write_text(
+        "林诗雨来到燕京。\n黑暗议会现身。\n", encoding="utf-8"
+    )
+
+    db = NovelVectorDB(str(tmp_path / "db"))
+    assert db.index_chapter_dir(chapters, window=4, overlap=1) == {1: 2, 2: 1}
+
+    passages = db.db.get_by_metadata("passages", {"chapter": 1})
+    assert [p["metadata"]["paragraph"] for p in passages] == [0, 3]
+    assert passages[1]["document"] == "\n".join(paragraphs[3:])
+    text = (chapters / "chapter-01.md").read_text(encoding="utf-8")
+    offset = passages[1]["metadata"]["offset"]
+    assert text[offset:].startswith(paragraphs[3])
+
+    groups = db.search_passages("林诗雨 燕京", n=1)
+    assert groups[0]["chapter"] == 2
+    assert groups[0]["passages"][0]["metadata"]["offset"] == 0
+
+    # 未变化的章节跳过，变化的章节重建
+    assert db.index_chapter_dir(chapters, window=4, overlap=1) == {1: 0, 2: 0}
+    (chapters / "chapter-02.md").write_text("苏晴觉醒血脉。\n", encoding="utf-8")
+    assert db.index_chapter_file(2, chapters / "chapter-02.md") == 1
+    assert [
+        p["document"] for p in db.db.get_by_metadata("passages", {"chapter": 2})
+    ] == ["苏晴觉醒血脉。"]
+    with pytest.raises(ValueError):
+        db.index_chapter_file(2, chapters / "chapter-02.md", window=2, overlap=2)
+
+
+def test_bm25_segments_match_brute_force():
+    rng = np.random.default_rng(3)
+    chars = list("叶尘林诗雨昆仑燕京血脉AB1，。 ")
+    texts = ["".join(rng.choice(chars, rng.integers(0, 30))) for _ in range(60)]
+
+    index = _BM25Index()
+    for start in range(0, 60, 7):
+        index.add(np.arange(start, min(start + 7, 60)), texts[start : start + 7])
+    assert len(index.segments) < 9
+
+    def tokens(text):
+        doc_ids, terms = _bigram_terms([text])
+        return terms.tolist()
+
+    docs = [tokens(t) for t in texts]
+    average = sum(map(len, docs)) / len(docs)
+    query = tokens("叶尘在昆仑ab")
+    assert query[-1] == ord("a") * 0x110000 + ord("b")
+
+    expected = {}
+    for term in set(query):
+        df = sum(term in d for d in docs)
+        idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5))
+        for row, d in enumerate(docs):
+            tf = d.count(term)
+            if tf:
+                norm = 1.2 * (1 - 0.75 + 0.75 * len(d) / average)
+                expected[row] = expected.get(row, 0) + idf * tf * 2.2 / (tf + norm)
+
+    rows, scores = index.scores(query)
+    assert rows.tolist() == sorted(expected)
+    np.testing.assert_allclose(scores, [expected[r] for r in sorted(expected)])
+
+
+def test_hybrid_search_finds_names(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    filler = ["修炼", "夜色", "山门", "风雪"]
+    db.add_many(
+        "characters",
+        [f"{filler[i % 4]}之中，弟子{i}独自前行。" for i in range(200)]
+        + ["林诗雨，主角的妹妹", "叶尘，主角，昆仑传人"],
+        [{"role": "配角"}] * 200 + [{"role": "配角"}, {"role": "主角"}],
+    )
+
+    results = db.search("characters", "叶尘", n=3, mode="hybrid")
+    assert [r["document"] for r in results] == ["叶尘，主角，昆仑传人"]
+    assert db.search(
+        "characters", "林诗雨", n=1, mode="hybrid", filter_metadata={"role": "主角"}
+    ) == db.search("characters", "林诗雨", n=1, filter_metadata={"role": "主角"})
+
+    # 没有二元组或没有命中时退回向量搜索
+    for query in ("叶", "不存在的词"):
+        assert db.search("characters", query, mode="hybrid") == db.search(
+            "characters", query
+        )
+
+    # 新增、修改、删除后索引同步
+    new_id = db.add("characters", "苏晴，叶尘的师姐", {"role": "配角"})
+    assert len(db.search("characters", "叶尘", n=3, mode="hybrid")) == 2
+    db.update_document(new_id, "苏晴，昆仑弟子")
+    db.delete("characters", document_id=201)
+    assert db.search("characters", "叶尘", mode="hybrid") == db.search(
+        "characters", "叶尘"
+    )
+    db.compact()
+    results = db.search("characters", "苏晴", n=3, mode="hybrid")
+    assert [r["id"] for r in results] == [new_id]
+
+    with pytest.raises(ValueError):
+        db.search("characters", "叶尘", mode="bm25")
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_columnar_records_round_trip(tmp_path, mmap):
+    db = SimpleVectorDB(str(tmp_path), mmap=mmap)
+    metadatas = [
+        {"name": "叶尘", "chapter": 3, "role": "主角"},
+        {"chapter": "序章"},
+        {"chapter": True},
+        {"chapter": 1 << 70, "tags": ["a", {"b": 1}]},
+        {},
+        {"name": "林诗雨", "chapter": 3},
+    ]
+    db.add_many("characters", [f"第{i}条\n正文" for i in range(6)], metadatas)
+    db.add("world", "", {"category": "设定"})
+    db.data[4]["timestamp"] = "2026-01-01T00:00:00"
+    del db.data[5]["timestamp"]
+    db.data[3]["extra"] = {"x": None}
+    db.delete("characters", document_id=2)
+    expected = [dict(e) for e in db.data if e["id"] != 2]
+    db.compact()
+    db.close()
+
+    reopened = SimpleVectorDB(str(tmp_path), mmap=mmap)
+    # 打开时不解码任何记录，chapter 查询只读列
+    assert not reopened.data._decoded
+    rows = reopened._match_rows("characters", {"chapter": 3})
+    assert [reopened.data[i]["metadata"]["name"] for i in rows] == ["叶尘", "林诗雨"]
+    assert len(reopened.data._decoded) == 2
+    assert [r["id"] for r in reopened.get_by_range("characters", "chapter", 0)] == [
+        0,
+        5,
+        3,
+    ]
+
+    assert list(reopened.data) == expected
+    assert list(reopened.data[0]["metadata"]) == ["name", "chapter", "role"]
+
+    # 修改过的解码行和新增行在下次压缩时写回
+    reopened.update_metadata(0, {"chapter": 4})
+    reopened.add("characters", "苏晴", {"chapter": 9})
+    reopened.compact()
+    reopened.close()
+    again = SimpleVectorDB(str(tmp_path), mmap=mmap)
+    chapters = [r["metadata"].get("chapter") for r in again.get_all("characters")]
+    assert chapters == [4, "序章", 1 << 70, None, 3, 9]
+
+
+def test_wal_group_commit_and_atomic_reset(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+
+    db = SimpleVectorDB(str(tmp_path), sync_interval=3600)
+    db.add("world", "等级体系")
+    log_fd = db._log_fp.fileno()
+    synced.clear()
+    for i in range(20):
+        db.add("world", f"设定{i}")
+    # 间隔内的写入不 fsync，关闭时一次落盘
+    assert synced == []
+    db.close()
+    assert synced == [log_fd]
+
+    db = SimpleVectorDB(str(tmp_path), sync_interval=0)
+    db.add("world", "势力分布")
+    synced.clear()
+    db.add_many("world", ["地理", "血脉", "功法"])
+    assert synced == [db._log_fp.fileno()]
+
+    (tmp_path / "data.json").write_text("[]")
+    db.reset()
+    assert not (tmp_path / "data.json").exists()
+    assert (tmp_path / "CURRENT").read_text() == str(db.generation)
+    assert not list(tmp_path.glob("log-*"))
+    db.add("world", "新设定")
+    db.close()
+    assert [r["id"] for r in SimpleVectorDB(str(tmp_path)).get_all("world")] == [0]
+
+
+def test_deferred_fsync_runs_by_deadline(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+
+    db = SimpleVectorDB(str(tmp_path), sync_interval=0.2)
+    db.add("world", "等级体系")
+    log_fd = db._log_fp.fileno()
+    synced.clear()
+    for i in range(5):
+        db.add("world", f"设定{i}")
+    assert synced == []
+
+    # 之后没有任何写入，推迟的 fsync 也在截止时间由定时器完成
+    db._sync_timer.join(5)
+    assert synced == [log_fd]
+    assert not db._unsynced and db._sync_timer is None
+
+    # sync() 取消等待中的定时器
+    db.add("world", "势力分布")
+    timer = db._sync_timer
+    db.sync()
+    timer.join(5)
+    assert synced == [log_fd, log_fd]
+    db.close()
+    assert synced == [log_fd, log_fd]
+
+
+def test_novel_db_close_syncs_deferred_writes(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+
+    with NovelVectorDB(str(tmp_path)) as db:
+        db.db.sync_interval = 3600
+        db.add_world("等级体系", "炼气、筑基、金丹", "修炼")
+        db.add_world("势力分布", "三大宗门", "势力")
+        log_fd = db.db._log_fp.fileno()
+        synced.clear()
+        db.add_world("地理", "东荒、北原", "地理")
+        # 间隔内的写入推迟 fsync
+        assert synced == []
+    # 退出 with 时落盘
+    assert synced == [log_fd]
+    assert db.db._log_fp is None
+
+
+def test_novel_db_forwards_options(tmp_path):
+    with NovelVectorDB(
+        str(tmp_path), vector_dtype="int8", persist_embedding_cache=True
+    ) as db:
+        db.add_character("叶尘", "叶尘，主角", chapter=1, role="主角")
+        db.search_characters("主角")
+        assert db.db.vector_dtype == "int8"
+    assert (tmp_path / "embedding_cache.npz").exists()
+
+    reopened = NovelVectorDB(str(tmp_path), persist_embedding_cache=True)
+    assert reopened.db.embedding_cache_info()["size"] > 0
+    reopened.close()
+
+
+def test_accepts_lone_surrogates(tmp_path):
+    db = SimpleVectorDB(str(tmp_path))
+    db.add("e", "bad\ud800x", {"name": "\udfff"})
+    assert db.search("e", "bad\ud800x", n=1, mode="hybrid")[0]["id"] == 0
+    db.close()
+
+    reopened = SimpleVectorDB(str(tmp_path))
+    assert reopened.get_all("e")[0]["document"] == "bad\ud800x"
+    reopened.compact()
+    reopened.close()
+    entry = SimpleVectorDB(str(tmp_path)).get_all("e")[0]
+    assert (entry["document"], entry["metadata"]) == ("bad\ud800x", {"name": "\udfff"})